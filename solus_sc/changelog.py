@@ -160,12 +160,21 @@ class ScUpdateObject(GObject.Object):
     # Simple, really.
     has_security_update = False
 
+    # EopkgUpgradeInfo from the upgrade table, if we have one
+    info = None
+
     __gtype_name__ = "ScUpdateObject"
 
-    def __init__(self, old_pkg, new_pkg):
+    def __init__(self, old_pkg, new_pkg, info=None):
         GObject.Object.__init__(self)
         self.old_pkg = old_pkg
         self.new_pkg = new_pkg
+        self.info = info
+
+        if self.info is not None:
+            # Already worked out for us
+            self.has_security_update = self.info.security
+            return
 
         if not self.old_pkg:
             return
@@ -180,6 +189,9 @@ class ScUpdateObject(GObject.Object):
 
     def get_update_size(self):
         """ Determine the update size for a given package """
+        if self.info is not None:
+            return self.info.size
+
         # FIXME: Check pisi config
         deltasEnabled = True
 
@@ -14,13 +14,12 @@
 from gi.repository import Gtk, GLib, GObject, GdkPixbuf, Gdk
 from .util import sc_format_size_local
 from .changelog import ScUpdateObject, ScChangelogEntry
+from .upgrades import build_upgrade_table
 from . import join_resource_path
 from . import PACKAGE_ICON_NORMAL
 from . import PACKAGE_ICON_SECURITY
 import threading
 
-import pisi.api
-
 
 class ScChangelogViewer(Gtk.Dialog):
     """ Show an overview of changes for a given update """
@@ -380,23 +379,16 @@ class ScUpdatesView(Gtk.VBox):
         self.installdb = self.basket.installdb
         self.packagedb = self.basket.packagedb
 
-        # Expand with a plan operation to be up front about new deps
-        upgrades = pisi.api.list_upgradable()
+        # One pass over the databases for every update
+        table = build_upgrade_table(self.packagedb, self.installdb)
+        upgrades = table.get_updates(self.packagedb)
         n_updates = len(upgrades)
 
-        obsol = pisi.api.list_obsoleted()
-        replc = pisi.api.list_replaces()
-        for item in sorted(upgrades):
-
-            old_item = item
-            if item in obsol:
-                if item not in replc:
-                    # No valid replacement, skip it
-                    continue
-                # Chose the replacement
-                item = replc[item][0]
+        for info in upgrades:
+            old_item = info.name
+            item = info.target
 
-            new_pkg = self.packagedb.get_package(item)
+            new_pkg = info.package
             new_version = "%s-%s" % (str(new_pkg.version),
                                      str(new_pkg.release))
             pkg_name = str(new_pkg.name)
@@ -413,7 +405,7 @@ class ScUpdatesView(Gtk.VBox):
             if self.installdb.has_package(item):
                 old_pkg = self.installdb.get_package(item)
 
-            sc_obj = ScUpdateObject(old_pkg, new_pkg)
+            sc_obj = ScUpdateObject(old_pkg, new_pkg, info)
 
             if sc_obj.is_security_update() and parent_row != row_m:
                 parent_row = row_s
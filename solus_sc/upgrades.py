@@ -0,0 +1,134 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2013-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+import pisi.blacklist
+import pisi.context
+import threading
+
+
+class EopkgUpgradeInfo:
+    """ Upgrade state of a single installed package """
+
+    # Installed package name
+    name = None
+
+    # Package we'll actually install, differs if name was replaced
+    target = None
+
+    release = None
+    installed_release = None
+
+    # Only known once the table details are loaded
+    package = None
+    security = False
+    size = 0
+
+    def __init__(self, name, target, release, installed_release):
+        self.name = name
+        self.target = target
+        self.release = release
+        self.installed_release = installed_release
+
+    def is_replaced(self):
+        return self.target != self.name
+
+
+class EopkgUpgradeTable:
+    """ EopkgUpgradeTable is the upgrade state of every installed package,
+        built once per refresh and shared by everything showing updates
+
+        releases maps each installed package name to its (available,
+        installed) release, with an available release of None for packages
+        no longer in the repos. replaces and obsoletes come straight from
+        the PackageDB. Which packages can be upgraded is fixed once built:
+        obsolete packages are upgraded to their replacement, or left alone
+        if they have none. Just like list_upgradable, blacklisted packages
+        are never upgraded.
+
+        The details only the update views need (the new package, security
+        fixes and the delta size) are loaded from the PackageDB in one pass
+        the first time something asks, and only for the upgradable packages.
+    """
+
+    key = None
+
+    # installed name -> EopkgUpgradeInfo
+    upgrades = None
+
+    details_loaded = False
+    lock = None
+
+    def __init__(self, releases, replaces, obsoletes, key=None):
+        self.key = key
+        self.upgrades = dict()
+        self.lock = threading.Lock()
+        obsoletes = set(obsoletes)
+        names = pisi.blacklist.exclude_from(list(releases),
+                                            pisi.context.const.blacklist)
+        for name in names:
+            (release, installed_release) = releases[name]
+            if name in obsoletes:
+                if name in replaces:
+                    target = str(replaces[name][0])
+                    self.upgrades[name] = EopkgUpgradeInfo(
+                        name, target, None, installed_release)
+                continue
+            if release and int(release) > int(installed_release):
+                self.upgrades[name] = EopkgUpgradeInfo(
+                    name, name, release, installed_release)
+
+    def is_upgradable(self, name):
+        return name in self.upgrades
+
+    def get(self, name):
+        """ Return the EopkgUpgradeInfo for name, or None """
+        return self.upgrades.get(name)
+
+    def get_updates(self, packagedb):
+        """ Return every available update with its details, in name order """
+        self.load_details(packagedb)
+        return [self.upgrades[x] for x in sorted(self.upgrades)]
+
+    def load_details(self, packagedb):
+        """ Fill in the new packages, security fixes and sizes """
+        with self.lock:
+            if self.details_loaded:
+                return
+            for info in self.upgrades.itervalues():
+                pkg = packagedb.get_package(info.target)
+                info.package = pkg
+                info.size = pkg.packageSize
+                if info.is_replaced():
+                    info.release = str(pkg.release)
+                    continue
+                old = int(info.installed_release)
+                info.security = any(
+                    x.type == "security" for x in pkg.history
+                    if int(x.release) > old)
+                delta = pkg.get_delta(old)
+                if delta:
+                    info.size = delta.packageSize
+            self.details_loaded = True
+
+
+def build_upgrade_table(packagedb, installdb):
+    """ Build the table straight from the pisi databases """
+    releases = dict()
+    for name in installdb.list_installed():
+        installed = installdb.get_package(name)
+        release = None
+        if packagedb.has_package(name):
+            release = str(packagedb.get_package(name).release)
+        releases[name] = (release, str(installed.release))
+    return EopkgUpgradeTable(releases, packagedb.get_replaces(),
+                             packagedb.get_obsoletes())
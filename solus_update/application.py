@@ -11,12 +11,11 @@
 #  (at your option) any later version.
 #
 
-from gi.repository import Gio, GObject, Notify, GLib
+from gi.repository import Gio, Notify, GLib
 
+from solus_sc.upgrades import build_upgrade_table
 import comar
 import pisi.db
-import pisi.api
-from operator import attrgetter
 import time
 import hashlib
 import subprocess
@@ -24,48 +23,6 @@ import subprocess
 SC_UPDATE_APP_ID = "com.solus_project.UpdateChecker"
 
 
-class ScUpdateObject(GObject.Object):
-    """ Keep glib happy and allow us to store references in a liststore """
-
-    old_pkg = None
-    new_pkg = None
-
-    # Simple, really.
-    has_security_update = False
-
-    __gtype_name__ = "ScUpdateObject"
-
-    def __init__(self, old_pkg, new_pkg):
-        GObject.Object.__init__(self)
-        self.old_pkg = old_pkg
-        self.new_pkg = new_pkg
-
-        if not self.old_pkg:
-            return
-        oldRelease = int(self.old_pkg.release)
-        histories = self.get_history_between(oldRelease, self.new_pkg)
-
-        # Initial security update detection
-        securities = [x for x in histories if x.type == "security"]
-        if len(securities) < 1:
-            return
-        self.has_security_update = True
-
-    def is_security_update(self):
-        """ Determine if the update introduces security fixes """
-        return self.has_security_update
-
-    def get_history_between(self, old_release, new):
-        """ Get the history items between the old release and new pkg """
-        ret = list()
-
-        for i in new.history:
-            if int(i.release) <= int(old_release):
-                continue
-            ret.append(i)
-        return sorted(ret, key=attrgetter('release'), reverse=True)
-
-
 # Correspond with gschema update types
 UPDATE_TYPE_ALL = 1
 UPDATE_TYPE_SECURITY = 2
@@ -244,7 +201,9 @@ class ScUpdateApp(Gio.Application):
         self.is_updating = False
         upds = None
         try:
-            upds = pisi.api.list_upgradable()
+            pdb = pisi.db.packagedb.PackageDB()
+            idb = pisi.db.installdb.InstallDB()
+            upds = build_upgrade_table(pdb, idb).get_updates(pdb)
         except:
             return
 
@@ -253,9 +212,6 @@ class ScUpdateApp(Gio.Application):
         if not upds or len(upds) < 1:
             return
 
-        idb = pisi.db.installdb.InstallDB()
-        pdb = pisi.db.packagedb.PackageDB()
-
         security_ups = []
         mandatory_ups = []
 
@@ -263,19 +219,12 @@ class ScUpdateApp(Gio.Application):
         ssz = ""
 
         for up in upds:
-            # Might be obsolete, skip it
-            if not pdb.has_package(up):
-                continue
-            candidate = pdb.get_package(up)
-            old_pkg = None
+            candidate = up.package
             ssz += str(candidate.packageHash)
-            if idb.has_package(up):
-                old_pkg = idb.get_package(up)
-            sc = ScUpdateObject(old_pkg, candidate)
-            if sc.is_security_update():
-                security_ups.append(sc)
+            if up.security:
+                security_ups.append(up)
             if candidate.partOf == "system.base":
-                mandatory_ups.append(sc)
+                mandatory_ups.append(up)
 
         pkg_hash.update(ssz)
         hx = pkg_hash.hexdigest()
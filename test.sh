@@ -5,3 +5,6 @@
 
 pycodestyle xng/*.py xng/plugins/*.py new.py || exit 1
 flake8 --builtins="_" xng/*.py xng/plugins/*.py new.py || exit 1
+pycodestyle tests/*.py || exit 1
+flake8 tests/*.py || exit 1
+PYTHONPATH=. python2 -m unittest discover -s tests || exit 1
@@ -0,0 +1,117 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves the fake server's files over keep-alive connections
+
+        /redirect/<path> redirects to <path>, and anything under /drop/ is
+        served normally but the connection is then dropped without telling
+        the client, just like a server timing out an idle connection.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.sockets.append(self.connection)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+        if self.path.startswith("/redirect/"):
+            self.send_response(302)
+            self.send_header("Location", self.path[len("/redirect"):])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        path = self.path
+        if path.startswith("/drop/"):
+            path = path[len("/drop"):]
+        entry = self.server.files.get(path)
+        if entry is None:
+            # Unlike send_error, keep the connection open
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        (body, etag) = entry
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            if etag:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        if self.path.startswith("/drop/"):
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeHttpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Local HTTP server for the tests, counting the connections made and
+        the requests served """
+
+    daemon_threads = True
+
+    # path -> (body, etag)
+    files = None
+
+    # Every connection accepted, and the paths requested
+    sockets = None
+    requests = None
+    lock = None
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           FakeHandler)
+        self.files = dict()
+        self.sockets = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        """ Stop serving and drop every open connection """
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def count_connections(self):
+        with self.lock:
+            return len(self.sockets)
+
+    def get_url(self, path):
+        return "http://127.0.0.1:{}{}".format(self.server_address[1], path)
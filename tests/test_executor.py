@@ -0,0 +1,304 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+from xng.executor import Executor
+from xng.op_journal import JournalEvent
+from xng.op_queue import OperationType
+from xng.plugins.base import ProviderPlugin, ProviderItem, ItemStatus
+from gi.repository import GLib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class FakeSettings:
+    """ Stands in for the GSettings, prefetching nothing """
+
+    def get_uint(self, key):
+        return 0
+
+
+class FakeItem(ProviderItem):
+
+    __gtype_name__ = "TestFakeItem"
+
+    id = None
+
+    def __init__(self, plugin, id, status=0):
+        ProviderItem.__init__(self)
+        self.parent_plugin = plugin
+        self.id = id
+        self.status = status
+
+    def get_id(self):
+        return self.id
+
+    def get_name(self):
+        return self.id
+
+
+class FakePlugin(ProviderPlugin):
+    """ Records every call made against it instead of touching the system
+
+        Items named in fail_on make the transaction containing them fail.
+    """
+
+    __gtype_name__ = "TestFakePlugin"
+
+    items = None
+    calls = None
+    fail_on = None
+
+    def __init__(self):
+        ProviderPlugin.__init__(self)
+        self.items = dict()
+        self.calls = []
+        self.fail_on = set()
+
+    def add(self, id, status=0):
+        self.items[id] = FakeItem(self, id, status)
+        return self.items[id]
+
+    def get_item(self, id):
+        return self.items.get(id)
+
+    def record(self, call, items):
+        ids = [x.get_id() for x in items]
+        self.calls.append((call, ids))
+        failed = self.fail_on.intersection(ids)
+        if failed:
+            raise RuntimeError("cannot {} {}".format(
+                call, ", ".join(sorted(failed))))
+
+    def install_item(self, items):
+        self.record("install", items)
+        for item in items:
+            item.add_status(ItemStatus.INSTALLED)
+
+    def remove_item(self, items):
+        self.record("remove", items)
+        for item in items:
+            item.set_status(0)
+
+    def upgrade_item(self, items):
+        self.record("upgrade", items)
+        for item in items:
+            item.set_status(ItemStatus.INSTALLED)
+
+
+class TestExecutor(unittest.TestCase):
+
+    tmpdir = None
+    plugin = None
+    executor = None
+
+    # (signal, args) in the order they were emitted
+    signals = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="sc-executor-test")
+        self.plugin = FakePlugin()
+        self.signals = []
+        self.executor = self.create_executor()
+
+    def tearDown(self):
+        self.executor.shutdown(5)
+        shutil.rmtree(self.tmpdir)
+
+    def get_journal_path(self):
+        return os.path.join(self.tmpdir, "executor.journal")
+
+    def create_executor(self):
+        executor = Executor([self.plugin], self.get_journal_path(),
+                            FakeSettings())
+        for name in ['operation-queued', 'operation-started',
+                     'operation-finished', 'busy-changed']:
+            executor.connect(name, self.on_signal, name)
+        return executor
+
+    def on_signal(self, executor, *args):
+        self.signals.append((args[-1], args[:-1]))
+
+    def pump(self):
+        """ Deliver everything the executor emitted on the main loop """
+        context = GLib.MainContext.default()
+        while context.iteration(False):
+            pass
+
+    def get_signals(self, name):
+        return [x[1] for x in self.signals if x[0] == name]
+
+    def read_journal(self):
+        self.assertTrue(self.executor.journal.flush(5))
+        with open(self.get_journal_path(), "r") as inp:
+            return [json.loads(x) for x in inp]
+
+    def test_priority_order(self):
+        """ Upgrades go before removals, which go before installs, and
+            operations of the same type keep the order they were queued """
+        first = self.plugin.add("first")
+        second = self.plugin.add("second")
+        gone = self.plugin.add("gone", ItemStatus.INSTALLED)
+        old = self.plugin.add(
+            "old", ItemStatus.INSTALLED | ItemStatus.UPDATE_NEEDED)
+
+        self.executor.install_package(first)
+        self.executor.remove_package(gone)
+        self.executor.install_package(second)
+        self.executor.upgrade_package(old)
+
+        pending = self.executor.get_pending()
+        self.assertEqual([x.data.get_id() for x in pending],
+                         ["old", "gone", "first", "second"])
+        self.assertEqual([x.opType for x in pending],
+                         [OperationType.UPGRADE, OperationType.REMOVE,
+                          OperationType.INSTALL, OperationType.INSTALL])
+
+        self.assertEqual(self.executor.run_once(), 4)
+        self.pump()
+        started = self.get_signals('operation-started')
+        self.assertEqual([x[0].data.get_id() for x in started],
+                         ["old", "gone", "first", "second"])
+
+    def test_merged_transaction(self):
+        """ Everything queued together is applied in one call per type """
+        items = [self.plugin.add("item{}".format(x)) for x in range(5)]
+        for item in items:
+            self.executor.install_package(item)
+
+        self.assertEqual(self.executor.run_once(), 5)
+        self.assertEqual(self.plugin.calls, [
+            ("install", ["item0", "item1", "item2", "item3", "item4"])])
+        self.assertEqual(self.executor.run_once(), 0)
+
+        self.pump()
+        finished = self.get_signals('operation-finished')
+        self.assertEqual(len(finished), 5)
+        self.assertTrue(all(x[1] for x in finished))
+        self.assertEqual(self.get_signals('busy-changed'), [(True,), (False,)])
+        self.assertFalse(self.executor.is_busy())
+        self.assertEqual(len(self.executor.get_done()), 5)
+
+    def test_install_remove_cancels(self):
+        """ Installing and removing the same item is a no-op """
+        item = self.plugin.add("item")
+        self.executor.install_package(item)
+        self.executor.remove_package(item)
+
+        self.assertEqual(self.executor.run_once(), 2)
+        self.assertEqual(self.plugin.calls, [])
+        self.pump()
+        self.assertEqual(self.get_signals('operation-started'), [])
+        finished = self.get_signals('operation-finished')
+        self.assertEqual([x[1] for x in finished], [True, True])
+
+    def test_conflict(self):
+        """ Conflicting operations fail the whole batch of the plugin before
+            anything is applied, and say why """
+        item = self.plugin.add(
+            "item", ItemStatus.INSTALLED | ItemStatus.UPDATE_NEEDED)
+        other = self.plugin.add("other")
+        self.executor.upgrade_package(item)
+        self.executor.remove_package(item)
+        self.executor.install_package(other)
+
+        self.assertEqual(self.executor.run_once(), 3)
+        self.assertEqual(self.plugin.calls, [])
+
+        self.pump()
+        finished = self.get_signals('operation-finished')
+        self.assertEqual(len(finished), 3)
+        for op, success in finished:
+            self.assertFalse(success)
+            self.assertEqual(op.result, JournalEvent.FAILED)
+            self.assertIn("item is queued for both upgrade and removal",
+                          op.error)
+
+    def test_apply_failure(self):
+        """ A failed transaction fails every operation in it """
+        item = self.plugin.add("item")
+        self.plugin.fail_on.add("item")
+        self.executor.install_package(item)
+
+        self.executor.run_once()
+        self.pump()
+        finished = self.get_signals('operation-finished')
+        self.assertEqual(len(finished), 1)
+        op, success = finished[0]
+        self.assertFalse(success)
+        self.assertEqual(op.error, "cannot install item")
+
+    def test_journal_events(self):
+        """ Every operation is journaled as queued, started and finished """
+        item = self.plugin.add("item")
+        other = self.plugin.add("other")
+        self.plugin.fail_on.add("other")
+        self.executor.install_package(item)
+        self.executor.run_once()
+        self.executor.install_package(other)
+        self.executor.run_once()
+
+        events = [(x["seq"], x["event"]) for x in self.read_journal()]
+        self.assertEqual(events, [
+            (1, JournalEvent.QUEUED),
+            (1, JournalEvent.STARTED),
+            (1, JournalEvent.FINISHED),
+            (2, JournalEvent.QUEUED),
+            (2, JournalEvent.STARTED),
+            (2, JournalEvent.FAILED),
+        ])
+        queued = self.read_journal()[0]
+        self.assertEqual(queued["plugin"], self.plugin.get_id())
+        self.assertEqual(queued["item"], "item")
+        self.assertEqual(queued["type"], OperationType.INSTALL)
+
+    def test_journal_recovery(self):
+        """ Unfinished installs are resumed on the next start, removals and
+            anything already applied are not """
+        fresh = self.plugin.add("fresh")
+        done = self.plugin.add("done")
+        gone = self.plugin.add("gone", ItemStatus.INSTALLED)
+        self.executor.install_package(fresh)
+        self.executor.install_package(done)
+        self.executor.remove_package(gone)
+        self.executor.shutdown(5)
+
+        # Installed behind our back before the session ended
+        done.add_status(ItemStatus.INSTALLED)
+
+        self.executor = self.create_executor()
+        pending = self.executor.get_pending()
+        self.assertEqual([x.data.get_id() for x in pending], ["fresh"])
+
+        # The old journal was replaced with just what we resumed
+        records = self.read_journal()
+        self.assertEqual([(x["item"], x["event"]) for x in records],
+                         [("fresh", JournalEvent.QUEUED)])
+        self.assertEqual(records[0]["seq"], 4)
+
+
+class TestProviderItem(unittest.TestCase):
+
+    def test_remove_status(self):
+        """ Removing a flag never sets it """
+        item = FakeItem(None, "item", ItemStatus.INSTALLED)
+        item.remove_status(ItemStatus.UPDATE_NEEDED)
+        self.assertEqual(item.get_status(), ItemStatus.INSTALLED)
+        item.remove_status(ItemStatus.INSTALLED)
+        self.assertEqual(item.get_status(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
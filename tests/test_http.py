@@ -0,0 +1,82 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+from http_server import FakeHttpServer
+from xng.util.http import ScHttpPool, ScHttpError
+from StringIO import StringIO
+import unittest
+
+
+class TestHttpPool(unittest.TestCase):
+
+    server = None
+    pool = None
+
+    def setUp(self):
+        self.server = FakeHttpServer()
+        self.server.files["/one.png"] = ("first image", None)
+        self.server.files["/two.png"] = ("second image", None)
+        self.server.start()
+        self.pool = ScHttpPool()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def fetch(self, path, headers=None):
+        out = StringIO()
+        (status, resp) = self.pool.fetch(self.server.get_url(path), out,
+                                         headers)
+        return (status, resp, out.getvalue())
+
+    def test_keep_alive(self):
+        """ Every fetch from the same host goes over one connection """
+        for i in range(3):
+            self.assertEqual(self.fetch("/one.png")[2], "first image")
+            self.assertEqual(self.fetch("/two.png")[2], "second image")
+        self.assertEqual(self.server.count_connections(), 1)
+
+    def test_redirect(self):
+        """ Redirects are followed to the real file """
+        (status, resp, body) = self.fetch("/redirect/two.png")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, "second image")
+        self.assertEqual(self.server.requests,
+                         ["/redirect/two.png", "/two.png"])
+        self.assertEqual(self.server.count_connections(), 1)
+
+    def test_dropped_connection(self):
+        """ A connection the server dropped while idle is replaced """
+        self.assertEqual(self.fetch("/drop/one.png")[2], "first image")
+        self.assertEqual(self.fetch("/two.png")[2], "second image")
+        self.assertEqual(self.server.count_connections(), 2)
+
+    def test_not_found(self):
+        """ Anything but a 200 or 304 raises, and the connection is
+            still reused afterwards """
+        with self.assertRaises(ScHttpError) as ctx:
+            self.fetch("/missing.png")
+        self.assertEqual(ctx.exception.status, 404)
+        self.assertEqual(self.fetch("/one.png")[2], "first image")
+        self.assertEqual(self.server.count_connections(), 1)
+
+    def test_progress(self):
+        """ Progress is told about every byte written """
+        seen = []
+        out = StringIO()
+        self.pool.fetch(self.server.get_url("/one.png"), out, None,
+                        seen.append)
+        self.assertEqual(sum(seen), len("first image"))
+
+
+if __name__ == "__main__":
+    unittest.main()
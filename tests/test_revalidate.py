@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+from http_server import FakeHttpServer
+from xng.util.fetcher import ScMediaFetcher
+from xng.util.http import ScHttpPool
+from xng.util.lru import LruCache
+from xng.util.media_cache import ScMediaCache
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class RevalidatingFetcher:
+    """ Just the revalidation half of the ScMediaFetcher, so we needn't
+        bring up the settings, fetch threads and decoding """
+
+    revalidate = ScMediaFetcher.__dict__["revalidate"]
+    revalidate_internal = ScMediaFetcher.__dict__["revalidate_internal"]
+
+    media_cache = None
+    http = None
+    pixbufs = None
+    revalidating = None
+    revalidate_lock = None
+
+    def __init__(self, media_cache):
+        self.media_cache = media_cache
+        self.http = ScHttpPool()
+        self.pixbufs = LruCache(1024, len)
+        self.revalidating = set()
+        self.revalidate_lock = threading.Lock()
+
+    def get_max_age(self):
+        # Everything is stale
+        return 0
+
+
+class TestRevalidate(unittest.TestCase):
+
+    tmpdir = None
+    home = None
+    server = None
+    cache = None
+    fetcher = None
+    url = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="sc-revalidate-test")
+        self.home = os.environ.get("HOME")
+        os.environ["HOME"] = self.tmpdir
+
+        self.server = FakeHttpServer()
+        self.server.start()
+        self.url = self.server.get_url("/media.png")
+
+        self.cache = ScMediaCache(1024 * 1024)
+        self.fetcher = RevalidatingFetcher(self.cache)
+        self.store("media.png", "old image", "v1")
+        self.store("media-32x32.png", "old variant")
+        self.fetcher.pixbufs.put((self.url, 32, 32), "old pixbuf")
+
+    def tearDown(self):
+        self.server.stop()
+        if self.home is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = self.home
+        shutil.rmtree(self.tmpdir)
+
+    def store(self, name, data, etag=None):
+        with open(self.cache.get_filename(name), "w") as out:
+            out.write(data)
+        self.cache.add(name, self.url, etag)
+
+    def read(self, name):
+        with open(self.cache.get_filename(name), "r") as inp:
+            return inp.read()
+
+    def list_temporary(self):
+        return [x for x in os.listdir(self.cache.path) if x.startswith(".")]
+
+    def test_not_modified(self):
+        """ A 304 keeps our copy and everything derived from it """
+        self.server.files["/media.png"] = ("new image", "v1")
+        fetched = self.cache.entries["media.png"].fetched
+        self.fetcher.revalidate(self.url, "media.png")
+
+        self.assertEqual(self.server.requests, ["/media.png"])
+        self.assertEqual(self.read("media.png"), "old image")
+        self.assertIsNotNone(self.cache.lookup("media-32x32.png"))
+        self.assertEqual(self.fetcher.pixbufs.get((self.url, 32, 32)),
+                         "old pixbuf")
+        self.assertGreater(self.cache.entries["media.png"].fetched, fetched)
+        self.assertEqual(self.list_temporary(), [])
+
+    def test_modified(self):
+        """ A newer copy replaces ours and drops the scaled variants """
+        self.server.files["/media.png"] = ("new image", "v2")
+        self.fetcher.revalidate(self.url, "media.png")
+
+        self.assertEqual(self.read("media.png"), "new image")
+        self.assertIsNone(self.cache.lookup("media-32x32.png"))
+        self.assertFalse(os.path.exists(
+            self.cache.get_filename("media-32x32.png")))
+        self.assertIsNone(self.fetcher.pixbufs.get((self.url, 32, 32)))
+        self.assertEqual(self.cache.entries["media.png"].etag, "v2")
+        self.assertEqual(self.list_temporary(), [])
+
+    def test_offline(self):
+        """ Failing to reach the server leaves the cache alone, and the
+            file is revalidated again next time """
+        self.server.files["/media.png"] = ("new image", "v2")
+        self.server.stop()
+        fetched = self.cache.entries["media.png"].fetched
+        self.fetcher.revalidate(self.url, "media.png")
+
+        self.assertEqual(self.read("media.png"), "old image")
+        self.assertIsNotNone(self.cache.lookup("media-32x32.png"))
+        self.assertEqual(self.cache.entries["media.png"].fetched, fetched)
+        self.assertEqual(self.cache.entries["media.png"].etag, "v1")
+        self.assertEqual(self.fetcher.revalidating, set())
+        self.assertEqual(self.list_temporary(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2013-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+
+from .util import get_user_cache_dir
+from .util.mapped import MappedIndex, MappedIndexWriter
+from gi.repository import AppStreamGlib as As
+from collections import namedtuple
+import hashlib
+import os
+
+
+# Where AppStream loads the system app-info from
+APP_INFO_DIRS = [
+    "/usr/share/app-info",
+    "/var/lib/app-info",
+    "/var/cache/app-info",
+]
+
+# Separators for the multi-valued fields
+LIST_SEP = "\x1e"
+FIELD_SEP = "\x1f"
+
+
+# Everything we need from AppStream outside of the details page. The icon
+# field is kind-tagged, i.e. "stock:name", "local:/path" or
+# "cached:prefix<FIELD_SEP>name", and screenshots are stored as
+# "default<FIELD_SEP>main_uri<FIELD_SEP>thumb_uri" entries.
+AppRecord = namedtuple("AppRecord", [
+    "pkgname",
+    "name",
+    "summary",
+    "kind",
+    "icon",
+    "homepage",
+    "donation",
+    "bugtracker",
+    "developer",
+    "keywords",
+    "screenshots",
+])
+
+
+def get_app_info_key():
+    """ Compute a key from the mtimes of all the app-info files """
+    parts = []
+    for root in APP_INFO_DIRS:
+        for kind in ["xmls", "yaml"]:
+            path = os.path.join(root, kind)
+            try:
+                files = sorted(os.listdir(path))
+            except Exception:
+                continue
+            for f in files:
+                try:
+                    st = os.stat(os.path.join(path, f))
+                except Exception:
+                    continue
+                parts.append("{}/{}:{}:{}".format(path, f, st.st_mtime,
+                                                  st.st_size))
+    return hashlib.sha1("|".join(parts)).hexdigest()
+
+
+def describe_icon(icon):
+    """ Turn an AsIcon into our kind-tagged icon field """
+    if not icon:
+        return ""
+    kind = icon.get_kind()
+    if kind == As.IconKind.STOCK:
+        return "stock:{}".format(icon.get_name())
+    if kind == As.IconKind.LOCAL and icon.get_filename():
+        return "local:{}".format(icon.get_filename())
+    if kind == As.IconKind.CACHED and icon.get_prefix():
+        return "cached:{}{}{}".format(icon.get_prefix(), FIELD_SEP,
+                                      icon.get_name())
+    return ""
+
+
+def build_app_record(app, pkgname, screenshot_type):
+    """ Build the AppRecord for an AsApp """
+    icon = app.get_icon_for_size(64, 64)
+    if not icon:
+        icon = app.get_icon_default()
+
+    screens = []
+    for screen in app.get_screenshots() or []:
+        try:
+            img = screenshot_type(screen, 1)
+        except Exception:
+            continue
+        screens.append(FIELD_SEP.join([
+            "1" if img.default else "0", img.main_uri, img.thumb_uri]))
+
+    keywords = app.get_keywords("C") or []
+    return AppRecord(
+        pkgname,
+        app.get_name("C"),
+        app.get_comment("C"),
+        As.app_kind_to_string(app.get_kind()),
+        describe_icon(icon),
+        app.get_url_item(As.UrlKind.HOMEPAGE),
+        app.get_url_item(As.UrlKind.DONATION),
+        app.get_url_item(As.UrlKind.BUGTRACKER),
+        app.get_developer_name("C"),
+        LIST_SEP.join(keywords),
+        LIST_SEP.join(screens))
+
+
+class AppIndex:
+    """ AppIndex is a compact, memory-mapped copy of the AppStream metadata
+        used for listings, keyed by package name.
+
+        Loading the full As.Store means parsing the whole system collection,
+        so we only do that when the app-info files change (to rebuild the
+        index) or when something needs full detail.
+    """
+
+    key = None
+    index = None
+
+    # Used when we can't write the index for whatever reason
+    fallback = None
+
+    def __init__(self):
+        self.key = get_app_info_key()
+        path = get_user_cache_dir("appstream.idx")
+        self.index = MappedIndex(path, self.key, AppRecord)
+
+    def is_valid(self):
+        if self.fallback is not None:
+            return True
+        return self.index.is_valid()
+
+    def rebuild(self, store, screenshot_type):
+        """ Rebuild the index from a loaded As.Store """
+        writer = MappedIndexWriter(self.index.path, self.key, AppRecord)
+        seen = set()
+        for app in store.get_apps():
+            pkgname = app.get_pkgname_default()
+            if not pkgname or pkgname in seen:
+                continue
+            seen.add(pkgname)
+            # Match the store semantics for apps sharing a package
+            app = store.get_app_by_pkgname(pkgname)
+            try:
+                writer.add(build_app_record(app, pkgname, screenshot_type))
+            except Exception as e:
+                print("Unable to index {}: {}".format(pkgname, e))
+        self.index.close()
+        if writer.write() and self.index.is_valid():
+            return
+        # Serve from memory this session, the next load retries the write
+        self.fallback = dict((k, writer.record_type(*writer.records[k]))
+                             for k in writer.records)
+
+    def get(self, pkgname):
+        """ Return the AppRecord for a package, or None """
+        if self.fallback is not None:
+            return self.fallback.get(pkgname)
+        return self.index.get(pkgname)
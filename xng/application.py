@@ -73,6 +73,7 @@ class ScApplication(Gtk.Application):
             flags=Gio.ApplicationFlags.HANDLES_COMMAND_LINE)
         self.connect("activate", self.on_activate)
         self.connect("startup", self.startup)
+        self.connect("shutdown", self.on_shutdown)
         self.connect("command-line", self.handle_command_line)
         self.connect("handle-local-options", self.handle_local_options)
 
@@ -86,6 +87,11 @@ class ScApplication(Gtk.Application):
         option.description = description
         self.add_main_option_entries([option])
 
+    def on_shutdown(self, app):
+        """ Let the context wind down """
+        if self.app_window is not None:
+            self.app_window.context.shutdown()
+
     def on_activate(self, app):
         """ Activate the primary view """
         self.activate_main_view()
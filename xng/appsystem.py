@@ -11,8 +11,21 @@
 #  (at your option) any later version.
 #
 
+from .appindex import AppIndex, build_app_record, LIST_SEP, FIELD_SEP
+from .util import pixbuf_size
+from .util.lru import LruCache
+from .util.pool import ScWorkerPool
 from gi.repository import AppStreamGlib as As
 from gi.repository import Gio, GLib, GdkPixbuf, Gtk
+import os
+import threading
+
+
+# Budget for decoded icons, 64x64 RGBA is 16KiB so this is ~500 icons
+ICON_CACHE_BYTES = 8 * 1024 * 1024
+
+# Icon decode threads
+ICON_THREADS = 2
 
 
 class Screenshot:
@@ -22,7 +35,9 @@ class Screenshot:
     thumb_uri = None
     default = None
 
-    def __init__(self, asImg, scale):
+    def __init__(self, asImg=None, scale=1):
+        if asImg is None:
+            return
         large = None
         normal = None
         thumbnail = None
@@ -64,6 +79,15 @@ class Screenshot:
         self.main_uri = large.get_url()
         self.thumb_uri = thumbnail.get_url()
 
+    @staticmethod
+    def from_uris(default, main_uri, thumb_uri):
+        """ Restore a Screenshot from the AppIndex """
+        ret = Screenshot()
+        ret.default = default
+        ret.main_uri = main_uri
+        ret.thumb_uri = thumb_uri
+        return ret
+
 
 class AppSystem:
     """ Mux calls into AppStream where appropriate.
@@ -72,12 +96,15 @@ class AppSystem:
         by hooking into AppSystem, and falling back to the native fields
         in the .eopkg's
 
+        Listing queries are answered from the compact AppIndex, and the
+        full As.Store is only loaded on demand, i.e. for descriptions.
+
         TODO: Locale integration
     """
 
     store = None
-
-    store = None
+    store_lock = None
+    index = None
     default_pixbuf = None
     security_pixbuf = None
     mandatory_pixbuf = None
@@ -85,9 +112,24 @@ class AppSystem:
     addon_pixbuf = None
     fetcher = None
 
+    # Decoded icons keyed by (pkgname, size, scale)
+    icon_cache = None
+    icon_pool = None
+
+    # Callbacks waiting on an icon decode, keyed like icon_cache
+    icon_pending = None
+    icon_lock = None
+
     def __init__(self):
-        self.store = As.Store()
-        self.store.load(As.StoreLoadFlags.APP_INFO_SYSTEM)
+        self.store_lock = threading.Lock()
+        self.index = AppIndex()
+        if not self.index.is_valid():
+            self.index.rebuild(self.get_store(), Screenshot)
+
+        self.icon_cache = LruCache(ICON_CACHE_BYTES, pixbuf_size)
+        self.icon_pending = dict()
+        self.icon_lock = threading.Lock()
+        self.icon_pool = ScWorkerPool("icons", ICON_THREADS)
 
         itheme = Gtk.IconTheme.get_default()
         try:
@@ -114,6 +156,24 @@ class AppSystem:
         except Exception as e:
             print(e)
 
+    def get_store(self):
+        """ Load the full As.Store the first time it is needed """
+        with self.store_lock:
+            if self.store is None:
+                self.store = As.Store()
+                self.store.load(As.StoreLoadFlags.APP_INFO_SYSTEM)
+            return self.store
+
+    def lookup(self, id):
+        """ Return the AppRecord for a package, or None """
+        if self.index.is_valid():
+            return self.index.get(id)
+        # Couldn't write the index, build records on the fly
+        app = self.get_store().get_app_by_pkgname(id)
+        if not app:
+            return None
+        return build_app_record(app, id, Screenshot)
+
     def sanitize(self, text):
         return text.replace("&quot;", "\"")
 
@@ -125,23 +185,30 @@ class AppSystem:
 
     def get_summary(self, id, fallback):
         """ Return a usable summary for a package """
-        app = self.store.get_app_by_pkgname(id)
+        record = self.lookup(id)
         ret = None
-        if not app:
+        if not record or not record.summary:
             ret = GLib.markup_escape_text(str(fallback))
         else:
-            ret = app.get_comment("C")
+            ret = record.summary
         return self.sanitize(ret)
 
     def has_id(self, id):
         """ Determine if an ID is known or not """
-        if self.store.get_app_by_pkgname(id) is None:
+        if self.lookup(id) is None:
             return False
         return True
 
+    def is_desktop_app(self, id):
+        """ Determine if the package provides a desktop application """
+        record = self.lookup(id)
+        if not record:
+            return False
+        return record.kind == As.app_kind_to_string(As.AppKind.DESKTOP)
+
     def get_description(self, id, fallback):
         """ Return a usable description for a package """
-        app = self.store.get_app_by_pkgname(id)
+        app = self.get_store().get_app_by_pkgname(id)
         if not app:
             return self.sanitize(
                 GLib.markup_escape_text(str(fallback)))
@@ -152,22 +219,15 @@ class AppSystem:
         return c
 
     def get_name(self, id, fallback):
-        app = self.store.get_app_by_pkgname(id)
-        if not app:
+        record = self.lookup(id)
+        if not record or not record.name:
             return GLib.markup_escape_text(str(fallback))
-        return GLib.markup_escape_text(self.sanitize(app.get_name("C")))
-
-    def _get_appstream_url(self, id, ptype):
-        """ Get an appstream link for the given package """
-        app = self.store.get_app_by_pkgname(id)
-        if not app:
-            return None
-        url = app.get_url_item(ptype)
-        return url
+        return GLib.markup_escape_text(self.sanitize(record.name))
 
     def get_website(self, id, fallback):
         """ Get the website for a given package """
-        home = self._get_appstream_url(id, As.UrlKind.HOMEPAGE)
+        record = self.lookup(id)
+        home = record.homepage if record else None
         if home:
             return home
         if fallback:
@@ -176,7 +236,7 @@ class AppSystem:
 
     def _get_pixbuf_internal(self, id, size):
         """ Get the AppStream GdkPixbuf for a package """
-        app = self.store.get_app_by_pkgname(id)
+        app = self.get_store().get_app_by_pkgname(id)
         if not app:
             return None
         # TODO: Incorporate HIDPI!
@@ -200,79 +260,160 @@ class AppSystem:
     def get_pixbuf_massive(self, id):
         return self._get_pixbuf_internal(id, 128)
 
-    def default_pixbuf_lookup(self, app):
+    def default_pixbuf_lookup(self, record):
         """ Use our built in preloaded pixbufs """
-        if app is None:
+        if record is None:
             return self.default_pixbuf
-        kind = app.get_kind()
-        if kind == As.AppKind.ADDON:
+        if record.kind == As.app_kind_to_string(As.AppKind.ADDON):
             return self.addon_pixbuf
         return self.default_pixbuf
 
-    def get_pixbuf_only(self, id):
+    def get_icon_filename(self, icon, px):
+        """ Find the file on disk backing an AppIndex icon field """
+        (kind, sep, value) = icon.partition(":")
+        if kind == "stock":
+            itheme = Gtk.IconTheme.get_default()
+            info = itheme.lookup_icon(value, px,
+                                      Gtk.IconLookupFlags.GENERIC_FALLBACK)
+            if not info:
+                return None
+            return info.get_filename()
+        if kind == "local":
+            return value
+        if kind != "cached":
+            return None
+        (prefix, sep, name) = value.partition(FIELD_SEP)
+        # Cached icons are stored by size, prefer the closest size
+        for size in [px, 128, 64]:
+            path = os.path.join(prefix, "{}x{}".format(size, size), name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def resolve_icon(self, id, px):
+        """ Return the record and icon filename for a package. The filename
+            is None if we should use a default pixbuf """
+        record = self.lookup(id)
+        if not record or not record.icon:
+            return (record, None)
+        try:
+            return (record, self.get_icon_filename(record.icon, px))
+        except Exception as e:
+            print("Unable to resolve icon for {}: {}".format(id, e))
+        return (record, None)
+
+    def decode_icon(self, filename, px):
+        """ Decode the icon at the requested size """
+        pbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(filename, px, px)
+        if pbuf.get_height() != px:
+            pbuf = pbuf.scale_simple(px, px, GdkPixbuf.InterpType.BILINEAR)
+        return pbuf
+
+    def get_pixbuf_only(self, id, size=64, scale=1):
         """ Only get a pixbuf - no fallbacks  """
-        app = self.store.get_app_by_pkgname(id)
-        if not app:
+        key = (id, size, scale)
+        pbuf = self.icon_cache.get(key)
+        if pbuf is not None:
+            return pbuf
+        px = size * scale
+        (app, filename) = self.resolve_icon(id, px)
+        if filename is None:
             return self.default_pixbuf_lookup(app)
-        # TODO: Incorporate HIDPI!
-        icon = app.get_icon_for_size(64, 64)
-        if not icon:
-            return self.default_pixbuf_lookup(app)
-        kind = icon.get_kind()
-        if kind == As.IconKind.UNKNOWN or kind == As.IconKind.REMOTE:
-            return None
-        if kind == As.IconKind.STOCK:
-            # Load up a gthemedicon version
-            try:
-                itheme = Gtk.IconTheme.get_default()
-                pbuf = itheme.load_icon(
-                    icon.get_name(),
-                    64,
-                    Gtk.IconLookupFlags.GENERIC_FALLBACK)
-                if pbuf.get_height() != 64:
-                    pbuf = pbuf.scale_simple(
-                        64, 64, GdkPixbuf.InterpType.BILINEAR)
-                return pbuf
-            except Exception as e:
-                print(e)
-            return self.default_pixbuf
-        if not icon.load(As.IconLoadFlags.SEARCH_SIZE):
+        try:
+            pbuf = self.decode_icon(filename, px)
+        except Exception as e:
+            print("Unable to load icon {}: {}".format(filename, e))
             return self.default_pixbuf
-        pbuf = icon.get_pixbuf()
-        if pbuf.get_height() != 64:
-            pbuf = pbuf.scale_simple(
-                64, 64, GdkPixbuf.InterpType.BILINEAR)
+        self.icon_cache.put(key, pbuf)
         return pbuf
 
+    def get_pixbuf_async(self, id, callback, size=64, scale=1):
+        """ Return a pixbuf immediately, either the cached icon or a
+            placeholder. When a placeholder is returned the real icon is
+            decoded on a worker thread, and callback(id, pixbuf) is invoked
+            on the main thread once it is ready """
+        key = (id, size, scale)
+        pbuf = self.icon_cache.get(key)
+        if pbuf is not None:
+            return pbuf
+        px = size * scale
+        (app, filename) = self.resolve_icon(id, px)
+        if filename is None:
+            return self.default_pixbuf_lookup(app)
+
+        with self.icon_lock:
+            if key in self.icon_pending:
+                self.icon_pending[key].append(callback)
+            else:
+                self.icon_pending[key] = [callback]
+                self.icon_pool.submit(self.decode_icon_async, key,
+                                      filename, px)
+        return self.default_pixbuf_lookup(app)
+
+    def decode_icon_async(self, key, filename, px):
+        """ Runs on the icon pool """
+        pbuf = None
+        try:
+            pbuf = self.decode_icon(filename, px)
+            self.icon_cache.put(key, pbuf)
+        except Exception as e:
+            print("Unable to load icon {}: {}".format(filename, e))
+        GLib.idle_add(self.deliver_icon, key, pbuf)
+
+    def deliver_icon(self, key, pbuf):
+        """ Hand the decoded icon to everyone who asked for it """
+        with self.icon_lock:
+            callbacks = self.icon_pending.pop(key, [])
+        if pbuf is None:
+            return False
+        for callback in callbacks:
+            callback(key[0], pbuf)
+        return False
+
+    def get_keywords(self, id):
+        """ Return the AppStream search keywords for a package """
+        record = self.lookup(id)
+        if not record or not record.keywords:
+            return []
+        return record.keywords.split(LIST_SEP)
+
     def get_donation_site(self, id):
         """ Get a donation link for the given package """
-        return self._get_appstream_url(id, As.UrlKind.DONATION)
+        record = self.lookup(id)
+        if not record or not record.donation:
+            return None
+        return record.donation
 
     def get_bug_site(self, id):
         """ Get a bug link for the given package """
-        return self._get_appstream_url(id, As.UrlKind.BUGTRACKER)
+        record = self.lookup(id)
+        if not record or not record.bugtracker:
+            return None
+        return record.bugtracker
 
     def get_developers(self, id):
         """ Get the developer names for the given package """
-        app = self.store.get_app_by_pkgname(id)
-        if not app:
+        record = self.lookup(id)
+        if not record or not record.developer:
             return None
-        return app.get_developer_name("C")
+        return record.developer
+
+    def has_screenshots(self, id):
+        """ Determine if the package has any AppStream screenshots """
+        record = self.lookup(id)
+        if not record or not record.screenshots:
+            return False
+        return True
 
     def get_screenshots(self, id):
         """ Return wrapped Screenshot objects for the package """
-        app = self.store.get_app_by_pkgname(id)
-        if not app:
-            return None
-        screens = app.get_screenshots()
-        if not screens:
+        record = self.lookup(id)
+        if not record or not record.screenshots:
             return None
         ret = []
-        for screen in screens:
-            try:
-                # TODO: Pass scale factor
-                img = Screenshot(screen, 1)
-                ret.append(img)
-            except Exception as e:
-                print("Unable to load screen: {}".format(e))
+        # TODO: Pass scale factor
+        for screen in record.screenshots.split(LIST_SEP):
+            (default, main_uri, thumb_uri) = screen.split(FIELD_SEP)
+            ret.append(Screenshot.from_uris(default == "1", main_uri,
+                                            thumb_uri))
         return ret
@@ -11,58 +11,70 @@
 #  (at your option) any later version.
 #
 
-from gi.repository import GObject, Gtk, Pango
+from gi.repository import GObject, Gio, GLib, Gtk, Pango
 from xng.plugins.base import PopulationFilter, ItemStatus, ProviderItem
+from xng.storage import ScFrameStorage
+
+
+# Rows within this many pixels of the viewport are resolved ahead of time
+VISIBLE_MARGIN = 200
 
 
 class ScItemButton(Gtk.FlowBoxChild):
-    """ Display an item in a pretty view """
+    """ Display an item in a pretty view
+
+        The button is created as a cheap shell. The icon, display name and
+        summary are only resolved once the button actually becomes visible,
+        and the icon is dropped again when it scrolls far out of view.
+    """
 
     __gtype_name__ = "ScItemButton"
 
     item = None
+    appsystem = None
     action_button = None
 
+    image = None
+    label = None
+    summary = None
+
+    resolved = False
+    has_summary = False
+
     def __init__(self, appsystem, item):
         Gtk.FlowBoxChild.__init__(self)
         self.item = item
-        item_id = item.get_id()
+        self.appsystem = appsystem
 
         main_box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
         self.add(main_box)
 
         # Pack the image first
-        img = Gtk.Image.new()
-        main_box.pack_start(img, False, False, 0)
-        icon = appsystem.get_pixbuf_only(item_id)
-        img.set_from_pixbuf(icon)
+        self.image = Gtk.Image.new()
+        self.image.set_size_request(64, 64)
+        main_box.pack_start(self.image, False, False, 0)
 
         stride_box = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
-        img.set_margin_end(12)
+        self.image.set_margin_end(12)
         main_box.pack_start(stride_box, True, True, 0)
 
-        # Get the title
-        name = appsystem.get_name(item_id, item.get_name())
-        label = Gtk.Label(name)
-        label.get_style_context().add_class("sc-bold")
-        label.set_use_markup(True)
-        label.set_margin_bottom(3)
-        label.set_property("xalign", 0.0)
-        label.set_halign(Gtk.Align.START)
-        stride_box.pack_start(label, False, False, 0)
-
-        # Get the summary
-        summ = appsystem.get_summary(item_id, item.get_summary())
-        if len(summ) > 100:
-            summ = "%s…" % summ[0:100]
-        summary = Gtk.Label(summ)
-        summary.set_use_markup(True)
-        summary.set_property("xalign", 0.0)
-        summary.set_line_wrap(True)
-        summary.set_line_wrap_mode(Pango.WrapMode.WORD)
-        summary.set_halign(Gtk.Align.START)
-        summary.set_max_width_chars(50)
-        stride_box.pack_start(summary, False, False, 0)
+        # Plain name until we're resolved
+        self.label = Gtk.Label(GLib.markup_escape_text(item.get_name()))
+        self.label.get_style_context().add_class("sc-bold")
+        self.label.set_use_markup(True)
+        self.label.set_margin_bottom(3)
+        self.label.set_property("xalign", 0.0)
+        self.label.set_halign(Gtk.Align.START)
+        stride_box.pack_start(self.label, False, False, 0)
+
+        self.summary = Gtk.Label("")
+        self.summary.set_use_markup(True)
+        self.summary.set_property("xalign", 0.0)
+        self.summary.set_line_wrap(True)
+        self.summary.set_line_wrap_mode(Pango.WrapMode.WORD)
+        self.summary.set_halign(Gtk.Align.START)
+        self.summary.set_max_width_chars(50)
+        stride_box.pack_start(self.summary, False, False, 0)
 
         action_name = "Install"
         action_style = "suggested-action"
@@ -81,6 +93,40 @@ class ScItemButton(Gtk.FlowBoxChild):
 
         self.get_style_context().add_class("category-item-row")
 
+    def resolve(self):
+        """ We're visible, so fill in the expensive parts """
+        if self.resolved:
+            return
+        self.resolved = True
+        item_id = self.item.get_id()
+
+        icon = self.appsystem.get_pixbuf_async(item_id, self.on_icon_loaded)
+        self.image.set_from_pixbuf(icon)
+
+        # Name and summary don't change, so only do them once
+        if self.has_summary:
+            return
+        self.has_summary = True
+        name = self.appsystem.get_name(item_id, self.item.get_name())
+        self.label.set_markup(name)
+
+        summ = self.appsystem.get_summary(item_id, self.item.get_summary())
+        if len(summ) > 100:
+            summ = "%s…" % summ[0:100]
+        self.summary.set_markup(summ)
+
+    def on_icon_loaded(self, id, pixbuf):
+        """ The real icon has been decoded """
+        if self.resolved:
+            self.image.set_from_pixbuf(pixbuf)
+
+    def release(self):
+        """ We've scrolled far out of view, drop the icon """
+        if not self.resolved:
+            return
+        self.resolved = False
+        self.image.clear()
+
 
 class ScComponentButton(Gtk.ToggleButton):
     """ Represent components in a category """
@@ -128,6 +174,14 @@ class ScCategoriesView(Gtk.Box):
     item_scroller = None
     item_list = None
 
+    # Delivers items to us from the plugins in idle time
+    storage = None
+
+    # Backing model for item_list, and the rows currently resolved
+    model = None
+    resolved = None
+    visible_source = 0
+
     def get_page_name(self):
         if not self.category:
             return "Categories"
@@ -137,6 +191,9 @@ class ScCategoriesView(Gtk.Box):
         Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
 
         self.context = context
+        self.storage = ScFrameStorage(self)
+        self.model = Gio.ListStore.new(ProviderItem)
+        self.resolved = []
 
         self.layout_constraint = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
         self.pack_start(self.layout_constraint, True, True, 0)
@@ -171,6 +228,11 @@ class ScCategoriesView(Gtk.Box):
             Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
         self.item_scroller.set_overlay_scrolling(False)
         self.item_list = Gtk.FlowBox.new()
+        self.item_list.bind_model(self.model, self.create_item_widget)
+        self.item_list.connect('size-allocate', self.queue_update_visible)
+        vadj = self.item_scroller.get_vadjustment()
+        vadj.connect('value-changed', self.queue_update_visible)
+        vadj.connect('changed', self.queue_update_visible)
         self.item_list.set_activate_on_single_click(True)
         self.item_list.connect('child-activated', self.item_activated)
         self.item_list.set_row_spacing(12)
@@ -235,18 +297,74 @@ class ScCategoriesView(Gtk.Box):
         """ Activate the current component """
         print("Component: {}".format(component.get_id()))
 
-        # Clear out the old items
-        for sproglet in self.item_list.get_children():
-            self.item_list.remove(sproglet)
+        self.context.populate(self.storage, PopulationFilter.CATEGORY,
+                              component)
 
-        for plugin in self.context.plugins:
-            plugin.populate_storage(self,
-                                    PopulationFilter.CATEGORY,
-                                    component,
-                                    None)
+    def clear(self):
+        """ Clear out the old items """
+        self.resolved = []
+        self.model.remove_all()
 
     def add_item(self, id, item, popfilter):
         """ Adding new item.. """
+        self.add_items([item], popfilter)
+
+    def add_items(self, items, popfilter):
+        """ Add a batch of items to the model """
+        self.model.splice(self.model.get_n_items(), 0, items)
+
+    def create_item_widget(self, item):
+        """ Construct the (cheap) row widget for a model item """
         wid = ScItemButton(self.context.appsystem, item)
-        self.item_list.add(wid)
         wid.show_all()
+        return wid
+
+    def queue_update_visible(self, *args):
+        """ Coalesce scroll/allocation changes into one visibility pass """
+        if self.visible_source == 0:
+            self.visible_source = GLib.idle_add(self.update_visible)
+
+    def find_first_visible(self, top):
+        """ Children are laid out in order, so bisect for the first child
+            that ends below the top of the viewport """
+        lo = 0
+        hi = self.model.get_n_items()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            alloc = self.item_list.get_child_at_index(mid).get_allocation()
+            if alloc.y + alloc.height < top:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def update_visible(self):
+        """ Resolve the rows in view, release those that scrolled away """
+        self.visible_source = 0
+        vadj = self.item_scroller.get_vadjustment()
+        top = vadj.get_value() - VISIBLE_MARGIN
+        bottom = vadj.get_value() + vadj.get_page_size() + VISIBLE_MARGIN
+
+        visible = []
+        count = self.model.get_n_items()
+        idx = self.find_first_visible(top)
+        while idx < count:
+            child = self.item_list.get_child_at_index(idx)
+            alloc = child.get_allocation()
+            # Not yet allocated, try again on the next allocation
+            if alloc.y < 0 or alloc.y > bottom:
+                break
+            child.resolve()
+            visible.append(child)
+            idx += 1
+
+        keep = set(visible)
+        for child in self.resolved:
+            if child not in keep:
+                child.release()
+        self.resolved = visible
+
+        if self.context.prefetcher is not None:
+            self.context.prefetcher.set_visible(
+                self, [x.item.get_id() for x in visible])
+        return False
@@ -13,9 +13,260 @@
 
 from .appsystem import AppSystem
 from .executor import Executor
+from .prefetch import ScPrefetcher
+from .plugins.base import ProviderStorage
+from .startup import StartupGraph
 from .util.fetcher import ScMediaFetcher
-from gi.repository import GObject, GLib
+from gi.repository import GObject
+from collections import deque
+import re
 import threading
+import time
+
+
+# Startup tasks the UI needs before it can show anything useful
+STARTUP_REQUIRED = ["plugins", "appsystem", "prepare", "executor"]
+
+# Seconds we give the executor to wind down when the application quits
+CONTEXT_SHUTDOWN_TIMEOUT = 2
+
+# Seconds a plugin may take to populate before we stop listening to it
+POPULATE_DEADLINE = 10
+
+
+def get_dedup_key(item):
+    """ Items from different plugins with the same key describe the same
+        application, i.e. "gimp" from eopkg and "GIMP" from snapd """
+    return re.sub(r"[^a-z0-9]", "", item.get_name().lower())
+
+
+class ScPluginCancel:
+    """ Cancellation for a single plugin, which is cancelled along with the
+        whole population or once the plugin runs past its deadline """
+
+    parent = None
+    deadline = None
+    cancelled = False
+
+    def __init__(self, parent, deadline):
+        self.parent = parent
+        self.deadline = deadline
+        self.cancelled = False
+
+    def is_set(self):
+        return self.cancelled or self.parent.is_set() or \
+            time.time() >= self.deadline
+
+    def set(self):
+        self.cancelled = True
+
+
+class ScPluginStorage(ProviderStorage):
+    """ Storage handed to a single plugin, merging its items into the
+        shared population without duplicating any other plugin's items """
+
+    __gtype_name__ = "ScPluginStorage"
+
+    population = None
+    rank = 0
+    cancel = None
+
+    def __init__(self, population, rank, cancel):
+        ProviderStorage.__init__(self)
+        self.population = population
+        self.rank = rank
+        self.cancel = cancel
+
+    def add_item(self, id, item, popfilter):
+        self.add_items([item], popfilter)
+
+    def add_items(self, items, popfilter):
+        if self.cancel.is_set():
+            return
+        self.population.merge(self.rank, items, popfilter)
+
+    def clear(self):
+        pass
+
+
+class ScPopulation:
+    """ A single population of one storage from every plugin
+
+        Plugins are ranked in the order of the context plugins, and when
+        two plugins provide the same application the item of the higher
+        ranked plugin is kept. Items are therefore only passed on once
+        every higher ranked plugin is done, or past its deadline, and until
+        then are held back. A plugin is never deduplicated against itself.
+    """
+
+    request = None
+    lock = None
+
+    # dedup key -> rank of the plugin that provided it
+    owners = None
+
+    # Ranks of the plugins that are done, and the first one that isn't
+    done = None
+    current = 0
+    count = 0
+
+    # rank -> [(items, popfilter)] waiting for higher ranked plugins
+    held = None
+
+    def __init__(self, request, count):
+        self.request = request
+        self.lock = threading.Lock()
+        self.owners = dict()
+        self.done = set()
+        self.current = 0
+        self.count = count
+        self.held = dict()
+
+    def merge(self, rank, items, popfilter):
+        """ Pass on the items no higher ranked plugin has provided, once
+            we know what those plugins provided """
+        with self.lock:
+            if rank > self.current:
+                self.held.setdefault(rank, []).append((items, popfilter))
+                return
+            self.deliver(rank, items, popfilter)
+
+    def finish(self, rank):
+        """ The plugin of the given rank has nothing more to add """
+        with self.lock:
+            self.done.add(rank)
+            self.advance()
+
+    def expire(self):
+        """ Every plugin is out of time, pass on whatever is held """
+        with self.lock:
+            self.done.update(range(self.count))
+            self.advance()
+
+    def advance(self):
+        """ Move past the finished plugins, passing on the items of the
+            next ones. Must hold the lock """
+        while self.current in self.done:
+            self.current += 1
+            for items, popfilter in self.held.pop(self.current, []):
+                self.deliver(self.current, items, popfilter)
+
+    def deliver(self, rank, items, popfilter):
+        """ Drop what a higher ranked plugin provided, must hold the lock """
+        fresh = []
+        for item in items:
+            key = get_dedup_key(item)
+            owner = self.owners.setdefault(key, rank)
+            if owner == rank:
+                fresh.append(item)
+        self.request.add_items(fresh, popfilter)
+
+
+class ScPluginRunner:
+    """ Runs the population calls of a single plugin one after another on
+        a thread of its own
+
+        A plugin that hangs therefore only holds up its own later calls,
+        and those are dropped if their population is cancelled while they
+        wait, so nothing piles up behind it.
+    """
+
+    plugin = None
+    lock = None
+    running = False
+
+    # (population, rank, popfilter, extra, deadline) waiting to run
+    pending = None
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.lock = threading.Lock()
+        self.running = False
+        self.pending = deque()
+
+    def submit(self, *args):
+        """ Run the population call now, or once the current one is over """
+        with self.lock:
+            self.pending.append(args)
+            if self.running:
+                return
+            self.running = True
+        t = threading.Thread(target=self.run_calls,
+                             name="populate-{}".format(self.plugin.get_id()))
+        t.daemon = True
+        t.start()
+
+    def run_calls(self):
+        """ Thread body, runs until nothing is pending """
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+                args = self.pending.popleft()
+            self.populate(*args)
+
+    def populate(self, population, rank, popfilter, extra, deadline):
+        cancel = ScPluginCancel(population.request.cancel, deadline)
+        if cancel.is_set():
+            population.finish(rank)
+            return
+        storage = ScPluginStorage(population, rank, cancel)
+        started = time.time()
+        try:
+            self.plugin.populate_storage(storage, popfilter, extra, cancel)
+        except Exception as e:
+            print("Failed to populate from {}: {}".format(
+                self.plugin.get_id(), e))
+        population.finish(rank)
+        if time.time() > deadline:
+            print("{} missed the population deadline after {:.1f}s".format(
+                self.plugin.get_id(), time.time() - started))
+
+
+class ScPopulator:
+    """ ScPopulator fills a storage from every plugin at once
+
+        Each plugin populates on its own thread, so a slow backend never
+        holds up the others, and items describing the same application
+        are only shown once, from whichever plugin comes first in the
+        plugin order. All plugins share the cancellation of the storage
+        request, and each may also only take so long: once a plugin passes
+        its deadline anything else it provides is dropped, and the view
+        keeps whatever it had by then.
+    """
+
+    # plugin id -> ScPluginRunner
+    runners = None
+    lock = None
+
+    def __init__(self):
+        self.runners = dict()
+        self.lock = threading.Lock()
+
+    def get_runner(self, plugin):
+        with self.lock:
+            id = plugin.get_id()
+            if id not in self.runners:
+                self.runners[id] = ScPluginRunner(plugin)
+            return self.runners[id]
+
+    def populate(self, storage, plugins, popfilter, extra,
+                 deadline=POPULATE_DEADLINE):
+        """ Cancel any ongoing population of the ScFrameStorage and
+            populate it from the plugins, returning the cancel Event """
+        request = storage.begin_request()
+        population = ScPopulation(request, len(plugins))
+        expires = time.time() + deadline
+        for rank, plugin in enumerate(plugins):
+            self.get_runner(plugin).submit(population, rank, popfilter,
+                                           extra, expires)
+
+        # Don't hold back the other plugins for one that hangs
+        timer = threading.Timer(deadline, population.expire)
+        timer.daemon = True
+        timer.start()
+        return request.cancel
 
 
 class ScContext(GObject.Object):
@@ -25,8 +276,11 @@ class ScContext(GObject.Object):
     appsystem = None
     has_loaded = False
     fetcher = None
+    prefetcher = None
     executor = None
     driver_manager = None
+    startup = None
+    populator = None
 
     __gtype_name__ = "ScContext"
 
@@ -37,21 +291,43 @@ class ScContext(GObject.Object):
     def __init__(self):
         GObject.Object.__init__(self)
         self.has_loaded = False
+        self.populator = ScPopulator()
 
-    def begin_load(self):
+    def begin_load(self, required=STARTUP_REQUIRED):
         """ Request a load for the system, i.e. after all components are
-            now available for the UI """
+            now available for the UI
+
+            The startup tasks run in parallel, and 'loaded' is emitted once
+            the required tasks have completed. LDM is probed alongside but
+            nothing in the UI waits on it
+        """
         if self.has_loaded:
             return
         self.has_loaded = True
-        self.init_ldm()
-        self.init_plugins()
         self.fetcher = ScMediaFetcher()
+        self.prefetcher = ScPrefetcher(self)
 
-        # Lazy load now
-        thr = threading.Thread(target=self.build_data)
-        thr.daemon = True
-        thr.start()
+        self.startup = StartupGraph()
+        self.startup.add("ldm", self.init_ldm)
+        self.startup.add("plugins", self.init_plugins)
+        self.startup.add("appsystem", self.init_appsystem)
+        self.startup.add("bind", self.bind_appsystem,
+                         ["plugins", "appsystem"])
+        self.startup.add("prepare", self.prepare_plugins, ["bind"])
+        self.startup.add("executor", self.init_executor, ["bind"])
+        self.startup.when_complete(required, self.emit_loaded)
+        self.startup.run()
+
+    def populate(self, storage, popfilter, extra):
+        """ Populate the ScFrameStorage from every plugin """
+        return self.populator.populate(storage, self.plugins or [], popfilter,
+                                       extra)
+
+    def shutdown(self):
+        """ The application is going away. eopkg carries on with anything
+            already started, the journal takes care of the rest """
+        if self.executor is not None:
+            self.executor.shutdown(CONTEXT_SHUTDOWN_TIMEOUT)
 
     def init_ldm(self):
         """ Initialise Linux Driver Management if available. """
@@ -105,28 +381,52 @@ class ScContext(GObject.Object):
     def emit_loaded(self):
         """ Emitted on the main thread to let the application know we're now
             ready and have available AppSystem data, etc. """
-        print("defer loaded")
         self.emit('loaded')
-        return False
 
-    def build_data(self, args=None):
-        """ Perform expensive operations """
+    def init_appsystem(self):
         self.appsystem = AppSystem()
-        self.executor = Executor()
-        GLib.idle_add(self.emit_loaded)
+
+    def bind_appsystem(self):
+        """ Let the plugins make use of the AppStream data """
+        if self.plugins is None or self.appsystem is None:
+            return
+        for plugin in self.plugins:
+            plugin.set_appsystem(self.appsystem)
+
+    def prepare_plugins(self):
+        """ Have the plugins build their caches before the first population,
+            which would otherwise run into its deadline on a cold start """
+        if self.plugins is None:
+            return
+        for plugin in self.plugins:
+            try:
+                plugin.prepare()
+            except Exception as e:
+                print("Failed to prepare {}: {}".format(plugin.get_id(), e))
+
+    def init_executor(self):
+        self.executor = Executor(self.plugins or [])
+        self.executor.start()
 
     def begin_install(self, item):
         """ Begin the work necessary to install a package """
-        packages = item.get_plugin().plan_install_item(item)
-        names = [x.get_id() for x in packages]
+        plan = item.get_plugin().plan_install([item])
+        names = [x.get_id() for x in plan.items]
 
         # TODO: Make sure this part is a dependency dialog
-        print("begin_install: {}".format(", ".join(names)))
+        print("begin_install: {} (download {}, installed {})".format(
+            ", ".join(names), plan.download_size, plan.installed_size))
 
-        # Now try the install
-        item.get_plugin().install_item(packages)
+        # Now queue the install, the plugin resolves the dependencies
+        # again for the whole transaction
+        self.executor.install_package(item)
 
     def begin_remove(self, item):
         """ Begin the work necessary to remove a package """
         packages = item.get_plugin().plan_remove_item(item)
-        print("begin_remove: {}".format(packages))
+        names = [x.get_id() for x in packages]
+
+        # TODO: Make sure this part is a dependency dialog
+        print("begin_remove: {}".format(", ".join(names)))
+
+        self.executor.remove_package(item)
@@ -57,11 +57,35 @@ class ScDetailsView(Gtk.Box):
         Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
 
         self.context = context
+        self.context.connect('loaded', self.on_context_loaded)
         self.parser = SpecialMarkdownParser()
 
         self.build_header()
         self.show_all()
 
+    def on_context_loaded(self, context):
+        """ Track operations on whatever item we're showing """
+        executor = context.executor
+        executor.connect('operation-queued', self.on_operation_changed)
+        executor.connect('operation-started', self.on_operation_changed)
+        executor.connect('operation-finished', self.on_operation_finished)
+
+    def on_operation_changed(self, executor, op):
+        if op.data is self.item:
+            self.update_actions()
+
+    def on_operation_finished(self, executor, op, success):
+        if op.data is self.item:
+            self.update_actions()
+
+    def is_item_busy(self):
+        """ Determine if the item has an operation queued or running """
+        executor = self.context.executor
+        if executor is None:
+            return False
+        ops = executor.get_pending() + executor.get_running()
+        return any(x.data is self.item for x in ops)
+
     def set_item(self, item):
         """ Update our UI for the current item """
         if item == self.item:
@@ -77,7 +101,7 @@ class ScDetailsView(Gtk.Box):
         self.header_name.set_markup(apps.get_name(id, item.get_name()))
         self.header_summary.set_markup(
             apps.get_summary(id, item.get_summary()))
-        pbuf = apps.get_pixbuf_only(id)
+        pbuf = apps.get_pixbuf_async(id, self.on_icon_loaded)
         self.header_image.set_from_pixbuf(pbuf)
 
         # Now set the screenshot ball in motion
@@ -89,6 +113,11 @@ class ScDetailsView(Gtk.Box):
         # Always re-focus to details
         self.stack.set_visible_child_name("details")
 
+    def on_icon_loaded(self, id, pixbuf):
+        """ The real icon for an item has been decoded """
+        if self.item and self.item.get_id() == id:
+            self.header_image.set_from_pixbuf(pixbuf)
+
     def build_header(self):
         """ Build our main header area """
         box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
@@ -219,8 +248,13 @@ class ScDetailsView(Gtk.Box):
             self.header_action_remove.hide()
             self.header_action_install.show()
 
+        # Nothing to do until the current operation on it is done
+        busy = self.is_item_busy()
+        self.header_action_install.set_sensitive(not busy)
+        self.header_action_upgrade.set_sensitive(not busy)
+
         # Disable remove button if dangerous!
-        if self.item.has_status(ItemStatus.META_ESSENTIAL):
+        if busy or self.item.has_status(ItemStatus.META_ESSENTIAL):
             self.header_action_remove.set_sensitive(False)
         else:
             self.header_action_remove.set_sensitive(True)
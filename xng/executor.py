@@ -12,71 +12,317 @@
 #
 
 
+from .op_journal import OperationJournal, JournalEvent
 from .op_queue import OperationQueue, Operation, OperationType
+from .plugins.base import ProviderTransaction, ProviderPrefetchBudget, \
+    ItemStatus
+from .util import get_user_cache_dir
+from gi.repository import Gio, GLib, GObject
+from collections import OrderedDict, deque
 from threading import Lock, Thread
 
 
-class Executor:
+# Seconds between looking ahead in the queue for new operations
+LOOKAHEAD_INTERVAL = 1.0
+
+# Completed operations we keep around for get_done()
+EXECUTOR_DONE_HISTORY = 50
+
+
+class Executor(GObject.Object):
     """ Executor is responsible for handling the main "loop" around the
         installation/removal of packages
+
+        Everything queued up by the time the worker gets to it is drained
+        in one go and merged into a single ProviderTransaction per plugin,
+        so that queueing ten installs results in one dependency resolution
+        and one native transaction rather than ten.
+
+        All operations are journaled, so that anything which didn't finish
+        (i.e. the session ended mid-install) is reconciled with the actual
+        item state on the next start. Installs and upgrades are queued again,
+        removals are not replayed without the user asking again.
+
+        While a transaction is being applied we look ahead in the queue and
+        let the plugins download whatever the next transaction will need,
+        within the configured bandwidth and disk budget.
+
+        A single worker thread lives for as long as the executor, sleeping
+        on the queue until there is work. Nothing is processed until
+        start() is called, and run_once() may be used instead to step
+        through the queue on the calling thread. Signals are always
+        emitted on the main loop.
     """
 
+    __gtype_name__ = "ScExecutor"
+
+    __gsignals__ = {
+        'operation-queued': (GObject.SIGNAL_RUN_FIRST, None, (object,)),
+        'operation-started': (GObject.SIGNAL_RUN_FIRST, None, (object,)),
+        'operation-finished': (GObject.SIGNAL_RUN_FIRST, None,
+                               (object, bool)),
+        'busy-changed': (GObject.SIGNAL_RUN_FIRST, None, (bool,)),
+    }
+
     queue = None
-    thread_lock = None
-    thread_running = False
+    worker = None
+
+    # Guards running and done
+    lock = None
+    running = None
+    done = None
 
-    def __init__(self):
+    plugins = None
+    journal = None
+    settings = None
+
+    def __init__(self, plugins, journal_path=None, settings=None):
+        GObject.Object.__init__(self)
         self.queue = OperationQueue()
-        self.thread_lock = Lock()
-        self.thread_running = False
+        self.lock = Lock()
+        self.running = []
+        self.done = deque(maxlen=EXECUTOR_DONE_HISTORY)
+        self.plugins = plugins
+        if settings is None:
+            settings = Gio.Settings.new("com.solus-project.software-center")
+        self.settings = settings
+
+        if journal_path is None:
+            journal_path = get_user_cache_dir("executor.journal")
+        self.journal = OperationJournal(journal_path)
+        # The old journal is only replaced once we've re-queued from it
+        self.recover(self.journal.recover())
+        self.journal.start()
+
+    def start(self):
+        """ Start the worker thread """
+        if self.worker is not None:
+            return
+        self.worker = Thread(target=self.process_queue)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def shutdown(self, timeout=None):
+        """ Stop once the current batch is applied. Anything still queued
+            stays in the journal and is resumed on the next start """
+        self.queue.close()
+        if self.worker is not None:
+            self.worker.join(timeout)
+        self.journal.flush(timeout)
+
+    def get_pending(self):
+        """ Operations waiting for the worker, in the order they'll run """
+        return self.queue.peek()
+
+    def get_running(self):
+        """ Operations in the batch currently being applied """
+        with self.lock:
+            return list(self.running)
+
+    def get_done(self):
+        """ Recently completed operations, most recent last """
+        with self.lock:
+            return list(self.done)
+
+    def is_busy(self):
+        with self.lock:
+            return len(self.running) > 0
+
+    def emit_idle(self, *args):
+        """ Emit the signal on the main loop """
+        GLib.idle_add(self.emit_signal, args)
 
-        # TODO: Spawn a thread
+    def emit_signal(self, args):
+        self.emit(*args)
+        return False
 
-    def install_package(self, ids):
+    def get_plugin(self, id):
+        for plugin in self.plugins:
+            if plugin.get_id() == id:
+                return plugin
+        return None
+
+    def is_satisfied(self, opType, item):
+        """ Determine if the item is already in the state an operation
+            would leave it in """
+        installed = item.has_status(ItemStatus.INSTALLED)
+        if opType == OperationType.INSTALL:
+            return installed
+        elif opType == OperationType.REMOVE:
+            return not installed
+        return installed and not item.has_status(ItemStatus.UPDATE_NEEDED)
+
+    def recover(self, records):
+        """ Queue up anything from the last session that didn't finish and
+            still needs doing. Installs and upgrades are resumed, removals
+            are only reconciled and never replayed """
+        for record in records:
+            plugin = self.get_plugin(record["plugin"])
+            item = None
+            if plugin is not None:
+                item = plugin.get_item(record["item"])
+            if item is None:
+                print("Dropping unknown journaled operation on {}".format(
+                    record["item"]))
+                continue
+            if self.is_satisfied(record["type"], item):
+                continue
+            if record["type"] == OperationType.REMOVE:
+                # Never remove anything without the user asking again
+                print("Not resuming removal of {}".format(record["item"]))
+                continue
+            self.push_operation(Operation(item, record["type"]))
+
+    def push_operation(self, op):
+        """ Journal and queue the operation """
+        item = op.data
+        self.journal.queued(op, item.get_plugin().get_id(), item.get_id())
+        self.queue.push_operation(op)
+        self.emit_idle('operation-queued', op)
+
+    def install_package(self, item):
         """ Install or queue installation """
-        self.queue.push_operation(Operation.Install(ids))
-        self.maybe_respawn()
+        self.push_operation(Operation.Install(item))
 
-    def remove_package(self, ids):
+    def remove_package(self, item):
         """ Remove or queue removal """
-        self.queue.push_operation(Operation.Remove(ids))
-        self.maybe_respawn()
+        self.push_operation(Operation.Remove(item))
 
-    def upgrade_package(self, ids):
+    def upgrade_package(self, item):
         """ Upgrade or queue upgrade """
-        self.queue.push_operation(Operation.Upgrade(ids))
-        self.maybe_respawn()
+        self.push_operation(Operation.Upgrade(item))
 
-    def maybe_respawn(self):
-        """ Start up the worker thread again if our thread ended """
-        self.thread_lock.acquire()
-        try:
-            if not self.thread_running:
-                self.thread_running = True
-                print("debug: spawning new work thread")
-                t = Thread(target=self.process_queue)
-                t.start()
+    def build_transactions(self, ops):
+        """ Merge the operations into one transaction per plugin """
+        transactions = OrderedDict()
+        for op in ops:
+            plugin = op.data.get_plugin()
+            if plugin not in transactions:
+                transactions[plugin] = ProviderTransaction(plugin)
+            transaction = transactions[plugin]
+            if op.opType == OperationType.INSTALL:
+                transaction.add_install(op.data)
+            elif op.opType == OperationType.REMOVE:
+                transaction.add_remove(op.data)
+            elif op.opType == OperationType.UPGRADE:
+                transaction.add_upgrade(op.data)
+        for transaction in transactions.itervalues():
+            transaction.resolve()
+            if not transaction.conflicts:
+                transaction.plugin.check_transaction(transaction)
+        return transactions
+
+    def create_budget(self):
+        """ Build the prefetch budget from the current settings """
+        rate = self.settings.get_uint("prefetch-bandwidth") * 1024
+        size = self.settings.get_uint("prefetch-disk-budget") * 1024 * 1024
+        return ProviderPrefetchBudget(rate, size)
+
+    def lookahead(self, budget):
+        """ Prefetch for whatever is queued behind the current transaction
+            until the budget is cancelled """
+        seen = set()
+        while not budget.is_cancelled():
+            pending = OrderedDict()
+            for op in self.queue.peek():
+                # Removals don't need anything downloaded
+                if op.opType == OperationType.REMOVE:
+                    continue
+                plugin = op.data.get_plugin()
+                key = (plugin, op.data.get_id())
+                if key in seen:
+                    continue
+                seen.add(key)
+                pending.setdefault(plugin, []).append(op.data)
+            for plugin, items in pending.iteritems():
+                try:
+                    plugin.prefetch_items(items, budget)
+                except Exception as e:
+                    print("Prefetch failed: {}".format(e))
+                if budget.is_cancelled():
+                    return
+            budget.cancel.wait(LOOKAHEAD_INTERVAL)
+
+    def complete(self, op, event, error=None):
+        """ Journal the final result of the operation """
+        op.result = event
+        op.error = error
+        self.journal.record(op, event)
+        with self.lock:
+            self.done.append(op)
+        self.emit_idle('operation-finished', op,
+                       event == JournalEvent.FINISHED)
+
+    def process_batch(self, ops):
+        """ Resolve the batch and apply everything that doesn't conflict """
+        transactions = self.build_transactions(ops)
+
+        # Report every conflict before we touch anything
+        for transaction in transactions.itervalues():
+            for conflict in transaction.conflicts:
+                print("Transaction conflict: {}".format(conflict))
+
+        # Journal the fate of each operation, merged away or not
+        applied = OrderedDict()
+        for op in ops:
+            transaction = transactions[op.data.get_plugin()]
+            id = op.data.get_id()
+            if transaction.conflicts:
+                self.complete(op, JournalEvent.FAILED,
+                              "\n".join(transaction.conflicts))
+            elif id in transaction.install or id in transaction.remove or \
+                    id in transaction.upgrade:
+                self.journal.record(op, JournalEvent.STARTED)
+                self.emit_idle('operation-started', op)
+                applied.setdefault(transaction, []).append(op)
             else:
-                print("debug: thread is already running")
-        finally:
-            self.thread_lock.release()
+                self.complete(op, JournalEvent.FINISHED)
 
-    def process_queue(self):
-        """ Process the queue until it empties """
-        while not self.queue.opstack.empty():
-            item = self.queue.opstack.get()
-            plugin = item.data.get_plugin()
-            if item.opType == OperationType.INSTALL:
-                plugin.install_item(item.data)
-            elif item.opType == OperationType.REMOVE:
-                plugin.install_item(item.data)
-            elif item.opType == OperationType.UPGRADE:
-                plugin.remove_item(item.data)
-            print("Got item: {}".format(item.data))
-        # Queue ran out
-        print("queue emptied")
-        self.thread_lock.acquire()
+        if not applied:
+            return
+
+        # Download for the next batch while this one is applied
+        budget = self.create_budget()
+        t = Thread(target=self.lookahead, args=(budget,))
+        t.daemon = True
+        t.start()
+
+        for transaction, tops in applied.iteritems():
+            event = JournalEvent.FINISHED
+            error = None
+            try:
+                transaction.plugin.apply_transaction(transaction)
+            except Exception as e:
+                print("Failed to apply transaction: {}".format(e))
+                event = JournalEvent.FAILED
+                error = str(e)
+            for op in tops:
+                self.complete(op, event, error)
+
+        budget.cancel.set()
+
+    def run_once(self):
+        """ Take everything currently queued and apply it on the calling
+            thread, returning the number of operations processed """
+        ops = self.queue.drain()
+        if not ops:
+            return 0
+        with self.lock:
+            self.running = list(ops)
+        self.emit_idle('busy-changed', True)
         try:
-            self.thread_running = False
+            self.process_batch(ops)
         finally:
-            self.thread_lock.release()
+            with self.lock:
+                self.running = []
+            self.emit_idle('busy-changed', False)
+        return len(ops)
+
+    def process_queue(self):
+        """ Worker thread body, runs until shutdown() """
+        while self.queue.wait():
+            try:
+                self.run_once()
+            except Exception as e:
+                # Never let a bad batch take the worker down with it
+                print("Executor batch failed: {}".format(e))
@@ -13,6 +13,7 @@
 
 from gi.repository import Gtk, GObject
 from .plugins.base import PopulationFilter, ProviderItem
+from .storage import ScFrameStorage
 
 
 class ScFeaturedPage(Gtk.Box):
@@ -30,7 +31,8 @@ class ScFeaturedPage(Gtk.Box):
         self.item = item
         id = self.item.get_id()
 
-        image = self.context.appsystem.get_pixbuf_massive(id)
+        image = self.context.appsystem.get_pixbuf_async(
+            id, self.on_icon_loaded, 128)
 
         self.image = Gtk.Image.new_from_pixbuf(image)
         self.image.set_halign(Gtk.Align.START)
@@ -69,6 +71,10 @@ class ScFeaturedPage(Gtk.Box):
         self.action_callout.get_style_context().add_class("flat")
         box.pack_start(self.action_callout, False, False, 0)
 
+    def on_icon_loaded(self, id, pixbuf):
+        """ The real icon has been decoded """
+        self.image.set_from_pixbuf(pixbuf)
+
 
 class ScFeatured(Gtk.EventBox):
     """ Experiment to create a "Featured" view """
@@ -136,6 +142,19 @@ class ScFeatured(Gtk.EventBox):
 
     def add_item(self, id, item, popfilter):
         """ Implement the population storage API """
+        self.add_items([item], popfilter)
+
+    def add_items(self, items, popfilter):
+        for item in items:
+            self.add_page(item)
+        self.navigate(0)
+
+    def clear(self):
+        """ Featured items are only populated once """
+        pass
+
+    def add_page(self, item):
+        """ Add a new page for the item """
         thumb = Gtk.Label("•")
         thumb.get_style_context().add_class("big-thumb")
         thumb.get_style_context().add_class("dim")
@@ -151,7 +170,6 @@ class ScFeatured(Gtk.EventBox):
         page.set_size_request(-1, -1)
         self.pages.append(page)
         self.dots.append(thumb)
-        self.navigate(0)
 
     def on_clicked(self, btn, data=None):
         # Emit click for the currently selected item
@@ -172,6 +190,13 @@ class ScFeatured(Gtk.EventBox):
         self.stack.set_visible_child(self.pages[idx])
         self.idx = idx
 
+        # Get the current and upcoming pages ready for clicking
+        ids = [self.pages[idx].item.get_id()]
+        if len(self.pages) > 1:
+            ids.append(self.pages[(idx + 1) % len(self.pages)].item.get_id())
+        if self.context.prefetcher is not None:
+            self.context.prefetcher.set_visible(self, ids)
+
 
 class ScFeaturedEmbed(Gtk.Revealer):
     """ Just allows wrapping the entire ScFeatured as a GtkRevealer
@@ -180,11 +205,13 @@ class ScFeaturedEmbed(Gtk.Revealer):
 
     widget = None
     loaded = None
+    storage = None
 
     def __init__(self, context):
         Gtk.Revealer.__init__(self)
         self.context = context
         self.loaded = False
+        self.storage = ScFrameStorage(self)
         self.context.connect('loaded', self.on_context_loaded)
         self.widget = ScFeatured(context)
 
@@ -194,14 +221,21 @@ class ScFeaturedEmbed(Gtk.Revealer):
 
     def on_context_loaded(self, context):
         """ Fill the featured view in  """
-        for plugin in self.context.plugins:
-            # Build the featured view
-            plugin.populate_storage(
-                self.widget, PopulationFilter.FEATURED,
-                self.context.appsystem, None)
+        self.context.populate(self.storage, PopulationFilter.FEATURED,
+                              self.context.appsystem)
+
+    def add_items(self, items, popfilter):
+        """ Pass items on to the featured widget, revealing it once we
+            actually have something to show """
+        self.widget.add_items(items, popfilter)
+        if self.loaded:
+            return
         self.loaded = True
         self.slide_down_show()
 
+    def clear(self):
+        self.widget.clear()
+
     def slide_up_hide(self):
         """ Slide up out of view """
         if not self.get_visible() or not self.get_child_visible():
@@ -13,6 +13,7 @@
 
 from gi.repository import Gtk, GObject
 from xng.plugins.base import PopulationFilter, ProviderItem, ProviderCategory
+from xng.storage import ScFrameStorage
 
 
 class ScTileButton(Gtk.Button):
@@ -48,6 +49,7 @@ class ScRecentButton(Gtk.Button):
     """ Prettified button to show a recently updated item """
 
     item = None
+    image = None
 
     def __init__(self, context, item):
         Gtk.Button.__init__(self)
@@ -65,9 +67,10 @@ class ScRecentButton(Gtk.Button):
         lab.set_use_markup(True)
         lab.set_halign(Gtk.Align.START)
 
-        pbuf = context.appsystem.get_pixbuf_only(id)
+        pbuf = context.appsystem.get_pixbuf_async(id, self.on_icon_loaded)
         img = Gtk.Image.new_from_pixbuf(pbuf)
         img.set_margin_end(12)
+        self.image = img
 
         layout.attach(img, 0, 0, 1, 2)
         layout.attach(lab, 1, 0, 1, 1)
@@ -81,6 +84,10 @@ class ScRecentButton(Gtk.Button):
         lab2.set_valign(Gtk.Align.START)
         layout.attach(lab2, 1, 1, 1, 1)
 
+    def on_icon_loaded(self, id, pixbuf):
+        """ The real icon has been decoded """
+        self.image.set_from_pixbuf(pixbuf)
+
 
 class ScHomeView(Gtk.Box):
     """ Main view that the user will interact with on launch """
@@ -89,6 +96,10 @@ class ScHomeView(Gtk.Box):
     categories = None
     recents = None
     recents_home = None
+    storage = None
+
+    # IDs shown in the recent rows, for prefetching
+    recent_ids = None
 
     __gtype_name__ = "ScHomeView"
 
@@ -107,6 +118,7 @@ class ScHomeView(Gtk.Box):
 
         self.context = context
         self.context.connect('loaded', self.on_context_loaded)
+        self.storage = ScFrameStorage(self)
         self.set_margin_top(24)
 
         self.next_items = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
@@ -139,6 +151,7 @@ class ScHomeView(Gtk.Box):
 
         # Somewhere to stuff the Recent rows
         self.recents = dict()
+        self.recent_ids = []
         self.next_items.pack_start(lab, False, False, 0)
         self.recents_home = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
         self.next_items.pack_start(self.recents_home, False, False, 0)
@@ -164,10 +177,9 @@ class ScHomeView(Gtk.Box):
             for cat in plugin.categories():
                 self.add_category(plugin, cat)
 
-            # Build the recently updated view
-            plugin.populate_storage(
-                self, PopulationFilter.RECENT,
-                self.context.appsystem, None)
+        # Build the recently updated view
+        self.context.populate(self.storage, PopulationFilter.RECENT,
+                              self.context.appsystem)
 
     def add_category(self, plugin, category):
         """ Add a main category to our view """
@@ -181,8 +193,23 @@ class ScHomeView(Gtk.Box):
         self.emit_selected_category(btn.category)
 
     def add_item(self, id, item, popfilter):
-        if popfilter == PopulationFilter.RECENT:
+        self.add_items([item], popfilter)
+
+    def add_items(self, items, popfilter):
+        if popfilter != PopulationFilter.RECENT:
+            return
+        for item in items:
             self.add_recent(item)
+            self.recent_ids.append(item.get_id())
+        if self.context.prefetcher is not None:
+            self.context.prefetcher.set_visible(self, self.recent_ids)
+
+    def clear(self):
+        """ Drop the recent rows """
+        for child in self.recents_home.get_children():
+            child.destroy()
+        self.recents = dict()
+        self.recent_ids = []
 
     def maybe_build_row(self, plugin):
         """ Find an appropriate Recent row for the plugin """
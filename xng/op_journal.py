@@ -0,0 +1,168 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+from .util import ensure_dir, atomic_write
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+
+
+class JournalEvent:
+    """ Events recorded in the journal for each operation """
+
+    QUEUED = "queued"
+    STARTED = "started"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+
+class OperationJournal:
+    """ OperationJournal is a write-ahead log of the executor operations
+
+        Every operation is recorded when it is queued, started and once it
+        has finished or failed, as one JSON object per line. Records are
+        handed to a writer thread and appended in batches, so journaling
+        never blocks whoever is queueing.
+
+        On startup the journal is read back and any operation that never
+        finished is returned so the executor can reconcile it with the
+        actual system state. The old journal is only replaced, atomically,
+        once whatever the executor still wants has been queued again.
+    """
+
+    path = None
+    seq = 0
+
+    # Records waiting for the writer thread
+    pending = None
+    cond = None
+
+    # Set while the writer thread has a batch in hand
+    writing = False
+
+    def __init__(self, path):
+        self.path = path
+        self.seq = 0
+        self.pending = []
+        self.cond = threading.Condition(threading.Lock())
+
+    def recover(self):
+        """ Read the journal, returning the queued records of operations
+            that never finished. Must be called before start() """
+        unfinished = OrderedDict()
+        try:
+            with open(self.path, "r") as inp:
+                for line in inp:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn final write
+                        continue
+                    seq = record.get("seq", 0)
+                    self.seq = max(self.seq, seq)
+                    event = record.get("event")
+                    if event == JournalEvent.QUEUED:
+                        unfinished[seq] = record
+                    elif event in [JournalEvent.FINISHED,
+                                   JournalEvent.FAILED]:
+                        unfinished.pop(seq, None)
+        except IOError:
+            pass
+        except Exception as e:
+            print("Unable to read journal {}: {}".format(self.path, e))
+        return unfinished.values()
+
+    def start(self):
+        """ Replace the journal with everything queued since recover(),
+            then start the writer thread """
+        if not ensure_dir(os.path.dirname(self.path)):
+            return
+        with self.cond:
+            batch = self.pending
+            self.pending = []
+        if not self.rewrite(batch):
+            # Keep the old journal, and append to it instead
+            with self.cond:
+                self.pending = batch + self.pending
+        t = threading.Thread(target=self.write_records)
+        t.daemon = True
+        t.start()
+
+    def queued(self, op, plugin_id, item_id):
+        """ Assign the operation its sequence number and journal it """
+        with self.cond:
+            self.seq += 1
+            op.seq = self.seq
+            self.pending.append({
+                "seq": op.seq,
+                "event": JournalEvent.QUEUED,
+                "type": op.opType,
+                "plugin": plugin_id,
+                "item": item_id,
+            })
+            self.cond.notify_all()
+
+    def record(self, op, event):
+        """ Journal a state change for a queued operation """
+        with self.cond:
+            self.pending.append({"seq": op.seq, "event": event})
+            self.cond.notify_all()
+
+    def rewrite(self, records):
+        """ Atomically replace the journal with the records """
+        try:
+            atomic_write(self.path, "".join(json.dumps(x) + "\n"
+                                            for x in records), sync=True)
+        except Exception as e:
+            print("Unable to write journal {}: {}".format(self.path, e))
+            return False
+        return True
+
+    def write_records(self):
+        """ Writer thread body, will effectively run forever """
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                batch = self.pending
+                self.pending = []
+                self.writing = True
+            try:
+                with open(self.path, "a") as out:
+                    out.write("".join(json.dumps(x) + "\n" for x in batch))
+                    out.flush()
+                    os.fsync(out.fileno())
+            except Exception as e:
+                print("Unable to write journal {}: {}".format(self.path, e))
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        """ Wait until everything journaled so far is on disk, returning
+            False if that didn't happen within the timeout """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.cond:
+            while self.pending or self.writing:
+                if deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
@@ -11,7 +11,9 @@
 #  (at your option) any later version.
 #
 
-import Queue
+import heapq
+import threading
+import time
 
 
 class OperationType:
@@ -30,6 +32,15 @@ class Operation:
     opType = 0
     data = None
 
+    # Assigned by the OperationJournal
+    seq = 0
+
+    # JournalEvent.FINISHED or FAILED once the executor is done with it
+    result = None
+
+    # Why the operation failed, for the user
+    error = None
+
     def __cmp__(self, other):
         """ Ensure we can make other items higher priority ... """
         return cmp(self.opType, other.opType)
@@ -39,29 +50,83 @@ class Operation:
         self.opType = opType
 
     @staticmethod
-    def Install(ids):
-        return Operation(ids, OperationType.INSTALL)
+    def Install(item):
+        return Operation(item, OperationType.INSTALL)
 
     @staticmethod
-    def Remove(ids):
-        return Operation(ids, OperationType.REMOVE)
+    def Remove(item):
+        return Operation(item, OperationType.REMOVE)
 
     @staticmethod
-    def Upgrade(ids):
-        return Operation(ids, OperationType.UPGRADE)
+    def Upgrade(item):
+        return Operation(item, OperationType.UPGRADE)
 
 
 class OperationQueue:
     """ OperationQueue is used to apply any pending packaging operations
         within the Software Center one after another
+
+        Operations are kept in priority order, and in the order they were
+        pushed within the same priority. Consumers block in wait() until
+        there is something to take, or the queue has been closed.
     """
 
-    # We enqueue pending operations here
+    # (opType, seq, op) heap of pending operations
     opstack = None
+    seq = 0
+
+    cond = None
+    closed = False
 
     def __init__(self):
-        self.opstack = Queue.PriorityQueue(0)
+        self.opstack = []
+        self.seq = 0
+        self.cond = threading.Condition(threading.Lock())
+        self.closed = False
 
     def push_operation(self, op):
         """ Set up an operation to be applied """
-        self.opstack.put(op)
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.opstack, (op.opType, self.seq, op))
+            self.cond.notify()
+
+    def peek(self):
+        """ Look ahead at everything queued, in priority order, without
+            taking anything """
+        with self.cond:
+            return [x[2] for x in sorted(self.opstack)]
+
+    def count(self):
+        with self.cond:
+            return len(self.opstack)
+
+    def drain(self):
+        """ Take everything currently queued, in priority order """
+        with self.cond:
+            ret = [x[2] for x in sorted(self.opstack)]
+            self.opstack = []
+            return ret
+
+    def wait(self, timeout=None):
+        """ Block until something is queued, returning False if the queue
+            was closed or nothing turned up within the timeout """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.cond:
+            while not self.opstack and not self.closed:
+                if deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return bool(self.opstack) and not self.closed
+
+    def close(self):
+        """ Wake up anyone waiting, the queue is going away """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
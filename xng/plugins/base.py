@@ -11,7 +11,11 @@
 #  (at your option) any later version.
 #
 
+from ..progress import ProgressTracker
 from gi.repository import GObject
+from collections import OrderedDict
+import threading
+import time
 
 
 class PopulationFilter:
@@ -113,10 +117,146 @@ class ProviderStorage(GObject.Object):
     def add_item(self, id, item, popfilter):
         raise RuntimeError("implement add_item")
 
+    def add_items(self, items, popfilter):
+        """ Add a batch of items in one go. Storage should override this
+            when batches can be handled more efficiently """
+        for item in items:
+            self.add_item(item.get_id(), item, popfilter)
+
     def clear(self):
         raise RuntimeError("implement clear")
 
 
+class ProviderPlan:
+    """ Everything a plugin needs to install to satisfy a request, and
+        what it will cost in bytes """
+
+    items = None
+    download_size = 0
+    installed_size = 0
+
+    def __init__(self, items, download_size=0, installed_size=0):
+        self.items = items
+        self.download_size = download_size
+        self.installed_size = installed_size
+
+
+class ProviderTransaction:
+    """ A ProviderTransaction is the merged set of pending operations for
+        a single plugin, so that they can be resolved and applied in one go
+
+        Requests are counted per item, so installing and removing the same
+        item cancels out regardless of the order they were queued in.
+    """
+
+    plugin = None
+
+    # id -> item, the final sets once resolved
+    install = None
+    remove = None
+    upgrade = None
+
+    # Human readable reasons we can't apply this transaction
+    conflicts = None
+
+    # id -> [item, install count - remove count, upgrade requested]
+    requests = None
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.install = OrderedDict()
+        self.remove = OrderedDict()
+        self.upgrade = OrderedDict()
+        self.conflicts = []
+        self.requests = OrderedDict()
+
+    def get_request(self, item):
+        id = item.get_id()
+        if id not in self.requests:
+            self.requests[id] = [item, 0, False]
+        return self.requests[id]
+
+    def add_install(self, item):
+        self.get_request(item)[1] += 1
+
+    def add_remove(self, item):
+        self.get_request(item)[1] -= 1
+
+    def add_upgrade(self, item):
+        self.get_request(item)[2] = True
+
+    def resolve(self):
+        """ Compute the final item sets and any conflicts """
+        for id, (item, net, upgrade) in self.requests.iteritems():
+            if upgrade:
+                if net < 0:
+                    self.conflicts.append(
+                        "{} is queued for both upgrade and removal".format(
+                            id))
+                    continue
+                # Installing something we're upgrading is the upgrade
+                self.upgrade[id] = item
+            elif net > 0:
+                self.install[id] = item
+            elif net < 0:
+                self.remove[id] = item
+
+    def is_empty(self):
+        return not (self.install or self.remove or self.upgrade)
+
+
+class ProviderPrefetchBudget:
+    """ Limits for downloading ahead of the executor, shared between all
+        plugins for the duration of a single transaction
+
+        The bandwidth limit is in bytes per second (0 for no limit) and the
+        disk limit is the total size we may download ahead of time.
+    """
+
+    max_rate = 0
+    max_bytes = 0
+    used_bytes = 0
+
+    # Time and bytes transferred since we started, for throttling
+    started = 0
+    transferred = 0
+
+    # Set once the executor moves on
+    cancel = None
+
+    def __init__(self, max_rate, max_bytes):
+        self.max_rate = max_rate
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.started = time.time()
+        self.transferred = 0
+        self.cancel = threading.Event()
+
+    def is_cancelled(self):
+        return self.cancel.is_set()
+
+    def reserve(self, nbytes):
+        """ Claim disk space for a download, returns False if it won't
+            fit within the budget """
+        if self.used_bytes + nbytes > self.max_bytes:
+            return False
+        self.used_bytes += nbytes
+        return True
+
+    def throttle(self, nbytes):
+        """ Account for transferred bytes, sleeping as needed to keep to
+            the bandwidth limit. Raises once the budget is cancelled """
+        if self.is_cancelled():
+            raise RuntimeError("Prefetch cancelled")
+        self.transferred += nbytes
+        if self.max_rate <= 0:
+            return
+        ahead = float(self.transferred) / self.max_rate - \
+            (time.time() - self.started)
+        if ahead > 0:
+            self.cancel.wait(ahead)
+
+
 class ProviderPlugin(GObject.Object):
     """ A ProviderPlugin provides its own managemenet and access to the
         underlying package management system to provide the options to the
@@ -125,8 +265,29 @@ class ProviderPlugin(GObject.Object):
 
     __gtype_name__ = "NxProviderPlugin"
 
+    appsystem = None
+
+    # Plugins report the progress of their operations here
+    progress = None
+
     def __init__(self):
         GObject.Object.__init__(self)
+        self.progress = ProgressTracker()
+
+    def get_id(self):
+        """ Stable identifier for the plugin, i.e. for the journal """
+        return self.__gtype_name__
+
+    def set_appsystem(self, appsystem):
+        """ Called once the AppSystem has been loaded, so that plugins can
+            make use of AppStream data outside of population """
+        self.appsystem = appsystem
+
+    def prepare(self):
+        """ Build anything population needs ahead of time, i.e. caches
+            that are slow to build from scratch. Called once during startup
+            after set_appsystem, and the UI is only shown once it's done """
+        pass
 
     def populate_storage(self, storage, popfilter, extra, cancel):
         """ Populate storage using the given filter """
@@ -144,6 +305,11 @@ class ProviderPlugin(GObject.Object):
         """ Return the categories known by this plugin """
         return []
 
+    def get_item(self, id):
+        """ Return the item for the given ID with its current status, or
+            None if the plugin doesn't know about it """
+        return None
+
     def install_item(self, item):
         raise RuntimeError("implement install_item")
 
@@ -153,6 +319,27 @@ class ProviderPlugin(GObject.Object):
     def upgrade_item(self, item):
         raise RuntimeError("implement upgrade_item")
 
+    def prefetch_items(self, items, budget):
+        """ Download whatever is needed to install or upgrade the items
+            ahead of time, within the ProviderPrefetchBudget. Called from
+            the executor while it applies an earlier transaction """
+        pass
+
+    def check_transaction(self, transaction):
+        """ Add any reasons the transaction cannot be applied to its
+            conflicts, before anything at all is applied """
+        pass
+
+    def apply_transaction(self, transaction):
+        """ Apply a resolved transaction. Plugins that can do everything
+            in a single native transaction should override this """
+        if transaction.remove:
+            self.remove_item(transaction.remove.values())
+        if transaction.upgrade:
+            self.upgrade_item(transaction.upgrade.values())
+        if transaction.install:
+            self.install_item(transaction.install.values())
+
     def plan_install_item(self, item):
         """ Implementation needs to return a list of all items to be installed
             to satisfy the installation of this item
@@ -161,6 +348,16 @@ class ProviderPlugin(GObject.Object):
         """
         raise RuntimeError("implement plan_install_item")
 
+    def plan_install(self, items):
+        """ Plan the installation of all of the items together, returning
+            a ProviderPlan. Plugins that know the sizes involved or can
+            resolve several items at once should override this """
+        ret = OrderedDict()
+        for item in items:
+            for planned in self.plan_install_item(item):
+                ret[planned.get_id()] = planned
+        return ProviderPlan(ret.values())
+
     def plan_remove_item(self, item):
         """ Implementation needs to return a list of all items to be removed
             to satisfy the removal of this item
@@ -191,18 +388,18 @@ class ProviderItem(GObject.Object):
 
     def remove_status(self, st):
         """ Remove a status field """
-        self.status ^= st
+        self.status = self.get_status() & ~st
 
     def add_status(self, st):
         """ Add a status field """
-        self.status |= st
+        self.status = self.get_status() | st
 
     def set_status(self, st):
         """ Set the complete status """
         self.status = st
 
     def has_status(self, st):
-        return self.status & st == st
+        return self.get_status() & st == st
 
     def get_id(self):
         """ Every item should return their unique ID so that they can
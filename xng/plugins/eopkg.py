@@ -13,63 +13,28 @@
 
 from .base import ProviderPlugin, ProviderItem, ProviderSource, \
     ProviderCategory
-from .base import PopulationFilter, ItemStatus
-from gi.repository import AppStreamGlib as As
+from .base import PopulationFilter, ItemStatus, ProviderPlan
+from .eopkg_snapshot import EopkgSnapshot, get_snapshot_key
+from .eopkg_recent import EopkgRecencyIndex
+from .eopkg_revdeps import EopkgRevDepGraph
+from ..progress import ProgressPhase
+from ..util import get_user_cache_dir, ensure_dir, atomic_write
+from ..util.http import ScHttpPool
+from ..util.lru import LruCache
+from ..util.search import SearchIndex
 from gi.repository import Gtk
+from solus_sc.upgrades import EopkgUpgradeTable
 import pisi
 from pisi.operations.install import plan_install_pkg_names
+from pisi.operations.upgrade import plan_upgrade
+import hashlib
+import os
+import threading
 import time
+import weakref
 import comar
 
 
-def find_have_data(adb, store):
-    """ Find all packages with AppStream data """
-    ret = []
-
-    for key in adb.list_packages(None):
-        app = store.get_app_by_pkgname(key)
-        if not app:
-            continue
-        # Only want desktop apps here
-        if app.get_kind() != As.AppKind.DESKTOP:
-            continue
-        ret.append(key)
-    return ret
-
-
-def filter_packages_by_data(adb, store):
-    """ Return available packages by appdata only """
-    pkgs = find_have_data(adb, store)
-    ret = []
-    for item in pkgs:
-        pkg = adb.get_package(item)
-        ret.append(pkg)
-    return ret
-
-
-def unmangle_date(tstamp):
-    try:
-        ret = time.strptime(tstamp, "%Y-%m-%d")
-        return ret
-    except Exception:
-        # Probably because old eopkg pspec
-        pass
-    try:
-        ret = time.strptime(tstamp, "%m-%d-%Y")
-        return ret
-    except Exception:
-        return 0
-
-
-def history_sort(pkgA, pkgB):
-    dateA = pkgA.history[0].date
-    dateB = pkgB.history[0].date
-    aa = unmangle_date(dateA)
-    ab = unmangle_date(dateB)
-
-    return cmp(aa, ab)
-
-
 # Mandatory components, removing will cause imminent death
 essential_components = [
     "system.base",
@@ -138,6 +103,26 @@ ICON_MAPS = {
 }
 
 
+# Seconds we'll wait without hearing anything from eopkg before giving up
+# on an operation
+EOPKG_OP_TIMEOUT = 10 * 60
+
+# Prefetched packages nobody installed are dropped after a day
+PREFETCH_MAX_AGE = 24 * 60 * 60
+
+# Package names we keep resolved install plans for
+PLAN_CACHE_SIZE = 4096
+
+# Items are pushed to the storage in batches of this size
+POPULATE_BATCH_SIZE = 25
+
+# Field weights used when building the search index
+SEARCH_WEIGHT_NAME = 10.0
+SEARCH_WEIGHT_SUMMARY = 4.0
+SEARCH_WEIGHT_KEYWORDS = 3.0
+SEARCH_WEIGHT_DESCRIPTION = 1.0
+
+
 def is_essential_package(pkg):
     """ Essential packages should NEVER be removed by the user. """
     if pkg.partOf in essential_components:
@@ -182,6 +167,20 @@ class EopkgGroup(ProviderCategory):
         self.group = group
         self.children = []
 
+    def get_children(self):
+        return self.children
+
+    def get_name(self):
+        return str(self.group.localName)
+
+    def get_id(self):
+        return str(self.id)
+
+    def get_icon_name(self):
+        """ Return internal eopkg group icon name
+
+            Groups are built off the main thread, so we only look at the
+            icon theme here, once the UI asks """
         # Just replace the icon on the fly with something that
         # fits better into the current theme
         settings = Gtk.Settings.get_default()
@@ -202,22 +201,8 @@ class EopkgGroup(ProviderCategory):
 
         icon = str(self.group.icon)
         if icon in replacements:
-            self.icon = replacements[icon]
-        else:
-            self.icon = icon
-
-    def get_children(self):
-        return self.children
-
-    def get_name(self):
-        return str(self.group.localName)
-
-    def get_id(self):
-        return str(self.id)
-
-    def get_icon_name(self):
-        """ Return internal eopkg group icon name """
-        return self.icon
+            return replacements[icon]
+        return icon
 
 
 class EopkgComponent(ProviderCategory):
@@ -243,6 +228,19 @@ class EopkgComponent(ProviderCategory):
         return "package-x-generic"
 
 
+# COMAR status commands and what they mean for progress
+COMAR_PHASES = {
+    "updatingrepo": ProgressPhase.UPDATING_REPO,
+    "extracting": ProgressPhase.EXTRACTING,
+    "configuring": ProgressPhase.CONFIGURING,
+    "installing": ProgressPhase.INSTALLING,
+    "removing": ProgressPhase.REMOVING,
+    "installed": ProgressPhase.INSTALLED,
+    "removed": ProgressPhase.REMOVED,
+    "upgraded": ProgressPhase.UPGRADED,
+}
+
+
 class EopkgPlugin(ProviderPlugin):
     """ EopkgPlugin interfaces with the eopkg package manager """
 
@@ -252,18 +250,67 @@ class EopkgPlugin(ProviderPlugin):
     compDB = None
     cats = None
 
+    # Compact snapshot of the package metadata used for listings
+    snapshot = None
+    db_lock = None
+
+    # Ranked search index, rebuilt whenever the snapshot changes
+    search_index = None
+    search_key = None
+    search_lock = None
+
+    # Recently updated/added apps, rebuilt whenever the snapshot changes
+    recency_index = None
+    recency_lock = None
+
     repos = None
 
     # pisi crap
     link = None
     pmanager = None
 
+    # Set once eopkg reports the current operation as done
+    op_done = None
+
+    # Method and token of the call in progress, None when idle
+    op_method = None
+    op_token = None
+
+    # Last time eopkg told us anything, why the operation failed and the
+    # last error eopkg broadcast while it ran
+    op_active = None
+    op_error = None
+    op_message = None
+
+    # Downloads packages ahead of the executor
+    prefetch_http = None
+
+    # name -> EopkgItem, for as long as anything still holds on to them
+    items = None
+    items_lock = None
+
+    # Installed dependency graph, updated whenever the snapshot changes
+    revdeps = None
+
+    # (frozenset of requested names, snapshot key) -> planned names
+    plan_cache = None
+
+    # Upgrade state of the installed packages for the current snapshot
+    upgrade_table = None
+
     __gtype_name__ = "NxEopkgPlugin"
 
     def __init__(self):
         ProviderPlugin.__init__(self)
-        self.availDB = pisi.db.packagedb.PackageDB()
-        self.installDB = pisi.db.installdb.InstallDB()
+        self.db_lock = threading.RLock()
+        self.search_lock = threading.Lock()
+        self.recency_lock = threading.Lock()
+        self.op_done = threading.Event()
+        self.prefetch_http = ScHttpPool()
+        self.items = weakref.WeakValueDictionary()
+        self.items_lock = threading.Lock()
+        self.revdeps = EopkgRevDepGraph()
+        self.plan_cache = LruCache(PLAN_CACHE_SIZE, len)
         self.repoDB = pisi.db.repodb.RepoDB()
         self.groupDB = pisi.db.groupdb.GroupDB()
         self.compDB = pisi.db.componentdb.ComponentDB()
@@ -274,6 +321,102 @@ class EopkgPlugin(ProviderPlugin):
         self.link.listenSignals("System.Manager", self.dbus_callback)
 
         self.build_categories()
+        self.snapshot = EopkgSnapshot(get_snapshot_key(self.repoDB))
+
+    def get_avail_db(self):
+        """ The PackageDB is only loaded once something needs full detail """
+        with self.db_lock:
+            if self.availDB is None:
+                self.availDB = pisi.db.packagedb.PackageDB()
+            return self.availDB
+
+    def get_install_db(self):
+        """ The InstallDB is only loaded once something needs full detail """
+        with self.db_lock:
+            if self.installDB is None:
+                self.installDB = pisi.db.installdb.InstallDB()
+            return self.installDB
+
+    def get_snapshot(self):
+        """ Return the package snapshot, rebuilding it from pisi if the
+            repos or installdb changed since it was written """
+        with self.db_lock:
+            if not self.snapshot.is_valid():
+                self.snapshot.rebuild(self.get_avail_db(),
+                                      self.get_install_db())
+            return self.snapshot
+
+    def refresh_snapshot(self):
+        """ Check if the snapshot key changed, i.e. after a transaction """
+        key = get_snapshot_key(self.repoDB)
+        with self.db_lock:
+            if key == self.snapshot.key:
+                return
+            self.snapshot = EopkgSnapshot(key)
+            # Any loaded pisi state is now stale too
+            self.availDB = None
+            self.installDB = None
+
+        # Rebuilding the snapshot is expensive, keep it off the main loop
+        thr = threading.Thread(target=self.update_items)
+        thr.daemon = True
+        thr.start()
+
+    def update_items(self):
+        """ Bring the live items up to date with the snapshot, only those
+            whose packages actually changed lose their state """
+        snapshot = self.get_snapshot()
+        with self.items_lock:
+            items = self.items.values()
+        for item in items:
+            item.set_record(snapshot.get(item.get_id()), snapshot.key)
+
+    def prepare(self):
+        """ Build the snapshot and the indexes on top of it, so that a cold
+            start doesn't spend the population deadline on them """
+        self.get_search_index()
+        if self.appsystem is not None:
+            self.get_recency_index(self.appsystem)
+
+    def get_search_index(self):
+        """ Return the search index for the current snapshot, loading it
+            from the cache or building it as required """
+        snapshot = self.get_snapshot()
+        key = snapshot.key
+        if self.appsystem is not None:
+            key += ":appstream"
+
+        with self.search_lock:
+            if self.search_key == key:
+                return self.search_index
+            path = get_user_cache_dir("eopkg-search.idx")
+            index = SearchIndex.load(path, key)
+            if index is None:
+                index = self.build_search_index(snapshot)
+                index.save(path, key)
+            self.search_index = index
+            self.search_key = key
+            return index
+
+    def build_search_index(self, snapshot):
+        """ Tokenize every package into a new SearchIndex """
+        index = SearchIndex()
+        for record in snapshot.records():
+            fields = [
+                (record.name, SEARCH_WEIGHT_NAME),
+                (record.summary, SEARCH_WEIGHT_SUMMARY),
+            ]
+            pkg = self.get_package(record.name,
+                                   bool(record.installed_release))
+            if pkg is not None:
+                fields.append((str(pkg.description),
+                               SEARCH_WEIGHT_DESCRIPTION))
+            if self.appsystem is not None:
+                for keyword in self.appsystem.get_keywords(record.name):
+                    fields.append((keyword, SEARCH_WEIGHT_KEYWORDS))
+            index.add_document(record.name, record.name, fields)
+        index.finish()
+        return index
 
     def build_categories(self):
         """ Find all of our possible categories and nest them. """
@@ -306,7 +449,7 @@ class EopkgPlugin(ProviderPlugin):
 
     def populate_storage(self, storage, popfilter, extra, cancel):
         if popfilter == PopulationFilter.INSTALLED:
-            return self.populate_installed(storage)
+            return self.populate_installed(storage, cancel)
         elif popfilter == PopulationFilter.SEARCH:
             return self.populate_search(storage, extra, cancel)
         elif popfilter == PopulationFilter.RECENT:
@@ -316,172 +459,576 @@ class EopkgPlugin(ProviderPlugin):
         elif popfilter == PopulationFilter.FEATURED:
             return self.populate_featured(storage, extra)
         elif popfilter == PopulationFilter.CATEGORY:
-            return self.populate_category(storage, extra)
+            return self.populate_category(storage, extra, cancel)
+
+    def get_recency_index(self, appsystem):
+        """ Return the recency index for the current snapshot, loading it
+            from the cache or building it as required """
+        snapshot = self.get_snapshot()
+        with self.recency_lock:
+            index = self.recency_index
+            if index is not None and index.key == snapshot.key:
+                return index
+            previous = EopkgRecencyIndex.load()
+            if previous is not None and previous.key == snapshot.key:
+                self.recency_index = previous
+                return previous
+            index = EopkgRecencyIndex(snapshot.key)
+            index.build(snapshot, appsystem, previous)
+            index.save()
+            self.recency_index = index
+            return index
+
+    def populate_names(self, storage, names, popfilter, cancel=None):
+        """ Add the named packages to the storage in batches, stopping as
+            soon as we're cancelled """
+        batch = []
+        for name in names:
+            # Check on each item if we need to bail NOW
+            if cancel is not None and cancel.is_set():
+                return
+            item = self.build_item(name)
+            if item is None:
+                continue
+            batch.append(item)
+            if len(batch) >= POPULATE_BATCH_SIZE:
+                storage.add_items(batch, popfilter)
+                batch = []
+        if batch:
+            storage.add_items(batch, popfilter)
 
     def populate_recent(self, storage, appsystem):
         """ Populate home view with recently updated packages """
-
         limit = 20  # Arbitrary right now
-
-        inp = filter_packages_by_data(self.availDB, appsystem.store)
-        inp.sort(history_sort, reverse=True)
-        if len(inp) > limit:
-            inp = inp[0:limit]
-
-        for pkg in inp:
-            item = self.build_item(pkg.name)
-            storage.add_item(item.get_id(), item, PopulationFilter.RECENT)
+        names = self.get_recency_index(appsystem).get_recent(limit)
+        self.populate_names(storage, names, PopulationFilter.RECENT)
 
     def populate_new(self, storage, appsystem):
-        """ Populate home view with recently uploaded packages """
-
-        # Hack for demo
-        news = [
-            "gnome-weather",
-            "gnome-mpv",
-            "kdenlive",
-            "hexchat",
-            "dustrac",
-        ]
-
-        for i in news:
-            item = self.build_item(i)
-            storage.add_item(item.get_id(), item, PopulationFilter.NEW)
+        """ Populate home view with packages added since the last refresh """
+        limit = 10
+        names = self.get_recency_index(appsystem).get_added(limit)
+        self.populate_names(storage, names, PopulationFilter.NEW)
 
     def populate_featured(self, storage, appsystem):
-        """ Populate home view with "hot" packages """
-
-        # Hack for demo
-        news = [
-            "sayonara-player",
-            "pitivi",
-            "libreoffice-writer",
-            "kdeconnect",
-            "polari",
-            "tilix",
-            "inkscape",
-            "gnome-boxes",
-        ]
-
-        for i in news:
-            item = self.build_item(i)
-            storage.add_item(item.get_id(), item, PopulationFilter.NEW)
+        """ Populate home view with "hot" packages, i.e. recently updated
+            apps that have screenshots to show off """
+        limit = 8
+        names = self.get_recency_index(appsystem).get_featured(limit)
+        self.populate_names(storage, names, PopulationFilter.FEATURED)
 
     def populate_search(self, storage, term, cancel):
-        """ Attempt to search for a given term in the DB """
-        # Trick eopkg into searching through spaces and hyphens
-        term = term.replace(" ", "[-_ ]")
+        """ Search the index for a term, results are added in rank order """
+        names = self.get_search_index().search(term)
+        self.populate_names(storage, names, PopulationFilter.SEARCH, cancel)
 
-        try:
-            srslt = set(self.availDB.search_package([term]))
-            srslt.update(self.installDB.search_package([term]))
-        except Exception as e:
-            # Invalid regex, basically, from someone smashing FIREFOX????
-            print(e)
-            return
-
-        for item in srslt:
-            # Check on each item if we need to bail NOW
-            if cancel.is_set():
-                print("Cancelled?!?")
-                return
-
-            pkg = self.build_item(item)
-            storage.add_item(pkg.get_id(), pkg, PopulationFilter.SEARCH)
-        print("eopkg done!")
-
-    def populate_installed(self, storage):
+    def populate_installed(self, storage, cancel):
         """ Populate from the installed filter """
-        for pkgID in self.installDB.list_installed():
-            pkg = self.build_item(pkgID)
-            storage.add_item(pkg.get_id(), pkg, PopulationFilter.INSTALLED)
+        names = self.get_snapshot().list_installed()
+        self.populate_names(storage, names, PopulationFilter.INSTALLED,
+                            cancel)
 
-    def populate_category(self, storage, category):
-        """ Ask componentDB for all packages in the given component """
-        pkgs = self.compDB.get_packages(category.get_id(), None, False)
-        for pkgID in pkgs:
-            pkg = self.build_item(pkgID)
-            storage.add_item(pkg.get_id(), pkg, PopulationFilter.CATEGORY)
+    def populate_category(self, storage, category, cancel):
+        """ Ask the snapshot for all packages in the given component """
+        snapshot = self.get_snapshot()
+        names = snapshot.get_component_packages(category.get_id())
+        self.populate_names(storage, names, PopulationFilter.CATEGORY,
+                            cancel)
 
     def build_item(self, name):
-        """ Build a complete item definition """
-        avail = None
-        installed = None
-        if self.availDB.has_package(name):
-            avail = self.availDB.get_package(name)
-        if self.installDB.has_package(name):
-            installed = self.installDB.get_package(name)
-        item = EopkgItem(installed, avail)
+        """ Return the item for name, reusing the existing item if anything
+            still holds on to it """
+        snapshot = self.get_snapshot()
+        with self.items_lock:
+            item = self.items.get(name)
+        if item is not None and item.key == snapshot.key:
+            return item
+
+        record = snapshot.get(name)
+        if record is None:
+            return None
+        if item is not None:
+            item.set_record(record, snapshot.key)
+            return item
+
+        item = EopkgItem(record, snapshot.key)
         item.parent_plugin = self
+        with self.items_lock:
+            # Another thread may have beaten us to it
+            existing = self.items.get(name)
+            if existing is not None:
+                return existing
+            self.items[name] = item
         return item
 
-    def plan_install_item(self, item):
-        """ Plan the installation of a given item """
-        (pg, pkgs) = plan_install_pkg_names([item.get_id()])
-        # We only want the package set, not the graph
+    def get_item(self, id):
+        return self.build_item(id)
+
+    def get_package(self, name, installed):
+        """ Return the full pisi package for name, if it exists """
+        if installed:
+            db = self.get_install_db()
+        else:
+            db = self.get_avail_db()
+        if not db.has_package(name):
+            return None
+        return db.get_package(name)
+
+    def get_upgrade_table(self):
+        """ Return the upgrade table for the current snapshot. Releases
+            come from the snapshot, replacements from the PackageDB """
+        snapshot = self.get_snapshot()
+        with self.db_lock:
+            table = self.upgrade_table
+            if table is None or table.key != snapshot.key:
+                releases = dict((x.name, (x.release, x.installed_release))
+                                for x in snapshot.records()
+                                if x.installed_release)
+                db = self.get_avail_db()
+                table = EopkgUpgradeTable(releases, db.get_replaces(),
+                                          db.get_obsoletes(), snapshot.key)
+                self.upgrade_table = table
+            return table
+
+    def get_revdeps(self):
+        """ Return the dependency graph for the current snapshot """
+        snapshot = self.get_snapshot()
+        with self.db_lock:
+            if self.revdeps.key != snapshot.key:
+                self.revdeps.update(self.get_install_db(), snapshot,
+                                    is_essential_package)
+            return self.revdeps
+
+    def plan_remove_item(self, item):
+        """ Plan the removal of the item and everything depending on it """
         ret = []
-        for name in pkgs:
+        for name in self.get_revdeps().plan_remove(item.get_id()):
             ret.append(self.build_item(name))
         return ret
 
+    def is_removal_protected(self, name):
+        """ Would removing the package take out an essential package """
+        return self.get_revdeps().is_protected(name)
+
+    def plan_install_names(self, names):
+        """ Names of every package needed to install the named packages,
+            resolved once per snapshot """
+        key = (frozenset(names), self.get_snapshot().key)
+        ret = self.plan_cache.get(key)
+        if ret is not None:
+            return ret
+        with self.db_lock:
+            # We only want the package set, not the graph
+            ret = tuple(plan_install_pkg_names(list(key[0]))[1])
+        self.plan_cache.put(key, ret)
+        return ret
+
+    def plan_install(self, items):
+        """ Resolve the installation of all of the items together """
+        snapshot = self.get_snapshot()
+        ret = []
+        download = 0
+        installed = 0
+        for name in self.plan_install_names([x.get_id() for x in items]):
+            record = snapshot.get(name)
+            if record is not None:
+                download += int(record.packageSize or 0)
+                installed += int(record.installedSize or 0)
+            ret.append(self.build_item(name))
+        return ProviderPlan(ret, download, installed)
+
+    def plan_install_item(self, item):
+        """ Plan the installation of a given item """
+        return self.plan_install([item]).items
+
     def dbus_callback(self, package, signal, args):
-        """ eopkg/pisi talked to us via COMAR """
-        print("signal: {} (args: {})".format(signal, args))
+        """ eopkg/pisi talked to us via COMAR. Signals are broadcast to
+            every client, so only those about our own call may end it """
+        if self.op_token is None:
+            return
+        self.op_active = time.time()
+        if signal == "status" and args:
+            phase = COMAR_PHASES.get(args[0])
+            if phase is not None:
+                what = args[1] if len(args) > 1 else None
+                self.progress.set_phase(phase, what)
+            return
+        elif signal == "progress" and args:
+            # fetching, file, ?, speed, speed unit, downloaded, size
+            if args[0] == "fetching" and len(args) >= 7:
+                self.progress.fetched(args[1], int(args[5]), int(args[6]))
+            return
+
+        if signal == "finished" and args:
+            # i.e. System.Manager.installPackage
+            if str(args[0]).split(".")[-1] == self.op_method:
+                self.complete_operation(self.op_token, None)
+        elif signal == "error":
+            # The call itself fails once eopkg gives up
+            self.op_message = " ".join(str(x) for x in args or [])
+
+    def reply_callback(self, token, exception):
+        """ COMAR replied to the call made with token """
+        if exception is None:
+            self.complete_operation(token, None)
+        elif exception == "auth":
+            self.complete_operation(token, "Not authorized")
+        else:
+            self.complete_operation(token, self.op_message or str(exception))
+
+    def complete_operation(self, token, error):
+        """ The call made with token succeeded, or failed with error """
+        if token is None or token is not self.op_token or \
+                self.op_done.is_set():
+            return
+        if error is None:
+            self.refresh_snapshot()
+            self.progress.finish(True)
+        else:
+            self.op_error = error
+            self.progress.finish(False)
+        self.op_done.set()
+
+    def get_download_size(self, names):
+        """ Bytes we expect eopkg to download for the packages """
+        cache_dir = pisi.context.config.cached_packages_dir()
+        total = 0
+        with self.db_lock:
+            for name in names:
+                try:
+                    (pkg, url) = self.get_package_url(name)
+                except Exception:
+                    continue
+                path = os.path.join(cache_dir, os.path.basename(url))
+                if not os.path.exists(path):
+                    total += int(pkg.packageSize)
+        return total
+
+    def get_prefetch_dir(self):
+        return get_user_cache_dir("packages")
+
+    def get_prefetched(self, names):
+        """ Return the verified local files for all of the packages, or None
+            unless every one of them was prefetched """
+        wanted = []
+        prefetch_dir = self.get_prefetch_dir()
+        with self.db_lock:
+            for name in names:
+                try:
+                    (pkg, url) = self.get_package_url(name)
+                except Exception:
+                    return None
+                path = os.path.join(prefetch_dir, os.path.basename(url))
+                if not os.path.exists(path):
+                    return None
+                wanted.append((path, str(pkg.packageHash)))
+
+        # Check them again, they sat in the user's cache for a while
+        for (path, sha1) in wanted:
+            if get_file_sha1(path) != sha1:
+                print("Dropping corrupt prefetch {}".format(path))
+                os.unlink(path)
+                return None
+        return [x[0] for x in wanted]
+
+    def forget_prefetched(self, files):
+        """ The files were installed, we don't need them any more """
+        for path in files:
+            try:
+                os.unlink(path)
+            except Exception as e:
+                print("Unable to remove {}: {}".format(path, e))
+
+    def run_files_or_names(self, method, items, names):
+        """ Install everything from prefetched files if we have them all,
+            otherwise let eopkg run the named method and download them
+            itself """
+        files = self.get_prefetched(names)
+        if files is None:
+            self.run_operation(method, [x.get_id() for x in items],
+                               len(names), self.get_download_size(names))
+            return
+        self.run_operation("installPackage", files, len(names), 0)
+        self.forget_prefetched(files)
+
+    def run_operation(self, method, targets, count, nbytes):
+        """ Run the named eopkg method for all of the targets (package
+            names or files), blocking until it completes. Only call this
+            from the executor thread.
+
+            count is the number of packages eopkg will end up touching and
+            nbytes how much it will download, for progress reporting.
+            Raises if the operation failed, or if eopkg went quiet for too
+            long """
+        token = object()
+        self.op_done.clear()
+        self.op_error = None
+        self.op_message = None
+        self.op_method = method
+        self.op_active = time.time()
+        self.op_token = token
+        self.progress.begin(count, nbytes)
+
+        def reply(package, exception, result):
+            self.reply_callback(token, exception)
+
+        try:
+            getattr(self.pmanager, method)(",".join(targets), async=reply)
+            while not self.op_done.wait(1.0):
+                if time.time() - self.op_active > EOPKG_OP_TIMEOUT:
+                    self.progress.finish(False)
+                    raise RuntimeError("No response from eopkg in {}s".format(
+                        EOPKG_OP_TIMEOUT))
+        finally:
+            self.op_token = None
+        if self.op_error is not None:
+            raise RuntimeError(self.op_error)
 
     def install_item(self, items):
-        names = [x.get_id() for x in items]
-        print("installing: {}".format(names))
-        self.pmanager.installPackage(",".join(names), async=self.dbus_callback)
+        print("installing: {}".format([x.get_id() for x in items]))
+        names = self.plan_install_names([x.get_id() for x in items])
+        self.run_files_or_names("installPackage", items, names)
+
+    def remove_item(self, items):
+        print("removing: {}".format([x.get_id() for x in items]))
+        self.run_operation("removePackage",
+                           [x.get_id() for x in items], len(items), 0)
+
+    def upgrade_item(self, items):
+        print("upgrading: {}".format([x.get_id() for x in items]))
+        with self.db_lock:
+            names = plan_upgrade([x.get_id() for x in items])[1]
+        # Installing the newer package files upgrades them just the same
+        self.run_files_or_names("updatePackage", items, names)
+
+    def plan_prefetch(self, items):
+        """ Names of every package needed to install or upgrade items """
+        installs = []
+        upgrades = []
+        for item in items:
+            if item.has_status(ItemStatus.INSTALLED):
+                upgrades.append(item.get_id())
+            else:
+                installs.append(item.get_id())
+        names = []
+        if installs:
+            names.extend(self.plan_install_names(installs))
+        with self.db_lock:
+            if upgrades:
+                names.extend(plan_upgrade(upgrades)[1])
+        return names
+
+    def get_package_url(self, name):
+        """ Return the package and the URL eopkg would fetch it from """
+        (pkg, repo) = self.get_avail_db().get_package_repo(name)
+        uri = str(pkg.packageURI)
+        if "://" not in uri and not uri.startswith("/"):
+            base = os.path.dirname(self.repoDB.get_repo_url(repo))
+            uri = "{}/{}".format(base, uri)
+        return (pkg, uri)
+
+    def prefetch_items(self, items, budget):
+        """ Download the packages into our own cache. If everything a later
+            operation needs was prefetched, we install from the files and
+            eopkg doesn't need to download anything """
+        cache_dir = self.get_prefetch_dir()
+        if not ensure_dir(cache_dir):
+            return
+        self.sweep_prefetched(cache_dir)
+        for name in self.plan_prefetch(items):
+            if budget.is_cancelled():
+                return
+            try:
+                self.prefetch_package(name, cache_dir, budget)
+            except Exception as e:
+                print("Unable to prefetch {}: {}".format(name, e))
+
+    def sweep_prefetched(self, cache_dir):
+        """ Drop prefetched packages nobody ended up installing """
+        now = time.time()
+        for f in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, f)
+            try:
+                if now - os.stat(path).st_mtime > PREFETCH_MAX_AGE:
+                    os.unlink(path)
+            except Exception as e:
+                print("Unable to remove {}: {}".format(path, e))
+
+    def prefetch_package(self, name, cache_dir, budget):
+        (pkg, url) = self.get_package_url(name)
+        path = os.path.join(cache_dir, os.path.basename(url))
+        if os.path.exists(path):
+            return
+        # Local repos don't need fetching
+        if not url.startswith("http://") and not url.startswith("https://"):
+            return
+        if not budget.reserve(int(pkg.packageSize)):
+            return
+
+        def fetch(out):
+            sha = hashlib.sha1()
+            self.prefetch_http.fetch(url, HashingWriter(out, sha), None,
+                                     budget.throttle)
+            if sha.hexdigest() != pkg.packageHash:
+                raise RuntimeError("Checksum mismatch for {}".format(url))
+
+        atomic_write(path, fetch)
+
+    def check_transaction(self, transaction):
+        """ Never let a batch take out an essential package """
+        for id, item in transaction.remove.iteritems():
+            if item.has_status(ItemStatus.META_ESSENTIAL):
+                transaction.conflicts.append(
+                    "{} is an essential package".format(id))
+            elif self.is_removal_protected(id):
+                transaction.conflicts.append(
+                    "{} is required by an essential package".format(id))
+
+
+def get_file_sha1(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as inp:
+        while True:
+            data = inp.read(64 * 1024)
+            if not data:
+                break
+            sha.update(data)
+    return sha.hexdigest()
+
+
+class HashingWriter:
+    """ Pass writes through to a file while computing their checksum """
+
+    out = None
+    hash = None
+
+    def __init__(self, out, hash):
+        self.out = out
+        self.hash = hash
+
+    def write(self, data):
+        self.hash.update(data)
+        self.out.write(data)
 
 
 class EopkgItem(ProviderItem):
-    """ EopkgItem abstracts access to the native package type, i.e. eopkg """
+    """ EopkgItem abstracts access to the native package type, i.e. eopkg
+
+        Items are built from the plugin snapshot and shared between every
+        view showing the same package. The status is only worked out once
+        something asks for it, and the full pisi packages are only loaded
+        when something asks for detail, such as the description.
+    """
 
+    record = None
     installed = None
     available = None
-    displayCandidate = None
+
+    # Key of the snapshot the record came from
+    key = None
+
+    # The package is gone from both the system and the repos
+    gone = False
 
     __gtype_name__ = "NxEopkgItem"
 
-    def __init__(self, installed, available):
+    def __init__(self, record, key):
         ProviderItem.__init__(self)
-        self.installed = installed
-        self.available = available
-
-        self.add_status(ItemStatus.META_CHANGELOG)
-
-        if self.installed is not None:
-            self.displayCandidate = self.installed
-            self.add_status(ItemStatus.INSTALLED)
-            relNew = self.available.history[0].release
-            relOld = self.installed.history[0].release
-            if relNew > relOld:
-                self.add_status(ItemStatus.UPDATE_NEEDED)
-        else:
-            self.displayCandidate = self.available
+        self.record = record
+        self.key = key
+        self.status = None
+
+    def set_record(self, record, key):
+        """ The snapshot changed. The status also depends on the upgrade
+            table so is always worked out again, the packages are only
+            forgotten if the package itself changed. A record of None means
+            the package no longer exists, and we keep the old record for
+            display only """
+        if key != self.key:
+            self.status = None
+        self.key = key
+        if record is None:
+            if not self.gone:
+                self.gone = True
+                self.status = None
+                self.installed = None
+                self.available = None
+            return
+        if record == self.record and not self.gone:
+            return
+        self.gone = False
+        self.record = record
+        self.status = None
+        self.installed = None
+        self.available = None
+
+    def get_status(self):
+        if self.status is None:
+            self.status = self.build_status()
+        return self.status
+
+    def build_status(self):
+        """ Work out the status from the snapshot record """
+        if self.gone:
+            return 0
+        status = ItemStatus.META_CHANGELOG
+
+        if self.record.installed_release:
+            status |= ItemStatus.INSTALLED
+            table = self.get_plugin().get_upgrade_table()
+            if table.is_upgradable(self.record.name):
+                status |= ItemStatus.UPDATE_NEEDED
 
         # Is this an essential item?
-        if self.available and is_essential_package(self.available):
-            self.add_status(ItemStatus.META_ESSENTIAL)
+        if self.record.release and is_essential_package(self.record):
+            status |= ItemStatus.META_ESSENTIAL
 
         name = self.get_name()
         if name.endswith("-dbginfo") or name.endswith("-devel"):
-            self.add_status(ItemStatus.META_DEVEL)
+            status |= ItemStatus.META_DEVEL
+        return status
+
+    def get_installed(self):
+        """ Full installed pisi package, if installed """
+        if self.gone:
+            return None
+        if self.installed is None and self.record.installed_release:
+            self.installed = self.get_plugin().get_package(
+                self.record.name, True)
+        return self.installed
+
+    def get_available(self):
+        """ Full available pisi package, if in the repos """
+        if self.gone:
+            return None
+        if self.available is None and self.record.release:
+            self.available = self.get_plugin().get_package(
+                self.record.name, False)
+        return self.available
+
+    def get_display_candidate(self):
+        """ Prefer the installed package when showing details """
+        if self.record.installed_release:
+            return self.get_installed()
+        return self.get_available()
 
     def get_id(self):
-        return str(self.displayCandidate.name)
+        return self.record.name
 
     def get_name(self):
-        return self.displayCandidate.name
+        return self.record.name
 
     def get_summary(self):
-        return str(self.displayCandidate.summary)
+        return self.record.summary
 
     def get_title(self):
-        return str(self.displayCandidate.name)
+        return self.record.name
 
     def get_description(self):
-        return str(self.displayCandidate.description)
+        if self.gone:
+            return self.record.summary
+        return str(self.get_display_candidate().description)
 
     def get_version(self):
-        return self.displayCandidate.history[0].version
+        if self.record.installed_release:
+            return self.record.installed_version
+        return self.record.version
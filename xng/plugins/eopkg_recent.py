@@ -0,0 +1,156 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+from ..util import ensure_dir, get_user_cache_dir, atomic_write
+import calendar
+import marshal
+import os
+import time
+
+
+# Bump whenever the serialised layout changes
+RECENCY_INDEX_VERSION = 1
+
+# Without a previous index, anything first packaged this long before the
+# newest update in the repo counts as newly added
+NEW_SEED_AGE = 60 * 24 * 60 * 60
+
+
+def find_have_data(names, appsystem):
+    """ Find all packages with AppStream data """
+    ret = []
+
+    for key in names:
+        # Only want desktop apps here
+        if not appsystem.is_desktop_app(key):
+            continue
+        ret.append(key)
+    return ret
+
+
+def unmangle_date(tstamp):
+    """ Return the UNIX timestamp for a history date, or 0 """
+    try:
+        ret = time.strptime(tstamp, "%Y-%m-%d")
+        return calendar.timegm(ret)
+    except Exception:
+        # Probably because old eopkg pspec
+        pass
+    try:
+        ret = time.strptime(tstamp, "%m-%d-%Y")
+        return calendar.timegm(ret)
+    except Exception:
+        return 0
+
+
+class EopkgRecencyIndex:
+    """ EopkgRecencyIndex holds every available desktop application ordered
+        by the date of its newest update, with the dates parsed just once.
+
+        It is built once per snapshot and stored alongside it. When the set
+        of available packages changes between snapshots we diff the two
+        to find the applications that were newly added to the repo. With
+        nothing to diff against (first run, cleared cache) we instead seed
+        it with the applications whose only release is recent, so that the
+        new section is never empty just because the cache is.
+    """
+
+    key = None
+
+    # (timestamp, name), newest first
+    entries = None
+
+    # Names with screenshots, newest first
+    featured = None
+
+    # Names newly added since the last refresh, newest first
+    added = None
+
+    def __init__(self, key):
+        self.key = key
+        self.entries = []
+        self.featured = []
+        self.added = []
+
+    @staticmethod
+    def get_path():
+        return get_user_cache_dir("eopkg-recent.idx")
+
+    def build(self, snapshot, appsystem, previous):
+        """ Build from the snapshot, diffing against the previous index """
+        names = find_have_data(snapshot.list_available(), appsystem)
+        for name in names:
+            record = snapshot.get(name)
+            self.entries.append((unmangle_date(record.date), name))
+        self.entries.sort(reverse=True)
+
+        self.featured = [x[1] for x in self.entries
+                         if appsystem.has_screenshots(x[1])]
+
+        if previous is None:
+            self.added = self.find_first_releases(snapshot)
+            return
+        old = set(x[1] for x in previous.entries)
+        if old == set(names):
+            # Only the installdb changed, keep the last diff around
+            self.added = previous.added
+        else:
+            self.added = [x[1] for x in self.entries if x[1] not in old]
+
+    def find_first_releases(self, snapshot):
+        """ Names still at their first release, packaged recently """
+        if not self.entries:
+            return []
+        cutoff = self.entries[0][0] - NEW_SEED_AGE
+        return [x[1] for x in self.entries
+                if x[0] >= cutoff and
+                str(snapshot.get(x[1]).release) == "1"]
+
+    def get_recent(self, limit):
+        return [x[1] for x in self.entries[0:limit]]
+
+    def get_added(self, limit):
+        return self.added[0:limit]
+
+    def get_featured(self, limit):
+        return self.featured[0:limit]
+
+    def save(self):
+        path = self.get_path()
+        dirn = os.path.dirname(path)
+        if not ensure_dir(dirn):
+            return False
+        try:
+            atomic_write(path, marshal.dumps((RECENCY_INDEX_VERSION, self.key,
+                                              self.entries, self.featured,
+                                              self.added)))
+        except Exception as e:
+            print("Unable to write recency index {}: {}".format(path, e))
+            return False
+        return True
+
+    @staticmethod
+    def load():
+        """ Load the stored index regardless of key, or return None """
+        try:
+            with open(EopkgRecencyIndex.get_path(), "rb") as inp:
+                (version, key, entries, featured, added) = marshal.load(inp)
+        except Exception:
+            return None
+        if version != RECENCY_INDEX_VERSION:
+            return None
+        index = EopkgRecencyIndex(key)
+        index.entries = entries
+        index.featured = featured
+        index.added = added
+        return index
@@ -0,0 +1,118 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from collections import deque
+
+
+class EopkgRevDepGraph:
+    """ EopkgRevDepGraph is the dependency graph of the installed packages
+
+        Asking pisi for the reverse dependencies of a package means walking
+        the dependencies of every installed package, so we build both
+        directions once from the InstallDB. After a transaction only the
+        packages whose installed release changed are read again.
+
+        We also track which packages are protected: everything an essential
+        package depends on, directly or not. Removing a protected package
+        would take an essential package out with it.
+    """
+
+    # Snapshot key the graph is current for
+    key = None
+
+    # name -> set of installed runtime dependencies, and the reverse
+    deps = None
+    revdeps = None
+
+    # name -> installed release the edges were read at
+    releases = None
+
+    protected = None
+
+    def __init__(self):
+        self.deps = dict()
+        self.revdeps = dict()
+        self.releases = dict()
+        self.protected = set()
+
+    def update(self, installdb, snapshot, is_essential):
+        """ Bring the graph up to date with the snapshot, reading only the
+            packages that were installed or changed since """
+        installed = dict((x.name, x.installed_release)
+                         for x in snapshot.records() if x.installed_release)
+
+        for name in self.deps.keys():
+            if name not in installed:
+                self.set_deps(name, set())
+                del self.deps[name]
+                del self.releases[name]
+
+        for name, release in installed.iteritems():
+            if self.releases.get(name) == release:
+                continue
+            pkg = installdb.get_package(name)
+            self.set_deps(name, set(
+                x.package for x in pkg.runtimeDependencies()))
+            self.releases[name] = release
+
+        self.protected = self.closure(
+            [x.name for x in snapshot.records()
+             if x.name in installed and is_essential(x)], self.deps)
+        self.key = snapshot.key
+
+    def set_deps(self, name, deps):
+        """ Replace the dependencies of name, fixing up the reverse edges """
+        old = self.deps.get(name, set())
+        for dep in old - deps:
+            users = self.revdeps.get(dep)
+            if users is not None:
+                users.discard(name)
+                if not users:
+                    del self.revdeps[dep]
+        for dep in deps - old:
+            self.revdeps.setdefault(dep, set()).add(name)
+        self.deps[name] = deps
+
+    def closure(self, names, edges):
+        """ Breadth first walk from names along the edges, returning every
+            installed package reached including names """
+        seen = set(x for x in names if x in self.deps)
+        queue = deque(seen)
+        while queue:
+            name = queue.popleft()
+            for other in edges.get(name, ()):
+                if other in seen or other not in self.deps:
+                    continue
+                seen.add(other)
+                queue.append(other)
+        return seen
+
+    def plan_remove(self, name):
+        """ Everything that goes when name is removed, name first """
+        if name not in self.deps:
+            return []
+        seen = set([name])
+        ret = [name]
+        queue = deque(ret)
+        while queue:
+            for user in self.revdeps.get(queue.popleft(), ()):
+                if user in seen:
+                    continue
+                seen.add(user)
+                ret.append(user)
+                queue.append(user)
+        return ret
+
+    def is_protected(self, name):
+        """ Would removing name take out an essential package """
+        return name in self.protected
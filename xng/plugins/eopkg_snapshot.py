@@ -0,0 +1,183 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+from ..util import get_user_cache_dir
+from ..util.mapped import MappedIndex, MappedIndexWriter
+from collections import namedtuple
+import hashlib
+import os
+import pisi
+
+
+# Everything the UI needs to list a package without touching pisi. The
+# unprefixed version fields come from the newest history entry of the
+# available package, installed_* from the installed package.
+SnapshotRecord = namedtuple("SnapshotRecord", [
+    "name",
+    "summary",
+    "partOf",
+    "version",
+    "release",
+    "date",
+    "packageSize",
+    "installedSize",
+    "installed_version",
+    "installed_release",
+    "installed_date",
+])
+
+
+def get_repo_checksum(repo):
+    """ Return the checksum of the locally stored index for a repo, falling
+        back to the index mtimes if eopkg didn't leave a checksum around """
+    index_dir = os.path.join(pisi.context.config.index_dir(), repo)
+    try:
+        files = sorted(os.listdir(index_dir))
+    except Exception:
+        return ""
+    sums = [x for x in files if x.endswith(".sha1sum")]
+    ret = []
+    for f in sums:
+        with open(os.path.join(index_dir, f), "r") as inp:
+            ret.append(inp.read().strip())
+    if ret:
+        return ",".join(ret)
+    for f in files:
+        st = os.stat(os.path.join(index_dir, f))
+        ret.append("{}:{}".format(f, st.st_mtime))
+    return ",".join(ret)
+
+
+def get_snapshot_key(repoDB):
+    """ Compute the key for the current repo + installdb state """
+    parts = []
+    for repo in repoDB.list_repos(only_active=True):
+        parts.append(repo)
+        parts.append(get_repo_checksum(repo))
+    try:
+        st = os.stat(pisi.context.config.packages_dir())
+        parts.append(str(st.st_mtime))
+    except Exception as e:
+        print("Unable to stat installdb: {}".format(e))
+    return hashlib.sha1("|".join(parts)).hexdigest()
+
+
+def build_record(name, avail, installed):
+    """ Build a SnapshotRecord from the pisi package objects """
+    display = installed if installed is not None else avail
+    fields = [name, display.summary, display.partOf]
+    if avail is not None:
+        fields.extend([
+            avail.history[0].version,
+            avail.history[0].release,
+            avail.history[0].date,
+            avail.packageSize,
+            avail.installedSize,
+        ])
+    else:
+        fields.extend(["", "", "", "", installed.installedSize])
+    if installed is not None:
+        fields.extend([
+            installed.history[0].version,
+            installed.history[0].release,
+            installed.history[0].date,
+        ])
+    else:
+        fields.extend(["", "", ""])
+    return SnapshotRecord(*fields)
+
+
+class EopkgSnapshot:
+    """ EopkgSnapshot is a compact, memory-mapped copy of the package
+        metadata the UI actually uses for listings.
+
+        It is stored under the user cache directory, keyed on the repo index
+        checksums plus the installdb mtime, so in the common case we can
+        populate views without ever loading the pisi databases.
+    """
+
+    key = None
+    index = None
+
+    # Used when we can't write the snapshot for whatever reason
+    fallback = None
+
+    # Lazily built lookup of component -> names
+    components = None
+
+    def __init__(self, key):
+        self.key = key
+        path = get_user_cache_dir("eopkg-snapshot.idx")
+        self.index = MappedIndex(path, key, SnapshotRecord)
+
+    def is_valid(self):
+        """ Determine if the snapshot is usable without a rebuild """
+        if self.fallback is not None:
+            return True
+        return self.index.is_valid()
+
+    def rebuild(self, availDB, installDB):
+        """ Build the snapshot from the pisi databases and store it """
+        names = set(availDB.list_packages(None))
+        names.update(installDB.list_installed())
+
+        writer = MappedIndexWriter(self.index.path, self.key, SnapshotRecord)
+        for name in names:
+            avail = None
+            installed = None
+            if availDB.has_package(name):
+                avail = availDB.get_package(name)
+            if installDB.has_package(name):
+                installed = installDB.get_package(name)
+            writer.add(build_record(name, avail, installed))
+
+        self.index.close()
+        self.components = None
+        if writer.write() and self.index.is_valid():
+            return
+        # Serve from memory this session
+        self.fallback = dict((k, writer.record_type(*writer.records[k]))
+                             for k in writer.records)
+
+    def get(self, name):
+        """ Return the SnapshotRecord for name, or None """
+        if self.fallback is not None:
+            return self.fallback.get(name)
+        return self.index.get(name)
+
+    def records(self):
+        """ Iterate every record in the snapshot """
+        if self.fallback is not None:
+            return self.fallback.itervalues()
+        return self.index.records()
+
+    def list_installed(self):
+        """ Names of all installed packages """
+        return [x.name for x in self.records() if x.installed_release]
+
+    def list_available(self):
+        """ Names of all packages available in the repos """
+        return [x.name for x in self.records() if x.release]
+
+    def get_component_packages(self, component):
+        """ Return names of all available packages within a component """
+        if self.components is None:
+            components = dict()
+            for record in self.records():
+                if not record.release:
+                    continue
+                if record.partOf not in components:
+                    components[record.partOf] = list()
+                components[record.partOf].append(record.name)
+            self.components = components
+        return self.components.get(component, [])
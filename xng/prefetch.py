@@ -0,0 +1,103 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from .util.media_queue import MEDIA_PRIORITY_PREFETCH
+from gi.repository import Gio
+
+
+# Most applications a single view may prefetch for at once
+PREFETCH_MAX_APPS = 12
+
+
+class ScPrefetcher:
+    """ ScPrefetcher downloads the screenshots of whatever applications
+        are currently on screen, so that they're already local by the time
+        the user opens the details page.
+
+        Each view tells us which items it is showing, and anything it was
+        showing before that isn't wanted any more is cancelled. Prefetches
+        run at the lowest priority and the fetcher limits how many of them
+        may run at once. We only download here, decoding happens once the
+        details page actually asks for the media.
+    """
+
+    context = None
+    monitor = None
+
+    # owner -> {id: [ScMediaRequest]}
+    requests = None
+
+    def __init__(self, context):
+        self.context = context
+        self.requests = dict()
+        try:
+            self.monitor = Gio.NetworkMonitor.get_default()
+        except Exception as e:
+            print("Network monitor unavailable: {}".format(e))
+            self.monitor = None
+
+    def is_metered(self):
+        if self.monitor is None:
+            return False
+        try:
+            return self.monitor.get_network_metered()
+        except Exception:
+            # Older GIO
+            return False
+
+    def can_prefetch(self):
+        """ Only prefetch when we're allowed to and it won't cost the
+            user money """
+        fetcher = self.context.fetcher
+        if fetcher is None or self.context.appsystem is None:
+            return False
+        if not fetcher.can_fetch_media:
+            return False
+        return not self.is_metered()
+
+    def set_visible(self, owner, ids):
+        """ The owning view is now showing the given item IDs """
+        old = self.requests.pop(owner, dict())
+        new = dict()
+        if self.can_prefetch():
+            for id in ids[0:PREFETCH_MAX_APPS]:
+                if id in new:
+                    continue
+                if id in old:
+                    new[id] = old.pop(id)
+                    continue
+                new[id] = self.prefetch_app(id)
+        for reqs in old.itervalues():
+            for req in reqs:
+                req.cancel()
+        self.requests[owner] = new
+
+    def prefetch_app(self, id):
+        """ Queue the default screenshot and the thumbnails for an app """
+        screens = self.context.appsystem.get_screenshots(id)
+        if not screens:
+            return []
+        default = screens[0]
+        for screen in screens:
+            if screen.default:
+                default = screen
+                break
+
+        uris = [default.main_uri]
+        # Thumbnails are only shown with multiple screenshots
+        if len(screens) > 1:
+            uris.extend(x.thumb_uri for x in screens)
+
+        fetcher = self.context.fetcher
+        return [fetcher.fetch_media(x, MEDIA_PRIORITY_PREFETCH, 0, 0)
+                for x in uris]
@@ -0,0 +1,261 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from gi.repository import GLib, GObject
+import threading
+import time
+
+
+# Milliseconds between progress updates to the UI
+PROGRESS_UPDATE_INTERVAL = 100
+
+# Weight of the newest throughput sample in the moving average
+PROGRESS_RATE_ALPHA = 0.3
+
+# Shortest window we'll measure throughput over, in seconds
+PROGRESS_RATE_WINDOW = 0.25
+
+
+class ProgressPhase:
+    """ What the package manager is currently doing """
+
+    IDLE = "idle"
+    UPDATING_REPO = "updating-repo"
+    FETCHING = "fetching"
+    EXTRACTING = "extracting"
+    CONFIGURING = "configuring"
+    INSTALLING = "installing"
+    REMOVING = "removing"
+    INSTALLED = "installed"
+    REMOVED = "removed"
+    UPGRADED = "upgraded"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+
+class ProgressEvent:
+    """ Snapshot of the progress of the current operation
+
+        Byte counts cover the downloads of the whole operation, and are 0
+        when unknown. The package index is 1-based and counts the package
+        currently being worked on. The rate is the smoothed download
+        throughput in bytes per second, and the ETA is in seconds or None
+        if we can't tell yet.
+    """
+
+    phase = None
+    package = None
+
+    bytes_done = 0
+    bytes_total = 0
+
+    package_index = 0
+    package_count = 0
+
+    rate = 0.0
+    eta = None
+
+    def __init__(self, phase, package, bytes_done, bytes_total,
+                 package_index, package_count, rate, eta):
+        self.phase = phase
+        self.package = package
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.package_index = package_index
+        self.package_count = package_count
+        self.rate = rate
+        self.eta = eta
+
+    def get_fraction(self):
+        """ Overall progress between 0 and 1, weighting downloads and
+            package installation equally """
+        if self.phase == ProgressPhase.FINISHED:
+            return 1.0
+        parts = []
+        if self.bytes_total > 0:
+            parts.append(min(float(self.bytes_done) / self.bytes_total, 1.0))
+        if self.package_count > 0:
+            done = max(self.package_index - 1, 0)
+            if self.phase in [ProgressPhase.INSTALLED, ProgressPhase.REMOVED,
+                              ProgressPhase.UPGRADED]:
+                done += 1
+            parts.append(min(float(done) / self.package_count, 1.0))
+        if not parts:
+            return 0.0
+        return sum(parts) / len(parts)
+
+
+class ProgressTracker(GObject.Object):
+    """ ProgressTracker turns the raw progress reported by a plugin into a
+        stream of ProgressEvents
+
+        Package managers report progress far more often than is worth
+        drawing, so the tracker only keeps the latest state and emits it
+        at a fixed rate on the main loop. Phase changes between two
+        updates are folded into the next one, except for the end of the
+        operation which is always delivered.
+
+        The tracker may be fed from any thread.
+    """
+
+    __gtype_name__ = "ScProgressTracker"
+
+    __gsignals__ = {
+        'progress': (GObject.SIGNAL_RUN_FIRST, None, (object,)),
+    }
+
+    lock = None
+    source_id = None
+
+    phase = None
+    package = None
+    package_index = 0
+    package_count = 0
+
+    # Bytes of fully fetched files, and of the file being fetched
+    bytes_fetched = 0
+    bytes_current = 0
+    bytes_total = 0
+
+    # Last package counted into bytes_fetched
+    last_fetched = None
+
+    # End of the operation, waiting to be delivered
+    final = None
+
+    # Throughput sampling
+    rate = 0.0
+    sample_time = None
+    sample_bytes = 0
+
+    def __init__(self):
+        GObject.Object.__init__(self)
+        self.lock = threading.Lock()
+        self.reset(0, 0)
+
+    def reset(self, package_count, bytes_total):
+        """ Forget the last operation, must hold the lock """
+        self.phase = ProgressPhase.IDLE
+        self.package = None
+        self.package_index = 0
+        self.package_count = package_count
+        self.bytes_fetched = 0
+        self.bytes_current = 0
+        self.bytes_total = bytes_total
+        self.last_fetched = None
+        self.rate = 0.0
+        self.sample_time = None
+        self.sample_bytes = 0
+
+    def begin(self, package_count, bytes_total):
+        """ A new operation on package_count packages is starting, which
+            will download bytes_total, or 0 if unknown """
+        with self.lock:
+            self.reset(package_count, bytes_total)
+            self.schedule()
+
+    def set_phase(self, phase, package):
+        """ The package manager moved on to the given phase for package """
+        with self.lock:
+            if phase in [ProgressPhase.EXTRACTING, ProgressPhase.INSTALLING,
+                         ProgressPhase.REMOVING] and \
+                    self.phase not in [ProgressPhase.EXTRACTING,
+                                       ProgressPhase.CONFIGURING,
+                                       ProgressPhase.INSTALLING,
+                                       ProgressPhase.REMOVING]:
+                # Starting work on the next package
+                self.package_index += 1
+                self.package_count = max(self.package_count,
+                                         self.package_index)
+            self.phase = phase
+            self.package = package
+            self.schedule()
+
+    def fetched(self, package, done, total):
+        """ done of total bytes of package have been downloaded """
+        with self.lock:
+            self.phase = ProgressPhase.FETCHING
+            self.package = package
+            self.bytes_current = done
+            if done >= total:
+                # File complete, the next fetch starts from zero. The
+                # completion may be reported more than once
+                if package != self.last_fetched:
+                    self.bytes_fetched += total
+                    self.last_fetched = package
+                self.bytes_current = 0
+            self.bytes_total = max(self.bytes_total,
+                                   self.bytes_fetched + self.bytes_current)
+            self.update_rate(time.time())
+            self.schedule()
+
+    def finish(self, success):
+        """ The operation is over, which is always delivered even if the
+            next operation begins before the update goes out """
+        with self.lock:
+            self.phase = ProgressPhase.FINISHED if success else \
+                ProgressPhase.FAILED
+            self.package = None
+            self.final = self.get_event()
+            self.schedule()
+
+    def update_rate(self, now):
+        """ Fold the bytes since the last sample into the moving average,
+            must hold the lock """
+        done = self.bytes_fetched + self.bytes_current
+        if self.sample_time is None:
+            self.sample_time = now
+            self.sample_bytes = done
+            return
+        elapsed = now - self.sample_time
+        if elapsed < PROGRESS_RATE_WINDOW:
+            return
+        sample = max(done - self.sample_bytes, 0) / elapsed
+        if self.rate <= 0:
+            self.rate = sample
+        else:
+            self.rate = PROGRESS_RATE_ALPHA * sample + \
+                (1 - PROGRESS_RATE_ALPHA) * self.rate
+        self.sample_time = now
+        self.sample_bytes = done
+
+    def schedule(self):
+        """ Make sure an update is on the way, must hold the lock """
+        if self.source_id is None:
+            self.source_id = GLib.timeout_add(PROGRESS_UPDATE_INTERVAL,
+                                              self.deliver)
+
+    def get_event(self):
+        """ Build the event for the current state, must hold the lock """
+        done = self.bytes_fetched + self.bytes_current
+        eta = None
+        if self.phase == ProgressPhase.FETCHING and self.rate > 0 and \
+                self.bytes_total > 0:
+            eta = max(self.bytes_total - done, 0) / self.rate
+        return ProgressEvent(self.phase, self.package, done,
+                             self.bytes_total, self.package_index,
+                             self.package_count, self.rate, eta)
+
+    def deliver(self):
+        """ Emit the latest state on the main loop """
+        with self.lock:
+            self.source_id = None
+            final = self.final
+            self.final = None
+            event = self.get_event()
+        if final is not None:
+            self.emit('progress', final)
+            if event.phase == final.phase:
+                return False
+        self.emit('progress', event)
+        return False
@@ -12,7 +12,10 @@
 #
 
 from gi.repository import Gtk
+from gi.repository import AppStreamGlib as As
 from .imagewidget import ScImageWidget
+from .util.media_queue import MEDIA_PRIORITY_VISIBLE_MAIN, \
+    MEDIA_PRIORITY_VISIBLE_THUMBNAIL, MEDIA_PRIORITY_PREFETCH
 
 
 class ScScreenshotView(Gtk.Box):
@@ -22,6 +25,10 @@ class ScScreenshotView(Gtk.Box):
     fetcher = None
     screen_map = None
 
+    # Outstanding ScMediaRequests for the current item
+    requests = None
+    main_request = None
+
     image_widget = None
     box_thumbnails = None
 
@@ -70,6 +77,7 @@ class ScScreenshotView(Gtk.Box):
         """ Bind to the fetcher now it's available """
         self.fetcher = context.fetcher
         self.screen_map = dict()
+        self.requests = []
         self.fetcher.connect('media-fetched', self.on_media_fetched)
         self.fetcher.connect('fetch-failed', self.on_fetch_failed)
 
@@ -108,9 +116,33 @@ class ScScreenshotView(Gtk.Box):
         # Request show of new picture
         self.image_widget.show_loading()
         self.image_widget.uri = thumb.alt_uri
-        self.fetcher.fetch_media(thumb.alt_uri)
+        self.fetch_main(thumb.alt_uri)
+
+    def fetch_thumbnail(self, uri):
+        self.requests.append(self.fetcher.fetch_media(
+            uri, MEDIA_PRIORITY_VISIBLE_THUMBNAIL,
+            As.IMAGE_THUMBNAIL_WIDTH, As.IMAGE_THUMBNAIL_HEIGHT))
+
+    def fetch_main(self, uri):
+        """ Fetch the main image, the previous one may still be clicked
+            back to so only demote it """
+        if self.main_request is not None:
+            self.main_request.set_priority(MEDIA_PRIORITY_PREFETCH)
+        self.main_request = self.fetcher.fetch_media(
+            uri, MEDIA_PRIORITY_VISIBLE_MAIN,
+            As.IMAGE_LARGE_WIDTH, As.IMAGE_LARGE_HEIGHT)
+        self.requests.append(self.main_request)
+
+    def cancel_requests(self):
+        """ Cancel anything still pending for the previous item """
+        for req in self.requests:
+            req.cancel()
+        self.requests = []
+        self.main_request = None
 
     def set_item(self, item):
+        self.cancel_requests()
+
         # Clean up old thumbnails
         for child in self.box_thumbnails.get_children():
             child.destroy()
@@ -139,7 +171,7 @@ class ScScreenshotView(Gtk.Box):
             default = screens[0]
         self.image_widget.uri = default.main_uri
         # Always "fetch", fetcher knows if it exists or not.
-        self.fetcher.fetch_media(default.main_uri)
+        self.fetch_main(default.main_uri)
 
         # Set up the screenshot order
         allScreens = [default]
@@ -165,7 +197,7 @@ class ScScreenshotView(Gtk.Box):
 
         # Now ask the preview to fetch
         for screen in allScreens:
-            self.fetcher.fetch_media(screen.thumb_uri)
+            self.fetch_thumbnail(screen.thumb_uri)
 
         # And now select it
         self.box_thumbnails.select_child(defaultParent)
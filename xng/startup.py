@@ -0,0 +1,184 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from .util import get_user_cache_dir, ensure_dir
+from gi.repository import GLib, GObject
+import os
+import threading
+import time
+
+
+STARTUP_TIMING_LOG = "startup-timing.log"
+
+
+class StartupTask:
+    """ A single named step of the startup, run once all of the tasks it
+        depends on have completed """
+
+    name = None
+    func = None
+    deps = None
+
+    # Wall clock seconds, relative to the start of the graph
+    started = None
+    finished = None
+
+    failed = False
+
+    def __init__(self, name, func, deps):
+        self.name = name
+        self.func = func
+        self.deps = deps
+
+
+class StartupGraph(GObject.Object):
+    """ StartupGraph runs the independent parts of the startup in parallel
+
+        Each task runs on its own daemon thread as soon as its dependencies
+        are complete, so slow hardware probing doesn't hold up the package
+        database, and vice versa. A failed task still counts as complete so
+        that nothing waits on it forever, and the tasks depending on it
+        have to cope with whatever it didn't set up.
+
+        Once every task has run the timing of each is appended to the
+        startup timing log in the cache directory.
+    """
+
+    __gtype_name__ = "ScStartupGraph"
+
+    __gsignals__ = {
+        'task-completed': (GObject.SIGNAL_RUN_FIRST, None, (str,)),
+    }
+
+    # name -> StartupTask, in the order they were added
+    tasks = None
+    order = None
+
+    # Names of the tasks that have run
+    completed = None
+
+    # ([names], callback) waiting for tasks to complete
+    waiters = None
+
+    lock = None
+    epoch = None
+
+    def __init__(self):
+        GObject.Object.__init__(self)
+        self.tasks = dict()
+        self.order = []
+        self.completed = set()
+        self.waiters = []
+        self.lock = threading.Lock()
+
+    def add(self, name, func, deps=()):
+        """ Add a task, which must happen before run() """
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError("{} depends on unknown task {}".format(
+                    name, dep))
+        self.tasks[name] = StartupTask(name, func, list(deps))
+        self.order.append(name)
+
+    def run(self):
+        """ Start every task that doesn't depend on anything """
+        self.epoch = time.time()
+        with self.lock:
+            ready = [self.tasks[x] for x in self.order
+                     if not self.tasks[x].deps]
+            for task in ready:
+                task.started = 0
+        for task in ready:
+            self.spawn(task)
+
+    def spawn(self, task):
+        t = threading.Thread(target=self.run_task, args=(task,),
+                             name="startup-{}".format(task.name))
+        t.daemon = True
+        t.start()
+
+    def run_task(self, task):
+        """ Task thread body """
+        started = time.time()
+        task.started = started - self.epoch
+        try:
+            task.func()
+        except Exception as e:
+            print("Startup task {} failed: {}".format(task.name, e))
+            task.failed = True
+        task.finished = time.time() - self.epoch
+
+        with self.lock:
+            self.completed.add(task.name)
+            ready = []
+            for name in self.order:
+                other = self.tasks[name]
+                if other.started is not None:
+                    continue
+                if all(x in self.completed for x in other.deps):
+                    other.started = task.finished
+                    ready.append(other)
+            done = len(self.completed) == len(self.tasks)
+        for other in ready:
+            self.spawn(other)
+        GLib.idle_add(self.emit_completed, task.name)
+        if done:
+            self.write_timing()
+
+    def is_complete(self, name):
+        with self.lock:
+            return name in self.completed
+
+    def when_complete(self, names, callback):
+        """ Call callback on the main loop once all of the named tasks have
+            completed, which may be right away. Only call this from the
+            main loop. """
+        with self.lock:
+            if all(x in self.completed for x in names):
+                GLib.idle_add(self.call_waiter, callback)
+                return
+            self.waiters.append((list(names), callback))
+
+    def call_waiter(self, callback):
+        callback()
+        return False
+
+    def emit_completed(self, name):
+        """ Let everyone know, and wake up anyone waiting on the task """
+        with self.lock:
+            ready = [x for x in self.waiters
+                     if all(n in self.completed for n in x[0])]
+            for waiter in ready:
+                self.waiters.remove(waiter)
+        self.emit('task-completed', name)
+        for (names, callback) in ready:
+            callback()
+        return False
+
+    def write_timing(self):
+        """ Append the timings of this startup to the log """
+        path = get_user_cache_dir(STARTUP_TIMING_LOG)
+        if not ensure_dir(os.path.dirname(path)):
+            return
+        lines = ["startup at {}".format(time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(self.epoch)))]
+        for name in self.order:
+            task = self.tasks[name]
+            lines.append("  {:<12} start {:7.3f}s  took {:7.3f}s{}".format(
+                name, task.started, task.finished - task.started,
+                "  (failed)" if task.failed else ""))
+        try:
+            with open(path, "a") as out:
+                out.write("\n".join(lines) + "\n")
+        except Exception as e:
+            print("Unable to write {}: {}".format(path, e))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+
+from .plugins.base import ProviderStorage
+from gi.repository import GLib
+from collections import deque
+import threading
+import time
+
+
+class ScStorageRequest(ProviderStorage):
+    """ Handed to the plugins for a single population request, so that
+        anything they push after the request was cancelled is dropped
+    """
+
+    __gtype_name__ = "ScStorageRequest"
+
+    parent = None
+    cancel = None
+
+    def __init__(self, parent, cancel):
+        ProviderStorage.__init__(self)
+        self.parent = parent
+        self.cancel = cancel
+
+    def add_item(self, id, item, popfilter):
+        self.add_items([item], popfilter)
+
+    def add_items(self, items, popfilter):
+        if self.cancel.is_set():
+            return
+        self.parent.push_items(self.cancel, items, popfilter)
+
+    def clear(self):
+        pass
+
+
+class ScFrameStorage(ProviderStorage):
+    """ ScFrameStorage sits between the plugins and a view
+
+        Plugins populate from a background thread and push batches of items
+        in from there. We hand those batches to the real storage (the view)
+        on the main loop during idle time, in small chunks, and never spend
+        more than the frame budget in a single idle callback. This keeps the
+        UI responsive when a component has hundreds of items.
+    """
+
+    __gtype_name__ = "ScFrameStorage"
+
+    # The real storage, i.e. the view
+    target = None
+
+    # (cancel, popfilter, items) waiting for the main loop
+    pending = None
+    lock = None
+    source_id = 0
+
+    # Cancellation for the current request
+    cancel = None
+
+    # Seconds we may spend per idle callback (~60fps with some headroom)
+    budget = 0.008
+
+    # Items handed to the target in one go
+    chunk_size = 8
+
+    def __init__(self, target):
+        ProviderStorage.__init__(self)
+        self.target = target
+        self.pending = deque()
+        self.lock = threading.Lock()
+
+    def begin_request(self):
+        """ Cancel any ongoing population and return the ScStorageRequest
+            the plugins should populate next """
+        self.clear()
+        cancel = threading.Event()
+        self.cancel = cancel
+        return ScStorageRequest(self, cancel)
+
+    def add_item(self, id, item, popfilter):
+        self.add_items([item], popfilter)
+
+    def add_items(self, items, popfilter):
+        """ Direct population, i.e. outside of populate() """
+        self.push_items(None, items, popfilter)
+
+    def push_items(self, cancel, items, popfilter):
+        """ Queue the items up for the main loop """
+        if not items:
+            return
+        with self.lock:
+            self.pending.append((cancel, popfilter, list(items)))
+            if self.source_id == 0:
+                self.source_id = GLib.idle_add(self.deliver)
+
+    def clear(self):
+        """ Cancel the current request and drop anything pending """
+        if self.cancel is not None:
+            self.cancel.set()
+            self.cancel = None
+        with self.lock:
+            self.pending.clear()
+        self.target.clear()
+
+    def deliver(self):
+        """ Idle callback, deliver chunks until we run out of budget """
+        deadline = time.time() + self.budget
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.source_id = 0
+                    return False
+                (cancel, popfilter, items) = self.pending[0]
+                if cancel is not None and cancel.is_set():
+                    self.pending.popleft()
+                    continue
+                chunk = items[0:self.chunk_size]
+                del items[0:self.chunk_size]
+                if not items:
+                    self.pending.popleft()
+
+            self.target.add_items(chunk, popfilter)
+            if time.time() >= deadline:
+                return True
@@ -10,3 +10,63 @@
 #  the Free Software Foundation, either version 2 of the License, or
 #  (at your option) any later version.
 #
+
+import os
+import tempfile
+
+
+def get_user_cache_dir(*paths):
+    """ Return the Solus SC cache directory, optionally joined with any
+        of the given path components """
+    home = os.path.expanduser("~")
+    return os.path.join(home, ".cache", "solus-sc", *paths)
+
+
+def pixbuf_size(pbuf):
+    """ Memory used by the pixel data of a pixbuf """
+    return pbuf.get_rowstride() * pbuf.get_height()
+
+
+def ensure_dir(path):
+    """ Make sure the given directory exists, returning False if we can't
+        create it for any reason """
+    try:
+        if not os.path.exists(path):
+            os.makedirs(path, 00755)
+    except Exception as ex:
+        print("Check home directory permissions for {}: {}".format(
+            path, ex))
+        return False
+    return True
+
+
+def atomic_write(path, data, sync=False):
+    """ Atomically replace the file at path, so readers only ever see the
+        old or the new contents. data is either the new contents, or a
+        function writing them to the open file, which may return False to
+        leave the old file alone. Returns False if the file was left alone.
+
+        Errors are raised once the temporary file is cleaned up. With sync
+        the data is on disk before it replaces the old file. """
+    fd, tmp = tempfile.mkstemp(prefix=".sc-", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if callable(data):
+                keep = data(out) is not False
+            else:
+                out.write(data)
+                keep = True
+            if keep and sync:
+                out.flush()
+                os.fsync(out.fileno())
+        if keep:
+            os.rename(tmp, path)
+        else:
+            os.unlink(tmp)
+        return keep
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except Exception:
+            pass
+        raise
@@ -15,32 +15,77 @@
 import Queue
 import multiprocessing
 import threading
-from gi.repository import GObject, GdkPixbuf, Gio, Gdk
+from gi.repository import GObject, GdkPixbuf, Gio, Gdk, GLib
+from . import pixbuf_size, atomic_write
+from .http import ScHttpPool
+from .lru import LruCache
+from .media_cache import ScMediaCache, MEDIA_FAILURES
+from .media_failures import ScMediaFailures, is_remote_failure
+from .pool import ScWorkerPool
+from .media_queue import ScMediaQueue, ScMediaRequest, \
+    MEDIA_PRIORITY_VISIBLE_MAIN, MEDIA_PRIORITY_PREFETCH
 import os
 import hashlib
 
 
+# Upper bound on fetch threads, i.e. the usual per-host browser limit
+MAX_FETCH_THREADS = 6
+
+# Seconds a spare fetch thread will wait for work before exiting
+FETCH_IDLE_TIMEOUT = 30
+
+# Memory we'll spend on decoded screenshots
+PIXBUF_CACHE_BYTES = 32 * 1024 * 1024
+
+# Fetch threads that prefetching may occupy at once
+PREFETCH_THREADS = 1
+
+# Threads used to revalidate stale media in the background
+REVALIDATE_THREADS = 1
+
+
 class ScMediaFetcher(GObject.Object):
     """ The ScMediaFetcher runs a low priority backround queue for handling
         media requests, such as screenshots.
         This allows for background fetching of screenshots and handles all
         the blocking, etc.
 
-        We'll limit to a maximum of 2 threads for fetching
-        and we'll very likely only ever use one anyway. This allows us to
-        switch between views with minimal transition pain. For single core
-        systems we limit to 1 thread and avoid context issues.
+        Fetching starts out on a single thread and more are spawned while
+        jobs are waiting, up to a limit based on the CPU count. Spare threads
+        exit again once the queue has been idle for a while. Downloads reuse
+        keep-alive connections to each host and are streamed directly into
+        the cache directory.
+
+        Callers may ask for media at a given size, in which case we decode
+        at that size rather than at full resolution, and store the scaled
+        variant in the cache directory for next time. Recently decoded
+        pixbufs are kept in memory, keyed by URI and size.
+
+        Local media is always served immediately. Once it is older than the
+        media-max-age setting we also revalidate it in the background with
+        a conditional GET, replacing it only if it actually changed.
 
         In all cases we also run a dedicated load thread, which takes over
         as the fetch thread routine ends, allowing interleaving of the
         operations as well as ensuring locally existing files are loaded
         while fetches are ongoing.
+
+        Requests are scheduled by priority class (see media_queue) and each
+        caller gets a ScMediaRequest back, which can be used to cancel or
+        demote the request once the media is no longer on screen.
     """
 
     # The main queue is used to attempt fetching of images
     queue = None
-    cache_lock = None
-    cache = None
+
+    # Persistent connections for the downloads
+    http = None
+
+    # Fetch thread accounting
+    worker_lock = None
+    workers = 0
+    idle_workers = 0
+    max_workers = 1
 
     # The load queue is dedicated on a single thread to attempting to
     # read the images
@@ -49,6 +94,20 @@ class ScMediaFetcher(GObject.Object):
     can_fetch_media = None
     settings = None
 
+    # Tracks everything stored on disk
+    media_cache = None
+
+    # (uri, width, height) -> GdkPixbuf.Pixbuf
+    pixbufs = None
+
+    # Backoff for media we failed to fetch
+    failures = None
+
+    # Background conditional GETs, and the names currently queued
+    revalidate_pool = None
+    revalidating = None
+    revalidate_lock = None
+
     # Emit media-fetched URL local-URL
     # or fetch-failed URL error
     __gsignals__ = {
@@ -65,37 +124,33 @@ class ScMediaFetcher(GObject.Object):
         self.can_fetch_media = True
 
         self.settings = Gio.Settings.new("com.solus-project.software-center")
+        self.media_cache = ScMediaCache(self.get_cache_size())
+        self.failures = ScMediaFailures(
+            self.media_cache.get_filename(MEDIA_FAILURES))
         self.settings.connect("changed", self.on_settings_changed)
         self.on_settings_changed(self.settings, "fetch-media")
 
         cpuCount = multiprocessing.cpu_count()
         if cpuCount < 2:
-            threadCount = 1
+            self.max_workers = 1
         else:
-            threadCount = 2
+            self.max_workers = min(cpuCount * 2, MAX_FETCH_THREADS)
         print("{} CPUs detected, restricting to {} threads".format(
-            cpuCount, threadCount))
-
-        # Ensure we have a cache directory before we start
-        cacheDir = self.get_cache_dir()
-        try:
-            if not os.path.exists(cacheDir):
-                os.makedirs(cacheDir, 00755)
-        except Exception as ex:
-            print("Check home directory permissions for {}: {}".format(
-                cacheDir, ex))
-            pass
+            cpuCount, self.max_workers))
 
         # Set up the basics
-        self.cache = dict()
-        self.cache_lock = threading.Lock()
-        self.queue = Queue.LifoQueue(0)
-
-        # We'll happily let the threads die if required
-        for i in range(threadCount):
-            t = threading.Thread(target=self.begin_fetch)
-            t.daemon = True
-            t.start()
+        self.queue = ScMediaQueue()
+        self.queue.set_limit(MEDIA_PRIORITY_PREFETCH, PREFETCH_THREADS)
+        self.http = ScHttpPool()
+        self.pixbufs = LruCache(PIXBUF_CACHE_BYTES, pixbuf_size)
+        self.revalidate_pool = ScWorkerPool("media-revalidate",
+                                            REVALIDATE_THREADS)
+        self.revalidating = set()
+        self.revalidate_lock = threading.Lock()
+        self.worker_lock = threading.Lock()
+
+        # Always keep one fetch thread around
+        self.spawn_worker()
 
         # Now start the main read queue
         self.load_queue = Queue.LifoQueue(0)
@@ -104,14 +159,22 @@ class ScMediaFetcher(GObject.Object):
         t.start()
 
     def on_settings_changed(self, s, key, data=None):
-        if key != "fetch-media":
-            return
-        self.can_fetch_media = s.get_boolean(key)
+        if key == "fetch-media":
+            self.can_fetch_media = s.get_boolean(key)
+        elif key == "media-cache-size":
+            self.media_cache.set_max_bytes(self.get_cache_size())
+
+    def get_cache_size(self):
+        """ Return the configured media cache size in bytes """
+        return self.settings.get_uint("media-cache-size") * 1024 * 1024
+
+    def get_max_age(self):
+        """ Return the configured media max-age in seconds """
+        return self.settings.get_uint("media-max-age") * 60 * 60
 
     def get_cache_dir(self):
         """ Return the Solus SC cache directory """
-        home = os.path.expanduser("~")
-        return os.path.join(home, ".cache", "solus-sc", "media")
+        return self.media_cache.path
 
     def get_cache_filename(self, url):
         """ Return the unique local filename part for a URL """
@@ -127,106 +190,273 @@ class ScMediaFetcher(GObject.Object):
         """ Determine if the media is pending before asking for
             it to be fetched
         """
-        with self.cache_lock:
-            if uri in self.cache:
-                return True
-        return False
+        return self.queue.is_pending(uri)
 
-    def load_pixbuf(self, local_file):
-        """ Load the pixbuf itself in the background thread """
-        pbuf = None
+    def get_variant_filename(self, uri, width, height):
+        """ Return the cache filename for a scaled variant of the URI """
+        f, ext = os.path.splitext(self.get_cache_filename(uri))
+        return "{}-{}x{}.png".format(f, width, height)
+
+    def store_variant(self, uri, name, pbuf):
+        """ Store a scaled variant so we needn't scale it again """
         try:
-            pbuf = GdkPixbuf.Pixbuf.new_from_file(local_file)
+            (ok, data) = pbuf.save_to_bufferv("png", [], [])
+            atomic_write(self.media_cache.get_filename(name), data)
         except Exception as e:
-            raise e
-            return None
+            print("Unable to store variant {}: {}".format(name, e))
+            return
+        self.media_cache.add(name, uri)
+
+    def load_scaled(self, uri, local_file, width, height):
+        """ Load the pixbuf at the given size from the variant cache, or
+            scale it from the original while loading """
+        name = self.get_variant_filename(uri, width, height)
+        variant = self.media_cache.lookup(name)
+        if variant is not None:
+            try:
+                return GdkPixbuf.Pixbuf.new_from_file(variant)
+            except Exception as e:
+                print("Dropping bad variant {}: {}".format(name, e))
+                self.media_cache.forget(name)
+
+        (fmt, fwidth, fheight) = GdkPixbuf.Pixbuf.get_file_info(local_file)
+        if fmt is None:
+            raise RuntimeError("Unknown image format")
+        # Never scale up, the original is good enough
+        if fwidth <= width and fheight <= height:
+            return GdkPixbuf.Pixbuf.new_from_file(local_file)
+        pbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(local_file, width,
+                                                       height, True)
+        self.store_variant(uri, name, pbuf)
+        return pbuf
+
+    def load_pixbuf(self, uri, local_file, width, height):
+        """ Load the pixbuf itself in the background thread """
+        key = (uri, width, height)
+        pbuf = self.pixbufs.get(key)
+        if pbuf is not None:
+            return pbuf
+        if width < 0 or height < 0:
+            pbuf = GdkPixbuf.Pixbuf.new_from_file(local_file)
+        else:
+            pbuf = self.load_scaled(uri, local_file, width, height)
+        self.pixbufs.put(key, pbuf)
         return pbuf
 
+    def spawn_worker(self):
+        """ Start another fetch thread if we're allowed to """
+        with self.worker_lock:
+            if self.workers >= self.max_workers:
+                return
+            self.workers += 1
+        t = threading.Thread(target=self.begin_fetch)
+        t.daemon = True
+        t.start()
+
+    def maybe_spawn_worker(self):
+        """ Scale up if jobs are waiting and nobody is free to take them """
+        with self.worker_lock:
+            idle = self.idle_workers
+        if self.queue.count_queued() > idle:
+            self.spawn_worker()
+
+    def is_http(self, uri):
+        return uri.startswith("http://") or uri.startswith("https://")
+
+    def download(self, uri, out):
+        """ Download the URI into the out file object, returning the
+            response headers if there were any """
+        if self.is_http(uri):
+            return self.http.fetch(uri, out)[1]
+        # Anything else (i.e. file://) goes via GIO
+        inp = Gio.File.new_for_uri(uri).read(None)
+        try:
+            while True:
+                data = inp.read_bytes(64 * 1024, None).get_data()
+                if not data:
+                    break
+                out.write(data)
+        finally:
+            inp.close(None)
+        return dict()
+
+    def maybe_revalidate(self, uri, name):
+        """ Queue a background revalidation if the local copy is stale """
+        if not self.can_fetch_media or not self.is_http(uri):
+            return
+        if self.media_cache.needs_revalidation(name,
+                                               self.get_max_age()) is None:
+            return
+        with self.revalidate_lock:
+            if name in self.revalidating:
+                return
+            self.revalidating.add(name)
+        self.revalidate_pool.submit(self.revalidate, uri, name)
+
+    def revalidate(self, uri, name):
+        """ Conditional GET for a cached file, only replacing it if the
+            server has a newer version """
+        try:
+            self.revalidate_internal(uri, name)
+        except Exception as e:
+            print("Unable to revalidate {}: {}".format(uri, e))
+        finally:
+            with self.revalidate_lock:
+                self.revalidating.discard(name)
+
+    def revalidate_internal(self, uri, name):
+        stale = self.media_cache.needs_revalidation(name, self.get_max_age())
+        if stale is None:
+            return
+        (url, etag, modified) = stale
+        headers = dict()
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+
+        resp = dict()
+
+        def fetch(out):
+            (status, reply) = self.http.fetch(url, out, headers)
+            resp.update(reply)
+            # Unchanged upstream, keep the copy we have
+            return status != 304
+
+        if not atomic_write(self.media_cache.get_filename(name), fetch):
+            self.media_cache.mark_validated(name, resp.get("etag"),
+                                            resp.get("last-modified"))
+            return
+
+        # Changed upstream, anything derived from the old copy is stale
+        base = os.path.splitext(name)[0] + "-"
+        self.media_cache.forget_matching(lambda x: x.startswith(base))
+        self.pixbufs.remove_matching(lambda x: x[0] == uri)
+        self.media_cache.add(name, uri, resp.get("etag"),
+                             resp.get("last-modified"))
+
     def fetch_pixbuf(self, uri, local_file):
         """ Fetch the GdkPixbuf in the background thread so it can be updated
             immediately in the UI without a secondary load routine
         """
-        if os.path.exists(local_file):
+        name = os.path.basename(local_file)
+        if self.media_cache.lookup(name) is not None:
+            self.maybe_revalidate(uri, name)
             return
         if not self.can_fetch_media:
             raise RuntimeError("Media fetching disabled in user settings")
             return
+        reason = self.failures.check(uri)
+        if reason is not None:
+            raise RuntimeError(reason)
 
-        # Attempt download to a local location, then finally rename to the
-        # final path
-        inf = Gio.File.new_for_uri(uri)
-        out, ios = Gio.File.new_tmp("solus-sc.XXXXXX")
+        # Stream to a temporary file next to the final path, then rename
+        # it into place so readers never see a partial file
+        resp = dict()
         try:
-            inf.copy(out, Gio.FileCopyFlags.OVERWRITE, None, None)
+            atomic_write(local_file,
+                         lambda out: resp.update(self.download(uri, out)))
         except Exception as e:
+            # Local problems, i.e. a full disk, say nothing about the host
+            if is_remote_failure(e):
+                self.failures.record_failure(uri, e)
+            else:
+                print("Unable to store {}: {}".format(uri, e))
             raise e
-            return
-
-        # Copy temporary over the original
-        try:
-            out2 = Gio.File.new_for_path(local_file)
-            out.copy(out2, Gio.FileCopyFlags.OVERWRITE, None, None)
-            out.delete()
-        except Exception as e:
-            out.delete()
-            raise e
+        self.failures.record_success(uri)
+        self.media_cache.add(name, uri, resp.get("etag"),
+                             resp.get("last-modified"))
 
     def begin_load(self):
         """ Handles loading of the images that already exist """
         while True:
             uri = self.load_queue.get()
             filename = self.get_cache_filename_full(uri)
-            pbuf = None
-            try:
-                pbuf = self.load_pixbuf(filename)
-            except Exception as e:
-                pbuf = None
-                print("Failed to load pixbuf {}: {}".format(
-                    filename, e))
-                Gdk.threads_enter()
-                self.emit('fetch-failed', uri, str(e))
-                Gdk.threads_leave()
 
-            # Let clients know the media is now ready
-            if pbuf:
+            # Decode once for every size still wanted. If everyone went
+            # away in the meantime, or only wanted the download, we don't
+            # bother decoding at all.
+            sizes = set((x.width, x.height) for x in self.queue.finish(uri)
+                        if x.width != 0)
+            for (width, height) in sizes:
+                pbuf = None
+                try:
+                    pbuf = self.load_pixbuf(uri, filename, width, height)
+                except Exception as e:
+                    print("Failed to load pixbuf {}: {}".format(
+                        filename, e))
+                    # Corrupt or evicted underneath us, fetch it again
+                    # next time
+                    self.media_cache.forget(os.path.basename(filename))
+                    Gdk.threads_enter()
+                    self.emit('fetch-failed', uri, str(e))
+                    Gdk.threads_leave()
+                    break
+
+                # Let clients know the media is now ready
                 Gdk.threads_enter()
                 self.emit('media-fetched', uri, filename, pbuf)
                 Gdk.threads_leave()
                 pbuf = None
             self.load_queue.task_done()
 
+    def emit_fetched(self, uri, pbuf):
+        """ Deliver a pixbuf from memory on the main loop """
+        self.emit('media-fetched', uri, self.get_cache_filename_full(uri),
+                  pbuf)
+        return False
+
     def begin_fetch(self):
         """ Main thread body function, will effectively run forever
             based on lock conditions
         """
         while True:
-            # Grab the next job and wipe from the cache
-            uri = self.queue.get()
+            # Grab the most urgent job
+            with self.worker_lock:
+                self.idle_workers += 1
+            job = self.queue.take(FETCH_IDLE_TIMEOUT)
+            with self.worker_lock:
+                self.idle_workers -= 1
+                if job is None:
+                    if self.workers > 1:
+                        self.workers -= 1
+                        return
+                    continue
+            uri = job.uri
 
             local_file = self.get_cache_filename_full(uri)
             fail = False
             try:
                 self.fetch_pixbuf(uri, local_file)
             except Exception as e:
+                self.queue.finish(uri)
                 Gdk.threads_enter()
                 self.emit('fetch-failed', uri, str(e))
                 Gdk.threads_leave()
                 print("Failed to fetch {}: {}".format(uri, e))
                 fail = True
+            self.queue.release(job)
 
-            # Request load on the main load thread
+            # Request load on the main load thread, the job stays pending
+            # until it's loaded so late requests are coalesced into it
             if not fail:
                 self.load_queue.put(uri)
 
-            # Clean up the fetch state
-            with self.cache_lock:
-                del self.cache[uri]
-            self.queue.task_done()
-
-    def fetch_media(self, uri):
-        """ Request background fetch of the given media """
-        if self.is_media_pending(uri):
-            return
-        with self.cache_lock:
-            self.cache[uri] = True
-        self.queue.put(uri)
+    def fetch_media(self, uri, priority=MEDIA_PRIORITY_VISIBLE_MAIN,
+                    width=-1, height=-1):
+        """ Request background fetch of the given media, returning the
+            ScMediaRequest handle for it. Every request for the same URI
+            shares a single fetch and load.
+
+            The media is decoded at width x height (preserving the aspect
+            ratio) unless they're -1. With a width of 0 the media is only
+            downloaded and media-fetched isn't emitted. """
+        if width != 0:
+            pbuf = self.pixbufs.get((uri, width, height))
+            if pbuf is not None:
+                GLib.idle_add(self.emit_fetched, uri, pbuf)
+                return ScMediaRequest(self.queue, uri, priority, width,
+                                      height)
+        req = self.queue.request(uri, priority, width, height)
+        self.maybe_spawn_worker()
+        return req
@@ -0,0 +1,155 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+import httplib
+import socket
+import threading
+import urlparse
+
+
+# Seconds before we give up on a stalled connection
+HTTP_TIMEOUT = 30
+
+# Idle connections we keep around for each host
+HTTP_MAX_IDLE = 4
+
+# Redirects we'll follow before giving up
+HTTP_MAX_REDIRECTS = 5
+
+# Size of the chunks we stream to disk
+HTTP_CHUNK_SIZE = 64 * 1024
+
+HTTP_USER_AGENT = "solus-sc"
+
+
+class ScHttpError(Exception):
+    """ The server didn't give us what we asked for """
+
+    status = 0
+
+    def __init__(self, status, reason):
+        Exception.__init__(self, "HTTP {}: {}".format(status, reason))
+        self.status = status
+
+
+class ScHttpPool:
+    """ ScHttpPool keeps persistent keep-alive connections to each host
+
+        Screenshot hosts serve many small images per application, so the
+        connection setup would otherwise dominate the fetch time. Idle
+        connections are handed out to whichever thread asks next, and a
+        connection that went stale while idle is transparently replaced.
+    """
+
+    # (scheme, host, port) -> [connection]
+    idle = None
+    lock = None
+
+    def __init__(self):
+        self.idle = dict()
+        self.lock = threading.Lock()
+
+    def get_connection(self, key):
+        """ Return an idle connection for the host, or a new one, and
+            whether it was reused """
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return (conns.pop(), True)
+        (scheme, host, port) = key
+        if scheme == "https":
+            return (httplib.HTTPSConnection(host, port,
+                                            timeout=HTTP_TIMEOUT), False)
+        return (httplib.HTTPConnection(host, port,
+                                       timeout=HTTP_TIMEOUT), False)
+
+    def release(self, key, conn):
+        """ Hand a connection back for reuse """
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < HTTP_MAX_IDLE:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def request(self, key, path, headers):
+        """ Perform the request, retrying once on a fresh connection if a
+            reused one turns out to have been closed by the server """
+        (conn, reused) = self.get_connection(key)
+        try:
+            conn.request("GET", path, headers=headers)
+            return (conn, conn.getresponse())
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            if not reused:
+                raise
+        (conn, reused) = self.get_connection(key)
+        try:
+            conn.request("GET", path, headers=headers)
+            return (conn, conn.getresponse())
+        except Exception:
+            conn.close()
+            raise
+
+    def fetch(self, url, out, headers=None, progress=None):
+        """ GET the URL, streaming the body to the out file object
+
+            Returns the final status (200 or 304) and the response headers
+            as a dict of lowercase names. Anything else raises. If given,
+            progress is called with the size of each chunk written. """
+        sent = {"User-Agent": HTTP_USER_AGENT}
+        if headers:
+            sent.update(headers)
+
+        for i in range(HTTP_MAX_REDIRECTS + 1):
+            parts = urlparse.urlsplit(url)
+            if parts.scheme not in ["http", "https"]:
+                raise ValueError("Unsupported URL: {}".format(url))
+            port = parts.port
+            if port is None:
+                port = 443 if parts.scheme == "https" else 80
+            key = (parts.scheme, parts.hostname, port)
+            path = parts.path or "/"
+            if parts.query:
+                path = "{}?{}".format(path, parts.query)
+
+            (conn, resp) = self.request(key, path, sent)
+            try:
+                if resp.status in [301, 302, 303, 307, 308]:
+                    resp.read()
+                    url = urlparse.urljoin(url, resp.getheader("location"))
+                elif resp.status == 200:
+                    while True:
+                        chunk = resp.read(HTTP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        if progress is not None:
+                            progress(len(chunk))
+                else:
+                    resp.read()
+            except Exception:
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self.release(key, conn)
+
+            if resp.status in [200, 304]:
+                return (resp.status, dict(resp.getheaders()))
+            if resp.status not in [301, 302, 303, 307, 308]:
+                raise ScHttpError(resp.status, resp.reason)
+
+        raise ScHttpError(0, "Too many redirects")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+
+from collections import OrderedDict
+import threading
+
+
+class LruCache:
+    """ LruCache is a thread-safe least-recently-used cache that is bounded
+        by the total size of its values, as reported by the sizeof function
+    """
+
+    entries = None
+    lock = None
+    sizeof = None
+    max_bytes = 0
+    total_bytes = 0
+
+    def __init__(self, max_bytes, sizeof):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.sizeof = sizeof
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+
+    def get(self, key):
+        """ Return the value for key (marking it as recently used) or None """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value):
+        """ Store a value, evicting the least recently used entries until
+            we're back within our size limit """
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            # Never going to fit, don't flush everything else for it
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                (old, entry) = self.entries.popitem(last=False)
+                self.total_bytes -= entry[1]
+
+    def remove(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+    def remove_matching(self, func):
+        """ Remove every entry whose key satisfies func """
+        with self.lock:
+            for key in [x for x in self.entries if func(x)]:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from . import ensure_dir, atomic_write
+import mmap
+import os
+import struct
+import threading
+
+
+# Bump this whenever the on-disk layout changes
+MAPPED_MAGIC = "SCMAP001"
+
+# magic, key length, field count, record count
+MAPPED_HEADER = struct.Struct("<8sIII")
+
+# Used both for the record offset table and the field lengths
+MAPPED_UINT = struct.Struct("<I")
+
+
+def _encode(value):
+    """ Everything on disk is a UTF-8 string """
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+class MappedIndexWriter:
+    """ Build a MappedIndex file on disk
+
+        Records are sorted by their first field (the name) so that readers
+        can bisect the offset table without loading the entire file.
+    """
+
+    path = None
+    key = None
+    record_type = None
+    records = None
+
+    def __init__(self, path, key, record_type):
+        self.path = path
+        self.key = _encode(key)
+        self.record_type = record_type
+        self.records = dict()
+
+    def add(self, record):
+        """ Add a record (a tuple of record_type fields) to the index """
+        fields = [_encode(x) for x in record]
+        if len(fields) != len(self.record_type._fields):
+            raise RuntimeError("Invalid field count for record: {}".format(
+                fields[0]))
+        self.records[fields[0]] = fields
+
+    def write(self):
+        """ Write the index out, atomically replacing any older index """
+        dirn = os.path.dirname(self.path)
+        if not ensure_dir(dirn):
+            return False
+
+        names = sorted(self.records.keys())
+        nfields = len(self.record_type._fields)
+        blobs = []
+        for name in names:
+            fields = self.records[name]
+            blobs.append("".join(
+                MAPPED_UINT.pack(len(x)) + x for x in fields))
+
+        # Records begin after the header, key and offset table
+        offset = MAPPED_HEADER.size + len(self.key) + \
+            MAPPED_UINT.size * len(names)
+        offsets = []
+        for blob in blobs:
+            offsets.append(MAPPED_UINT.pack(offset))
+            offset += len(blob)
+
+        def write_index(out):
+            out.write(MAPPED_HEADER.pack(MAPPED_MAGIC, len(self.key),
+                                         nfields, len(names)))
+            out.write(self.key)
+            out.write("".join(offsets))
+            for blob in blobs:
+                out.write(blob)
+
+        try:
+            atomic_write(self.path, write_index)
+        except Exception as e:
+            print("Unable to write index {}: {}".format(self.path, e))
+            return False
+        return True
+
+
+class MappedIndex:
+    """ MappedIndex provides lazy, read-only access to a compact on-disk
+        table of string records
+
+        The file is memory-mapped on first access, and only the records that
+        are actually requested are ever decoded. The index is only considered
+        valid when the key stored in the file matches the key we expect, so
+        the caller can use something like a checksum or mtime to invalidate
+        the index.
+    """
+
+    path = None
+    key = None
+    record_type = None
+
+    mapping = None
+    count = 0
+    table = 0
+    loaded = False
+    load_lock = None
+
+    def __init__(self, path, key, record_type):
+        self.path = path
+        self.key = _encode(key)
+        self.record_type = record_type
+        self.load_lock = threading.Lock()
+
+    def load(self):
+        """ Map the file into memory if we haven't done so yet. Returns
+            True if the index is usable """
+        with self.load_lock:
+            if self.loaded:
+                return self.mapping is not None
+            self.loaded = True
+            try:
+                self.mapping = self.map_file()
+            except Exception as e:
+                print("Unable to map index {}: {}".format(self.path, e))
+                self.mapping = None
+            return self.mapping is not None
+
+    def map_file(self):
+        """ Open and validate the index file """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as inp:
+            size = os.fstat(inp.fileno()).st_size
+            if size < MAPPED_HEADER.size:
+                return None
+            mapping = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, keylen, nfields, count) = MAPPED_HEADER.unpack_from(mapping)
+        end = MAPPED_HEADER.size + keylen
+        if magic != MAPPED_MAGIC or \
+                nfields != len(self.record_type._fields) or \
+                mapping[MAPPED_HEADER.size:end] != self.key:
+            mapping.close()
+            return None
+        self.count = count
+        self.table = end
+        return mapping
+
+    def close(self):
+        """ Drop the mapping, the next access will map it again """
+        with self.load_lock:
+            if self.mapping is not None:
+                self.mapping.close()
+            self.mapping = None
+            self.loaded = False
+            self.count = 0
+
+    def is_valid(self):
+        return self.load()
+
+    def _field_at(self, offset):
+        """ Return the field at offset and the offset of the next field """
+        (length,) = MAPPED_UINT.unpack_from(self.mapping, offset)
+        offset += MAPPED_UINT.size
+        return (self.mapping[offset:offset + length], offset + length)
+
+    def _record_offset(self, idx):
+        pos = self.table + idx * MAPPED_UINT.size
+        return MAPPED_UINT.unpack_from(self.mapping, pos)[0]
+
+    def _name_at(self, idx):
+        return self._field_at(self._record_offset(idx))[0]
+
+    def _record_at(self, idx):
+        offset = self._record_offset(idx)
+        fields = []
+        for i in range(len(self.record_type._fields)):
+            (field, offset) = self._field_at(offset)
+            fields.append(field)
+        return self.record_type(*fields)
+
+    def _find(self, name):
+        """ Bisect the offset table for the given name """
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_at(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._name_at(lo) == name:
+            return lo
+        return -1
+
+    def get(self, name):
+        """ Return the record for name, or None if it isn't known """
+        if not self.load():
+            return None
+        idx = self._find(_encode(name))
+        if idx < 0:
+            return None
+        return self._record_at(idx)
+
+    def __contains__(self, name):
+        if not self.load():
+            return False
+        return self._find(_encode(name)) >= 0
+
+    def __len__(self):
+        if not self.load():
+            return 0
+        return self.count
+
+    def names(self):
+        """ Iterate all names in sorted order """
+        if not self.load():
+            return
+        for i in xrange(self.count):
+            yield self._name_at(i)
+
+    def records(self):
+        """ Iterate all records in sorted order """
+        if not self.load():
+            return
+        for i in xrange(self.count):
+            yield self._record_at(i)
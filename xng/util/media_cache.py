@@ -0,0 +1,300 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from . import ensure_dir, get_user_cache_dir, atomic_write
+import json
+import os
+import threading
+import time
+
+
+# Name of the index within the media directory
+MEDIA_INDEX = "index.json"
+
+# Failed fetch records, see media_failures
+MEDIA_FAILURES = "failures.json"
+
+# Bump whenever the index layout changes
+MEDIA_INDEX_VERSION = 1
+
+# Once over the cap we evict down to this fraction of it, so that we're not
+# evicting again on the very next download
+EVICT_LOW_WATER = 0.9
+
+# Seconds between index writes when entries have changed
+SAVE_INTERVAL = 30
+
+# Temporary files older than this are leftovers from an interrupted write
+STALE_TEMP_AGE = 3600
+
+
+class ScMediaEntry:
+    """ Metadata for a single file in the media cache """
+
+    url = None
+    size = 0
+    atime = 0
+
+    # HTTP validators, and when we last fetched or revalidated the file
+    etag = None
+    modified = None
+    fetched = 0
+
+    def __init__(self, url, size, atime, etag=None, modified=None,
+                 fetched=0):
+        self.url = url
+        self.size = size
+        self.atime = atime
+        self.etag = etag
+        self.modified = modified
+        self.fetched = fetched
+
+
+class ScMediaCache:
+    """ ScMediaCache manages the on-disk media (screenshot) cache
+
+        An index of every cached file, with its size, last access time and
+        source URL is kept in memory and stored alongside the media. This
+        lets us answer "is it local?" without hitting the disk, and keep the
+        directory within a configurable size by evicting the least recently
+        used files.
+
+        On startup the maintenance thread sweeps the directory to bring the
+        index back in line with what is actually on disk, then takes care of
+        eviction and writing the index out in the background.
+    """
+
+    path = None
+    index_path = None
+
+    # filename -> ScMediaEntry
+    entries = None
+    total_bytes = 0
+    max_bytes = 0
+
+    lock = None
+    wakeup = None
+    dirty = False
+
+    def __init__(self, max_bytes):
+        self.path = get_user_cache_dir("media")
+        self.index_path = os.path.join(self.path, MEDIA_INDEX)
+        self.entries = dict()
+        self.total_bytes = 0
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        ensure_dir(self.path)
+        self.load()
+
+        t = threading.Thread(target=self.maintain)
+        t.daemon = True
+        t.start()
+
+    def get_filename(self, name):
+        """ Return the full path for a cache filename """
+        return os.path.join(self.path, name)
+
+    def load(self):
+        """ Load the stored index, trusting it until the sweep runs """
+        try:
+            with open(self.index_path, "r") as inp:
+                data = json.load(inp)
+        except Exception:
+            return
+        if data.get("version") != MEDIA_INDEX_VERSION:
+            return
+        for name, meta in data.get("entries", {}).iteritems():
+            entry = ScMediaEntry(meta["url"], meta["size"], meta["atime"],
+                                 meta.get("etag"), meta.get("modified"),
+                                 meta.get("fetched", meta["atime"]))
+            self.entries[name] = entry
+            self.total_bytes += entry.size
+
+    def save(self):
+        """ Atomically write the index out """
+        with self.lock:
+            entries = dict((k, {"url": v.url,
+                                "size": v.size,
+                                "atime": v.atime,
+                                "etag": v.etag,
+                                "modified": v.modified,
+                                "fetched": v.fetched})
+                           for k, v in self.entries.iteritems())
+            self.dirty = False
+        try:
+            atomic_write(self.index_path, json.dumps(
+                {"version": MEDIA_INDEX_VERSION, "entries": entries}))
+        except Exception as e:
+            print("Unable to write media index {}: {}".format(
+                self.index_path, e))
+
+    def lookup(self, name):
+        """ Return the full path if the file is cached, marking it as
+            recently used, otherwise None """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            entry.atime = time.time()
+            self.dirty = True
+        return self.get_filename(name)
+
+    def add(self, name, url, etag=None, modified=None):
+        """ Record a newly stored file in the index """
+        try:
+            size = os.stat(self.get_filename(name)).st_size
+        except Exception as e:
+            print("Unable to add {} to media cache: {}".format(name, e))
+            return
+        now = time.time()
+        with self.lock:
+            old = self.entries.get(name)
+            if old is not None:
+                self.total_bytes -= old.size
+            self.entries[name] = ScMediaEntry(url, size, now, etag, modified,
+                                              now)
+            self.total_bytes += size
+            self.dirty = True
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.wakeup.set()
+
+    def needs_revalidation(self, name, max_age):
+        """ Return (url, etag, modified) if the file is older than max_age
+            seconds and can be revalidated, otherwise None """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry.url is None:
+                return None
+            if time.time() - entry.fetched < max_age:
+                return None
+            return (entry.url, entry.etag, entry.modified)
+
+    def mark_validated(self, name, etag, modified):
+        """ The server says our copy is still current """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return
+            entry.fetched = time.time()
+            if etag:
+                entry.etag = etag
+            if modified:
+                entry.modified = modified
+            self.dirty = True
+
+    def forget_matching(self, func):
+        """ Drop every file whose name satisfies func """
+        with self.lock:
+            names = [x for x in self.entries if func(x)]
+        for name in names:
+            self.forget(name)
+
+    def forget(self, name):
+        """ Drop a file from the cache, i.e. because it failed to load """
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is None:
+                return
+            self.total_bytes -= entry.size
+            self.dirty = True
+        self.unlink(name)
+
+    def set_max_bytes(self, max_bytes):
+        """ Update the size cap, evicting in the background if needed """
+        with self.lock:
+            self.max_bytes = max_bytes
+        self.wakeup.set()
+
+    def unlink(self, name):
+        try:
+            os.unlink(self.get_filename(name))
+        except Exception as e:
+            print("Unable to remove cached media {}: {}".format(name, e))
+
+    def sweep(self):
+        """ Reconcile the index with the files actually on disk """
+        started = time.time()
+        try:
+            files = os.listdir(self.path)
+        except Exception as e:
+            print("Unable to sweep media cache: {}".format(e))
+            return
+        found = dict()
+        for name in files:
+            if name in [MEDIA_INDEX, MEDIA_FAILURES]:
+                continue
+            full = self.get_filename(name)
+            try:
+                st = os.stat(full)
+            except Exception:
+                continue
+            # Leftovers from an interrupted download or index write
+            if name.startswith("."):
+                if time.time() - st.st_mtime < STALE_TEMP_AGE:
+                    continue
+                try:
+                    os.unlink(full)
+                except Exception:
+                    pass
+                continue
+            found[name] = st
+
+        with self.lock:
+            for name in self.entries.keys():
+                # Stored since we listed the directory
+                if self.entries[name].atime > started:
+                    continue
+                st = found.get(name)
+                if st is None or st.st_size != self.entries[name].size:
+                    self.total_bytes -= self.entries.pop(name).size
+                    self.dirty = True
+            # Adopt untracked files so they're subject to eviction, we
+            # no longer know the URL
+            for name, st in found.iteritems():
+                if name in self.entries:
+                    continue
+                self.entries[name] = ScMediaEntry(None, st.st_size,
+                                                  st.st_atime)
+                self.total_bytes += st.st_size
+                self.dirty = True
+
+    def evict(self):
+        """ Remove the least recently used files until we're back under
+            the low water mark """
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            target = int(self.max_bytes * EVICT_LOW_WATER)
+            victims = []
+            for name in sorted(self.entries,
+                               key=lambda x: self.entries[x].atime):
+                if self.total_bytes <= target:
+                    break
+                self.total_bytes -= self.entries.pop(name).size
+                victims.append(name)
+            self.dirty = True
+        for name in victims:
+            self.unlink(name)
+
+    def maintain(self):
+        """ Maintenance thread body, will effectively run forever """
+        self.sweep()
+        while True:
+            self.evict()
+            if self.dirty:
+                self.save()
+            self.wakeup.wait(SAVE_INTERVAL)
+            self.wakeup.clear()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from . import atomic_write
+from .http import ScHttpError
+import httplib
+import json
+import socket
+import threading
+import time
+import urlparse
+
+
+# Bump whenever the stored layout changes
+FAILURES_VERSION = 1
+
+# Backoff for a single URI, doubled on each failure: 1 minute up to a day
+URI_BACKOFF_BASE = 60
+URI_BACKOFF_MAX = 24 * 60 * 60
+
+# Backoff for an unreachable host: 30 seconds up to an hour
+HOST_BACKOFF_BASE = 30
+HOST_BACKOFF_MAX = 60 * 60
+
+# Records are forgotten entirely once this long has passed since the last
+# failure, so a fixed URL gets a clean slate
+FAILURE_TTL = 7 * 24 * 60 * 60
+
+
+def is_remote_failure(error):
+    """ Determine if the error came from the server or the network, rather
+        than i.e. our own disk running out of space """
+    return isinstance(error, (ScHttpError, socket.error,
+                              httplib.HTTPException))
+
+
+def get_host(uri):
+    try:
+        return urlparse.urlsplit(uri).netloc
+    except Exception:
+        return None
+
+
+class ScFailureRecord:
+    """ Failure count and backoff for a single URI or host """
+
+    count = 0
+    last = 0
+    until = 0
+
+    def __init__(self, count, last, until):
+        self.count = count
+        self.last = last
+        self.until = until
+
+
+class ScMediaFailures:
+    """ ScMediaFailures remembers which media couldn't be fetched
+
+        A failed URI isn't requested again until its backoff expires, and
+        the backoff doubles with each consecutive failure. If we couldn't
+        reach the host at all, every URI on that host is held back too.
+        The records are stored alongside the media cache so that dead
+        screenshot links don't cost a network round-trip on every start.
+    """
+
+    path = None
+
+    # uri -> ScFailureRecord
+    uris = None
+
+    # netloc -> ScFailureRecord
+    hosts = None
+
+    lock = None
+
+    def __init__(self, path):
+        self.path = path
+        self.uris = dict()
+        self.hosts = dict()
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """ Load the stored records, dropping any that have expired """
+        try:
+            with open(self.path, "r") as inp:
+                data = json.load(inp)
+        except Exception:
+            return
+        if data.get("version") != FAILURES_VERSION:
+            return
+        now = time.time()
+        for (stored, target) in [(data.get("uris", {}), self.uris),
+                                 (data.get("hosts", {}), self.hosts)]:
+            for key, (count, last, until) in stored.iteritems():
+                if now - last < FAILURE_TTL:
+                    target[key] = ScFailureRecord(count, last, until)
+
+    def save(self):
+        """ Atomically write the records out, must hold the lock """
+        data = {
+            "version": FAILURES_VERSION,
+            "uris": dict((k, [v.count, v.last, v.until])
+                         for k, v in self.uris.iteritems()),
+            "hosts": dict((k, [v.count, v.last, v.until])
+                          for k, v in self.hosts.iteritems()),
+        }
+        try:
+            atomic_write(self.path, json.dumps(data))
+        except Exception as e:
+            print("Unable to write {}: {}".format(self.path, e))
+
+    def get_record(self, table, key, now):
+        """ Return the live record for key, or None """
+        record = table.get(key)
+        if record is None:
+            return None
+        if now - record.last >= FAILURE_TTL:
+            del table[key]
+            return None
+        return record
+
+    def check(self, uri):
+        """ Return the reason we shouldn't fetch the URI right now, or None
+            if we're free to try """
+        now = time.time()
+        with self.lock:
+            record = self.get_record(self.uris, uri, now)
+            if record is not None and record.until > now:
+                return "Fetch failed recently, retrying in {}s".format(
+                    int(record.until - now))
+            record = self.get_record(self.hosts, get_host(uri), now)
+            if record is not None and record.until > now:
+                return "Host unreachable, retrying in {}s".format(
+                    int(record.until - now))
+        return None
+
+    def bump(self, table, key, base, limit, now):
+        record = self.get_record(table, key, now)
+        if record is None:
+            record = ScFailureRecord(0, now, now)
+            table[key] = record
+        record.count += 1
+        record.last = now
+        record.until = now + min(base * 2 ** (record.count - 1), limit)
+
+    def record_failure(self, uri, error):
+        """ Back off from the URI, and from the host as well unless the
+            server actually answered us """
+        now = time.time()
+        host = get_host(uri)
+        with self.lock:
+            self.bump(self.uris, uri, URI_BACKOFF_BASE, URI_BACKOFF_MAX, now)
+            if isinstance(error, ScHttpError):
+                self.hosts.pop(host, None)
+            elif host:
+                self.bump(self.hosts, host, HOST_BACKOFF_BASE,
+                          HOST_BACKOFF_MAX, now)
+            self.save()
+
+    def record_success(self, uri):
+        """ Forget any failures for the URI and its host """
+        host = get_host(uri)
+        with self.lock:
+            if uri not in self.uris and host not in self.hosts:
+                return
+            self.uris.pop(uri, None)
+            self.hosts.pop(host, None)
+            self.save()
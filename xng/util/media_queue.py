@@ -0,0 +1,243 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+import heapq
+import threading
+import time
+
+
+# Priority classes, lower values are served first
+MEDIA_PRIORITY_VISIBLE_MAIN = 0
+MEDIA_PRIORITY_VISIBLE_THUMBNAIL = 1
+MEDIA_PRIORITY_PREFETCH = 2
+
+
+class ScMediaRequest:
+    """ Handle for a single request of a URI, owned by whoever asked for it
+
+        Views hold on to these so that they can cancel or demote requests
+        when the user moves on, i.e. switching to another application.
+    """
+
+    queue = None
+    uri = None
+    priority = None
+    cancelled = False
+
+    # Size to decode at, -1 for the original size and 0 to only download
+    width = -1
+    height = -1
+
+    def __init__(self, queue, uri, priority, width=-1, height=-1):
+        self.queue = queue
+        self.uri = uri
+        self.priority = priority
+        self.cancelled = False
+        self.width = width
+        self.height = height
+
+    def cancel(self):
+        """ We no longer want this URI """
+        self.queue.cancel_request(self)
+
+    def set_priority(self, priority):
+        """ Promote or demote the request """
+        self.queue.set_request_priority(self, priority)
+
+
+class ScMediaJob:
+    """ All requests for a single URI, coalesced into one job """
+
+    uri = None
+    requests = None
+    priority = None
+
+    # Taken by a worker, no longer in the heap
+    running = False
+
+    # Priority the job was taken at, for the concurrency limits
+    taken_priority = None
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.requests = []
+        self.running = False
+
+    def update_priority(self):
+        """ The job runs at the most urgent priority of its requests """
+        self.priority = min(x.priority for x in self.requests)
+
+
+class ScMediaQueue:
+    """ ScMediaQueue schedules media jobs by priority class
+
+        Within a class the most recent request wins, so that whatever the
+        user just navigated to is served first. Multiple requests for the
+        same URI share a single job, which is dropped as soon as every
+        request for it has been cancelled.
+
+        A priority class may be limited to a number of concurrently running
+        jobs, i.e. so that prefetching never occupies every worker.
+    """
+
+    # uri -> ScMediaJob
+    jobs = None
+
+    # (priority, -seq, uri), may contain stale entries
+    heap = None
+    seq = 0
+
+    cond = None
+
+    # priority -> maximum running jobs, and the current running counts
+    limits = None
+    running = None
+
+    def __init__(self):
+        self.jobs = dict()
+        self.heap = []
+        self.seq = 0
+        self.cond = threading.Condition(threading.Lock())
+        self.limits = dict()
+        self.running = dict()
+
+    def set_limit(self, priority, limit):
+        """ Limit how many jobs of a priority class may run at once """
+        with self.cond:
+            self.limits[priority] = limit
+            self.cond.notify_all()
+
+    def is_limited(self, priority):
+        """ Determine if the class is at its limit, must hold the lock """
+        limit = self.limits.get(priority)
+        return limit is not None and self.running.get(priority, 0) >= limit
+
+    def push(self, job):
+        """ Queue the job at its current priority, must hold the lock """
+        self.seq += 1
+        heapq.heappush(self.heap, (job.priority, -self.seq, job.uri))
+        self.cond.notify()
+
+    def request(self, uri, priority, width=-1, height=-1):
+        """ Request the URI, returning the new ScMediaRequest """
+        with self.cond:
+            req = ScMediaRequest(self, uri, priority, width, height)
+            job = self.jobs.get(uri)
+            if job is None:
+                job = ScMediaJob(uri)
+                self.jobs[uri] = job
+            old = job.priority
+            job.requests.append(req)
+            job.update_priority()
+            # New, promoted, or needs to jump ahead of its class again
+            if not job.running and (old is None or job.priority <= old):
+                self.push(job)
+            return req
+
+    def pop_runnable(self):
+        """ Pop the most urgent job we're allowed to run, must hold the
+            lock. Entries held back by a limit stay in the heap. """
+        deferred = []
+        ret = None
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            (priority, seq, uri) = entry
+            job = self.jobs.get(uri)
+            if job is None or job.running or priority != job.priority:
+                continue
+            if self.is_limited(priority):
+                deferred.append(entry)
+                continue
+            ret = job
+            break
+        for entry in deferred:
+            heapq.heappush(self.heap, entry)
+        return ret
+
+    def take(self, timeout=None):
+        """ Block until a job is available and mark it running, returning
+            None if nothing turned up within the timeout """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                job = self.pop_runnable()
+                if job is not None:
+                    job.running = True
+                    job.taken_priority = job.priority
+                    self.running[job.priority] = \
+                        self.running.get(job.priority, 0) + 1
+                    return job
+                if deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def release(self, job):
+        """ The worker is done with the job, freeing its slot """
+        with self.cond:
+            self.running[job.taken_priority] -= 1
+            self.cond.notify_all()
+
+    def count_queued(self):
+        """ Number of jobs a worker could take right now """
+        with self.cond:
+            return len([x for x in self.jobs.itervalues()
+                        if not x.running and not self.is_limited(x.priority)])
+
+    def is_pending(self, uri):
+        with self.cond:
+            return uri in self.jobs
+
+    def finish(self, uri):
+        """ The job is complete, returning the requests to notify """
+        with self.cond:
+            job = self.jobs.pop(uri, None)
+            if job is None:
+                return []
+            return job.requests
+
+    def cancel_request(self, req):
+        with self.cond:
+            if req.cancelled:
+                return
+            req.cancelled = True
+            job = self.jobs.get(req.uri)
+            if job is None or req not in job.requests:
+                return
+            job.requests.remove(req)
+            if job.requests:
+                old = job.priority
+                job.update_priority()
+                if not job.running and job.priority != old:
+                    self.push(job)
+            elif not job.running:
+                # Stale heap entries are skipped in take()
+                del self.jobs[req.uri]
+
+    def set_request_priority(self, req, priority):
+        with self.cond:
+            if req.cancelled or req.priority == priority:
+                return
+            req.priority = priority
+            job = self.jobs.get(req.uri)
+            if job is None:
+                return
+            old = job.priority
+            job.update_priority()
+            if not job.running and job.priority != old:
+                self.push(job)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+
+import Queue
+import threading
+
+
+class ScWorkerPool:
+    """ ScWorkerPool runs jobs on a small, fixed set of daemon threads
+
+        Jobs are plain callables and run in submission order. Anything that
+        needs to touch the UI with the result must go via GLib.idle_add.
+    """
+
+    name = None
+    queue = None
+
+    def __init__(self, name, threadCount):
+        self.name = name
+        self.queue = Queue.Queue(0)
+        for i in range(threadCount):
+            t = threading.Thread(target=self.run_jobs,
+                                 name="{}-{}".format(name, i))
+            t.daemon = True
+            t.start()
+
+    def submit(self, func, *args):
+        """ Queue a job for one of the worker threads """
+        self.queue.put((func, args))
+
+    def run_jobs(self):
+        """ Worker thread body, will effectively run forever """
+        while True:
+            (func, args) = self.queue.get()
+            try:
+                func(*args)
+            except Exception as e:
+                print("{}: job failed: {}".format(self.name, e))
+            self.queue.task_done()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  This file is part of solus-sc
+#
+#  Copyright © 2017-2018 Ikey Doherty <ikey@solus-project.com>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+
+from . import ensure_dir, atomic_write
+import bisect
+import marshal
+import os
+import re
+
+
+# Split on anything that isn't a letter or digit, so that "gnome-mpv",
+# "gnome_mpv" and "gnome mpv" all tokenize the same way.
+TOKEN_SPLIT = re.compile(r"[\W_]+", re.UNICODE)
+
+# Bump whenever the serialised layout changes
+SEARCH_INDEX_VERSION = 1
+
+# Relative weights for the various kinds of token match
+MATCH_EXACT = 1.0
+MATCH_PREFIX = 0.6
+MATCH_FUZZY = 0.3
+
+# Minimum trigram similarity before we consider a token a fuzzy match
+FUZZY_THRESHOLD = 0.4
+
+# Boosts applied for whole-name matches, which always rank first
+BOOST_NAME_EXACT = 1000.0
+BOOST_NAME_PREFIX = 100.0
+
+
+def _unicode(text):
+    if text is None:
+        return u""
+    if isinstance(text, unicode):
+        return text
+    return str(text).decode("utf-8", "replace")
+
+
+def tokenize(text):
+    """ Split text into lowercase search tokens """
+    return [x for x in TOKEN_SPLIT.split(_unicode(text).lower()) if x]
+
+
+def trigrams(token):
+    """ Return the set of trigrams for a token, padded at both ends """
+    padded = u"${}$".format(token)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class SearchIndex:
+    """ SearchIndex is a tokenized inverted index over a set of documents
+
+        Each document has a name and any number of weighted text fields.
+        Queries support exact, prefix and trigram (fuzzy) token matching,
+        and results are ranked by relevance with exact name matches first.
+    """
+
+    # token -> {doc: weight}
+    postings = None
+
+    # doc -> normalised name
+    names = None
+
+    # Sorted token list for prefix lookups
+    vocabulary = None
+
+    # trigram -> [tokens]
+    grams = None
+
+    def __init__(self):
+        self.postings = dict()
+        self.names = dict()
+        self.vocabulary = []
+        self.grams = dict()
+
+    def add_document(self, doc, name, fields):
+        """ Add a document with a list of (text, weight) fields """
+        self.names[doc] = u"-".join(tokenize(name))
+        for text, weight in fields:
+            for token in tokenize(text):
+                docs = self.postings.setdefault(token, dict())
+                docs[doc] = max(docs.get(doc, 0.0), weight)
+
+    def finish(self):
+        """ Build the lookup tables once all documents are added """
+        self.vocabulary = sorted(self.postings.keys())
+        self.grams = dict()
+        for token in self.vocabulary:
+            if len(token) < 3:
+                continue
+            for gram in trigrams(token):
+                self.grams.setdefault(gram, []).append(token)
+
+    def match_token(self, query):
+        """ Return {doc: score} for a single query token """
+        hits = dict()
+
+        def merge(token, factor):
+            for doc, weight in self.postings[token].iteritems():
+                score = weight * factor
+                if score > hits.get(doc, 0.0):
+                    hits[doc] = score
+
+        if query in self.postings:
+            merge(query, MATCH_EXACT)
+
+        i = bisect.bisect_left(self.vocabulary, query)
+        while i < len(self.vocabulary):
+            token = self.vocabulary[i]
+            if not token.startswith(query):
+                break
+            if token != query:
+                merge(token, MATCH_PREFIX)
+            i += 1
+
+        if hits or len(query) < 3:
+            return hits
+
+        # Nothing direct, fall back to trigram similarity
+        qgrams = trigrams(query)
+        shared = dict()
+        for gram in qgrams:
+            for token in self.grams.get(gram, []):
+                shared[token] = shared.get(token, 0) + 1
+        for token, count in shared.iteritems():
+            # A padded token has one trigram per character
+            total = len(qgrams) + len(token) - count
+            similarity = float(count) / total
+            if similarity >= FUZZY_THRESHOLD:
+                merge(token, MATCH_FUZZY * similarity)
+        return hits
+
+    def search(self, term):
+        """ Return matching documents, most relevant first """
+        query = tokenize(term)
+        if not query:
+            return []
+
+        scores = None
+        for token in query:
+            hits = self.match_token(token)
+            if scores is None:
+                scores = hits
+            else:
+                # Every token has to match somewhere
+                scores = dict((doc, score + hits[doc])
+                              for doc, score in scores.iteritems()
+                              if doc in hits)
+            if not scores:
+                return []
+
+        whole = u"-".join(query)
+        for doc in scores:
+            name = self.names[doc]
+            if name == whole:
+                scores[doc] += BOOST_NAME_EXACT
+            elif name.startswith(whole):
+                scores[doc] += BOOST_NAME_PREFIX
+
+        return sorted(scores, key=lambda x: (-scores[x],
+                                             len(self.names[x]),
+                                             x))
+
+    def save(self, path, key):
+        """ Store the index so it can be reloaded for the same key """
+        dirn = os.path.dirname(path)
+        if not ensure_dir(dirn):
+            return False
+        try:
+            atomic_write(path, marshal.dumps((SEARCH_INDEX_VERSION, key,
+                                              self.names, self.postings)))
+        except Exception as e:
+            print("Unable to write search index {}: {}".format(path, e))
+            return False
+        return True
+
+    @staticmethod
+    def load(path, key):
+        """ Load a stored index if it matches the key, or return None """
+        try:
+            with open(path, "rb") as inp:
+                (version, stored, names, postings) = marshal.load(inp)
+        except Exception:
+            return None
+        if version != SEARCH_INDEX_VERSION or stored != key:
+            return None
+        index = SearchIndex()
+        index.names = names
+        index.postings = postings
+        index.finish()
+        return index
@@ -17,6 +17,8 @@ from .home import ScHomeView
 from .categories import ScCategoriesView
 from .details import ScDetailsView
 from .featured import ScFeaturedEmbed
+from .op_queue import OperationType
+from .progress import ProgressPhase
 
 
 class LoadingPage(Gtk.VBox):
@@ -115,6 +117,16 @@ class ScMainWindow(Gtk.ApplicationWindow):
 
     featured = None
 
+    # Tells the user when an operation failed
+    info_bar = None
+    info_label = None
+
+    # Spins while the executor is applying operations
+    busy_spinner = None
+
+    # Progress of the operation being applied
+    progress_bar = None
+
     # Tracking
     context = None
     stack = None
@@ -139,6 +151,7 @@ class ScMainWindow(Gtk.ApplicationWindow):
         self.add(self.layout)
 
         self.build_search_bar()
+        self.build_info_bar()
         self.get_style_context().add_class("solus-sc")
 
         self.context = ScContext()
@@ -160,8 +173,75 @@ class ScMainWindow(Gtk.ApplicationWindow):
 
     def on_context_loaded(self, context):
         """ Initial load completed """
+        context.executor.connect('operation-finished',
+                                 self.on_operation_finished)
+        context.executor.connect('busy-changed', self.on_busy_changed)
+        for plugin in context.plugins:
+            plugin.progress.connect('progress', self.on_progress)
         GLib.idle_add(self.end_load)
 
+    def build_info_bar(self):
+        """ Build the (hidden) bar we report failed operations in """
+        self.info_bar = Gtk.InfoBar()
+        self.info_bar.set_message_type(Gtk.MessageType.ERROR)
+        self.info_bar.set_show_close_button(True)
+        self.info_bar.connect('response', self.on_info_response)
+        self.info_label = Gtk.Label()
+        self.info_label.set_line_wrap(True)
+        self.info_label.set_halign(Gtk.Align.START)
+        self.info_bar.get_content_area().add(self.info_label)
+        self.info_label.show()
+        self.info_bar.set_no_show_all(True)
+        self.layout.pack_start(self.info_bar, False, False, 0)
+
+    def on_busy_changed(self, executor, busy):
+        """ Show that work is happening in the background """
+        if busy:
+            self.busy_spinner.show()
+            self.busy_spinner.start()
+        else:
+            self.busy_spinner.stop()
+            self.busy_spinner.hide()
+            self.progress_bar.hide()
+
+    def on_progress(self, tracker, event):
+        """ Show how far along the current operation is """
+        if event.phase in [ProgressPhase.IDLE, ProgressPhase.FINISHED,
+                           ProgressPhase.FAILED]:
+            self.progress_bar.hide()
+            return
+        if event.phase == ProgressPhase.UPDATING_REPO:
+            text = _("Updating repositories")
+        elif event.phase == ProgressPhase.FETCHING:
+            text = _("Downloading {}")
+        elif event.phase in [ProgressPhase.REMOVING, ProgressPhase.REMOVED]:
+            text = _("Removing {}")
+        else:
+            text = _("Installing {}")
+        self.progress_bar.set_text(text.format(event.package or ""))
+        self.progress_bar.set_fraction(event.get_fraction())
+        self.progress_bar.show()
+
+    def on_info_response(self, bar, response, udata=None):
+        bar.hide()
+
+    def on_operation_finished(self, executor, op, success):
+        """ Let the user know why an operation didn't happen """
+        if success:
+            return
+        if op.opType == OperationType.INSTALL:
+            msg = _("Unable to install {}")
+        elif op.opType == OperationType.REMOVE:
+            msg = _("Unable to remove {}")
+        else:
+            msg = _("Unable to update {}")
+        text = msg.format(GLib.markup_escape_text(op.data.get_name()))
+        if op.error:
+            text = u"{}\n<small>{}</small>".format(
+                text, GLib.markup_escape_text(op.error))
+        self.info_label.set_markup(text)
+        self.info_bar.show()
+
     def end_load(self):
         self.set_current_page("home")
         self.loading.spinner.stop()
@@ -261,6 +341,16 @@ class ScMainWindow(Gtk.ApplicationWindow):
         self.updates_button = ScUpdatesButton()
         self.hbar.pack_end(self.updates_button)
 
+        self.busy_spinner = Gtk.Spinner()
+        self.busy_spinner.set_no_show_all(True)
+        self.hbar.pack_end(self.busy_spinner)
+
+        self.progress_bar = Gtk.ProgressBar()
+        self.progress_bar.set_show_text(True)
+        self.progress_bar.set_valign(Gtk.Align.CENTER)
+        self.progress_bar.set_no_show_all(True)
+        self.hbar.pack_end(self.progress_bar)
+
     def handle_key_event(self, w, e=None, d=None):
         """ Proxy window navigation events to the searchbar """
         return self.search_bar.handle_event(e)